@@ -0,0 +1,140 @@
+/*
+Upstream conditions of the emulated Etsy API - latency, injected errors, rate limiting, bandwidth
+(perf tests, see emu_core.js for the control API)
+
+  {
+    "latency": { "distribution": "fixed", "ms": 200 }
+             | { "distribution": "uniform", "min_ms": 100, "max_ms": 300 }
+             | { "distribution": "normal", "mean_ms": 200, "stddev_ms": 50 }
+             | { "distribution": "exponential", "mean_ms": 200 }
+             | [ { "method": "PUT", "url": "/v2/listings/[0-9]+", "distribution": ... }, ... ]
+                  -- per endpoint, the first rule matching method (optional) and url regex (optional)
+    "errors": [ { "method": "PUT", "url": "/v2/listings/[0-9]+", "rate": 0.05, "status": 503, "body": "..." } ],
+                  -- every matching rule fails the request with its probability
+    "rate_limit": { "per_second": 10, "burst": 10, "limit": 10000 },
+                  -- token bucket, requests over it get 429 with X-RateLimit-* and Retry-After headers
+    "bandwidth": { "bytes_per_second": 1000000 }
+                  -- all responses share the bandwidth, bodies are sent when their bytes "arrived"
+  }
+*/
+
+const DISTRIBUTIONS = ['fixed', 'uniform', 'normal', 'exponential'];
+const DEFAULT_ERROR_STATUS = 503;
+const DEFAULT_RATE_LIMIT = 10000;
+const RATE_LIMIT_BODY = 'You have exceeded your API limit\n';
+
+class Conditions {
+  constructor() {
+    this.set({});
+  }
+
+  // replace the conditions, reset the statistics - throws Error on invalid conditions
+  set(conditions) {
+    var latency = [].concat(conditions.latency || []);
+    for (var rule of latency) {
+      if (DISTRIBUTIONS.indexOf(rule.distribution) < 0) {
+        throw new Error('latency distribution must be one of ' + DISTRIBUTIONS.join(', '));
+      }
+    }
+    for (var rule of conditions.errors || []) {
+      if (!(rule.rate >= 0 && rule.rate <= 1)) {
+        throw new Error('error rate must be 0..1');
+      }
+    }
+    if (conditions.rate_limit && !(conditions.rate_limit.per_second > 0)) {
+      throw new Error('rate_limit.per_second must be > 0');
+    }
+    if (conditions.bandwidth && !(conditions.bandwidth.bytes_per_second > 0)) {
+      throw new Error('bandwidth.bytes_per_second must be > 0');
+    }
+
+    this.conditions = conditions;
+    this.latencyRules = latency;
+    this.tokens = conditions.rate_limit ? (conditions.rate_limit.burst || conditions.rate_limit.per_second) : 0;
+    this.tokensAt = Date.now();
+    this.bandwidthFreeAt = 0;
+    this.stats = { requests: 0, latency_ms: 0, errors: 0, rate_limited: 0, bytes: 0 };
+  }
+
+  matches(rule, method, urlPath) {
+    return (!rule.method || rule.method.toUpperCase() === method) &&
+      (!rule.url || urlPath.match('^' + rule.url + '$') !== null);
+  }
+
+  // ms the response of the request waits
+  latency(method, urlPath) {
+    var rule = this.latencyRules.find(rule => this.matches(rule, method, urlPath));
+    var ms = 0;
+    if (rule) {
+      switch (rule.distribution) {
+        case 'fixed':
+          ms = rule.ms;
+          break;
+        case 'uniform':
+          ms = rule.min_ms + Math.random() * (rule.max_ms - rule.min_ms);
+          break;
+        case 'normal':
+            // Box-Muller
+          ms = rule.mean_ms + rule.stddev_ms * Math.sqrt(-2 * Math.log(1 - Math.random())) * Math.cos(2 * Math.PI * Math.random());
+          break;
+        case 'exponential':
+          ms = -rule.mean_ms * Math.log(1 - Math.random());
+          break;
+      }
+    }
+    ms = Math.max(0, Math.round(ms || 0));
+    this.stats.latency_ms += ms;
+    return ms;
+  }
+
+  // rule of the error injected to the request, or undefined
+  error(method, urlPath) {
+    var rule = (this.conditions.errors || []).find(rule => this.matches(rule, method, urlPath) && Math.random() < rule.rate);
+    if (rule) {
+      this.stats.errors++;
+      return { status: rule.status || DEFAULT_ERROR_STATUS, body: rule.body || 'Injected error\n' };
+    }
+    return undefined;
+  }
+
+  // take a rate limit token; undefined if allowed, the 429 response (status, headers, body) if not
+  rateLimit() {
+    var limit = this.conditions.rate_limit;
+    if (!limit) {
+      return undefined;
+    }
+    var now = Date.now();
+    this.tokens = Math.min(limit.burst || limit.per_second, this.tokens + (now - this.tokensAt) / 1000 * limit.per_second);
+    this.tokensAt = now;
+    if (this.tokens >= 1) {
+      this.tokens--;
+      return undefined;
+    }
+    this.stats.rate_limited++;
+      // whole seconds until the bucket has a token again, at least 1 - 0 would invite an immediate retry
+    var retryAfter = Math.max(1, Math.ceil((1 - this.tokens) / limit.per_second));
+    return {
+      status: 429,
+      body: RATE_LIMIT_BODY,
+      headers: {
+        'X-RateLimit-Limit': String(limit.limit || DEFAULT_RATE_LIMIT),
+        'X-RateLimit-Remaining': '0',
+        'Retry-After': String(retryAfter)
+      }
+    };
+  }
+
+  // ms until the response body of the size is through the shared bandwidth
+  bandwidthDelay(bytes) {
+    var bandwidth = this.conditions.bandwidth;
+    this.stats.bytes += bytes;
+    if (!bandwidth) {
+      return 0;
+    }
+    var now = Date.now();
+    this.bandwidthFreeAt = Math.max(now, this.bandwidthFreeAt) + bytes / bandwidth.bytes_per_second * 1000;
+    return this.bandwidthFreeAt - now;
+  }
+}
+
+module.exports = new Conditions();
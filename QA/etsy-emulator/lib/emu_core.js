@@ -10,17 +10,24 @@ Emulator core API
   Return array of processed requests
      curl http://localhost:3000/requests
 
+  Set upstream conditions of the emulated API - latency, errors, rate limit, bandwidth (see conditions.js),
+  they stay until the next test case is set, {} = none; return them with the statistics of the requests:
+     curl -H 'Content-Type: application/json' -d '{"latency": {"distribution": "fixed", "ms": 200}}' http://localhost:3000/conditions
+     curl http://localhost:3000/conditions
+
 */
 
 var fs = require('fs');
 var utils = require('./utils');
 var urlCounters = require ('./url_counters');
+var conditions = require('./conditions');
 
 var test_id_file = (process.env.ETEST_TEST_ID_FILE || 'test_id.txt');
 
 var requests = [];
 var ignoredUrls = [];
 var coreUrls = {};
+var corePostUrls = {};
 
 var app;
 var cfg;
@@ -92,6 +99,26 @@ function get_requests(req, res) {
 
 
 
+//--------------------------------------------------------------------------------
+// return the conditions and their statistics
+function get_conditions(req, res) {
+  res.send({ conditions: conditions.conditions, stats: conditions.stats });
+}
+
+
+//--------------------------------------------------------------------------------
+// set the conditions from the JSON body
+function set_conditions(req, res) {
+  try {
+    conditions.set(req.body || {});
+  } catch (err) {
+    return utils.error(res, 400, 'Invalid conditions: ' + err.message);
+  }
+  console.log('setting conditions:', JSON.stringify(conditions.conditions));
+  res.send({ conditions: conditions.conditions });
+}
+
+
 //--------------------------------------------------------------------------------
 // store each request that is not in ignoredUrls in the requests array
 function rememberRequest(req, res, next) {
@@ -116,12 +143,11 @@ function rememberRequest(req, res, next) {
 // Core API to set test case etc.
 function coreApi(req, res, next) {
   var method = req.method.toUpperCase();
-  if (method === 'GET') {
-    for (var url in coreUrls) {
-      var urlMatch = req.url.match('^' + url + '$');
-      if (urlMatch !== null) {
-        return coreUrls[url](req, res);
-      }
+  var urls = method === 'GET' ? coreUrls : method === 'POST' ? corePostUrls : {};
+  for (var url in urls) {
+    var urlMatch = req.url.match('^' + url + '$');
+    if (urlMatch !== null) {
+      return urls[url](req, res);
     }
   }
   next();
@@ -129,6 +155,35 @@ function coreApi(req, res, next) {
 
 
 
+//--------------------------------------------------------------------------------
+// apply the conditions to the emulated API (core API answers at once):
+// rate limit / injected error responses or the emulated response, after the latency,
+// its body throttled by the bandwidth
+function applyConditions(req, res, next) {
+  var urlPath = req.url.match(/^[^?]*/)[0];
+  var method = req.method.toUpperCase();
+  conditions.stats.requests++;
+
+  var end = res.end;
+  res.end = function(data, encoding) {
+    var delay = conditions.bandwidthDelay(data ? Buffer.byteLength(data, encoding) : 0);
+    if (delay > 0) {
+      return setTimeout(() => end.call(res, data, encoding), delay);
+    }
+    end.call(res, data, encoding);
+  };
+
+  var response = conditions.rateLimit() || conditions.error(method, urlPath);
+  var respond = response ? () => res.status(response.status).send(response.body, response.headers || {}) : next;
+  var latency = conditions.latency(method, urlPath);
+  if (latency > 0) {
+    return setTimeout(respond, latency);
+  }
+  respond();
+}
+
+
+
 //--------------------------------------------------------------------------------
 // initialize module
 function init(application, config) {
@@ -138,11 +193,14 @@ function init(application, config) {
   coreUrls['/requests'] = get_requests;             ignoredUrls.push('/requests');
   coreUrls['/exit'] = exit_app,                     ignoredUrls.push('/exit');
 	coreUrls['/set_test_id\\?test_id=.+'] = set_test; ignoredUrls.push('/set_test_id');
+	coreUrls['/conditions'] = get_conditions;         ignoredUrls.push('/conditions');
+	corePostUrls['/conditions'] = set_conditions;
 
     // register urls
   console.log("** Initializing emu_core");
 	app.use(rememberRequest);
 	app.use(coreApi);
+	app.use(applyConditions);
 }
 
 
@@ -6,6 +6,11 @@ var cfg;
 var rateLimitRemaining = 10000;
 const DEFAULT_HEADERS = 'default_headers';
 const DEFAULT_STATUS = 200;
+const RATE_LIMIT_REMAINING = 'rate_limit_remaining';
+const TEMPLATE_LISTING_ID = 100001;
+
+  // template lines of template_json_list, by file name and line number
+var templateLines = {};
 
 const FUNCTIONS = {
   fixed_json: fixed_json,
@@ -13,6 +18,7 @@ const FUNCTIONS = {
   generate_listings_from_data: generate_listings_from_data,
   external_json: external_json,
   external_json_list: external_json_list,
+  template_json_list: template_json_list,
   dynamic_json_list: dynamic_json_list
 }
 
@@ -191,6 +197,52 @@ function external_json_list(req, res, data) {
   });
 }
 
+//--------------------------------------------------------------------------------
+// read one line of a file (each line containg a JSON data) as a template of all listings
+// - get number from the request (Regex 1st group)
+// - replace the listing id of the template (data.listing_id, default 100001) by it
+// - the line (data.line, default 1) is read only once - shops of any size are served
+//   in constant time per request (perf tests of big shops)
+// decrement X-RateLimit-Remaining header
+//
+//		"/v2/listings/([0-9]+)": {
+//			"function": "template_json_list",
+//			"data": { "file": "listings_51_active.json", "line": 2 }
+//		}
+function template_json_list(req, res, data) {
+  var headers = {};
+  if (DEFAULT_HEADERS in cfg) {
+    headers = cfg[DEFAULT_HEADERS];
+  }
+  if ('headers' in data) {
+    headers = utils.merge(headers, data.headers);
+  }
+  headers['X-RateLimit-Remaining'] = rateLimitRemaining--;
+  if (!('file' in data)) {
+      return error(res, 500, "config item '<url>.data.file' is not defined");
+  }
+  var fileName = cfg._app.test_dir + '/' + data.file;
+  var line_no = data.line || 1;
+  var key = fileName + ':' + line_no;
+  var listing_no = cfg._app.urlMatch[1];
+
+  if (!(key in templateLines)) {
+    try {
+      templateLines[key] = fs.readFileSync(fileName, 'utf8').split('\n')[line_no - 1];
+    } catch (err) {
+      return error(res, 500, "Error reading '" + fileName + "' " + err);
+    }
+    if (templateLines[key] === undefined) {
+      delete templateLines[key];
+      return error(res, 500, 'Line ' + line_no + ' not found in ' + fileName);
+    }
+  }
+  var templateId = new RegExp('\\b' + (data.listing_id || TEMPLATE_LISTING_ID) + '\\b', 'g');
+  const status = data.status || DEFAULT_STATUS;
+  res.status(status).send(templateLines[key].replace(templateId, listing_no), headers);
+}
+
+
 //--------------------------------------------------------------------------------
 // read json from a file (each line containg a JSON data)
 // - get count of the method/url combination already received on emulator
@@ -236,6 +288,9 @@ function dynamic_json_list(req, res, data) {
 function init(application, config) {
   app = application;
   cfg = config;
+  if (RATE_LIMIT_REMAINING in cfg) {
+    rateLimitRemaining = cfg[RATE_LIMIT_REMAINING];
+  }
 
     // register URLs
 	app.get(/.*/, function(req, res) { utils.processRequest(req, res, cfg, FUNCTIONS); } );
@@ -1,260 +1,211 @@
 #!/usr/bin/env python3
 from requests_oauthlib import OAuth1Session
-from urllib.parse import urlparse, parse_qs, urlencode, quote
-import requests
-import os, sys
-from pprint import pprint
-import json
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-import base64
+import json
+import os
+import sys
+import threading
+import time
+
+# Fetch the Etsy property sets of all taxonomy ids into prop-sets.json (input of scaling.py)
+#   {"<taxonomy_id>": <GET /v2/property_sets?taxonomy_id=<id> response>, ...}
+# The requests run concurrently (--concurrency) through one OAuth session with a shared connection pool,
+# limited to --rate requests per second, 429 responses are retried after their Retry-After.
+# Every response is cached in --cache-dir/<taxonomy_id>.json with its fetch time, Last-Modified and ETag:
+# entries younger than --ttl are not requested at all, older ones are revalidated by a conditional
+# request (304 keeps the entry), so refreshing the whole taxonomy is one incremental pass.
+# prop-sets.json is rewritten only when a property set changed. A failed taxonomy id does not stop the
+# others, the failures are reported at the end (exit status 1) and prop-sets.json holds the fetched ones.
+# --api-url points the fetcher to a local stand-in server (Etsy emulator).
+#
+# Usage:
+#    ./fetch_prop-sets.py --client-token $VELA_CLIENT_TOKEN --client-secret $VELA_CLIENT_SECRET
+#    ./fetch_prop-sets.py --client-token t --client-secret s --api-url http://127.0.0.1:8090/v2 --ttl 0
 
 VERIFY_CERT = True
 
-# Uncomment for detailed oauthlib logs
-#   import logging
-#   import sys
-#   log = logging.getLogger('oauthlib')
-#   log.addHandler(logging.StreamHandler(sys.stdout))
-#   log.setLevel(logging.DEBUG)
-
-ETSY_REQUEST_TOKEN_URL = 'https://openapi.etsy.com/v2/oauth/request_token'
-ETSY_ACCES_TOKEN_URL = 'https://openapi.etsy.com/v2/oauth/access_token'
-#ETSY_CLIENT_KEY = 'whv9ifuh8y6mbozy8ggitiac'
-#ETSY_CLIENT_SECRET = 'czh00o2hb6'
-CALLBACK_URI='http://127.0.0.1/callback'
-
-#AUTHORIZED_OAUTH_TOKEN = '29f757b6aaf1e2c53e9eca37066e2b'
-#AUTHORIZED_OAUTH_TOKEN_SECRET = '252c2992a2'
 ETSY_API_URL = 'https://openapi.etsy.com/v2'
-
-def get_access_token(client_key, client_secret, request_token_url, access_token_url, callback_uri):
-        # get request token (temporary resource_owner_key/secret)
-    oauth = OAuth1Session(client_key=client_key, client_secret=client_secret)
-    #oauth = OAuth1Session(client_key=client_key, client_secret=client_secret, callback_uri=callback_uri)
-    fetch_response = oauth.fetch_request_token(request_token_url)
-    resource_owner_key = fetch_response.get('oauth_token')
-    resource_owner_secret = fetch_response.get('oauth_token_secret')
-    auth_url = fetch_response['login_url']
-    print('response =', fetch_response)
-    print('tmp owner key:', resource_owner_key)
-    print('tmp owner sec:', resource_owner_secret)
-
-        # RETURNED RESPONSE:
-        #    Cache-Control: private
-        #    Date: Tue, 17 Nov 2015 10:57:44 GMT
-        #    Connection: keep-alive
-        #    Content-Length: 364
-        #    X-Etsy-Request-Uuid: l0BAkRk2y7jeXkqYwdT1MH8ifRWU
-        #    Content-Type: application/x-www-form-urlencoded
-        #    Server: Apache
-        #    X-Cnection: close
-        #
-        #  login_url=https%3A%2F%2Fwww.etsy.com%2Foauth%2Fsignin%3Foauth_consumer_key%3Dwhv9ifuh8y6mbozy8ggitiac%26oauth_token%3D9e69f73f12f8a9148cdec4ca7a8c6c%26service%3Dv2_prod&oauth_token=9e69f73f12f8a9148cdec4ca7a8c6c&oauth_token_secret=bce8a21bb1&oauth_callback_confirmed=true&oauth_consumer_key=whv9ifuh8y6mbozy8ggitiac&oauth_callback=http%3A%2F%2F127.0.0.1%2Fcallback
-        # DECODED:
-        #                                                                          (client-app key)                        (tmp owner key)
-        #    login_url=https://www.etsy.com/oauth/signin?oauth_consumer_key=whv9ifuh8y6mbozy8ggitiac&oauth_token=9e69f73f12f8a9148cdec4ca7a8c6c&service=v2_prod
-        #
-        #    oauth_token=9e69f73f12f8a9148cdec4ca7a8c6c     // tmp owner key
-        #    oauth_token_secret=bce8a21bb1                  // tmp owner secret
-        #    oauth_callback_confirmed=true
-        #    oauth_consumer_key=whv9ifuh8y6mbozy8ggitiac    // client-app key (application hive)
-        #    oauth_callback=http://127.0.0.1/callback
-
-        # get authorization, insert the verifier key
-    print('Go to this URL and get the key:', auth_url)
-    verifier = input('enter the verifier:')
-
-
-        # ETSY returns CALLBACK redirect (HTTP:302 Location:xxx)
-        #   HTTP/1.1 302 Found
-        #   Cache-Control: private, no-store, no-cache, must-revalidate, post-check=0, pre-check=0
-        #   Content-Type: text/html; charset=UTF-8
-        #   Date: Tue, 17 Nov 2015 15:14:48 GMT
-        #   Expires: Thu, 19 Nov 1981 08:52:00 GMT
-                    #     (my callback URL)                    (tmp owner key)                  (verifier 9faf70a7)
-        #   Location: http://127.0.0.1/callback?oauth_token=9e69f73f12f8a9148cdec4ca7a8c6c&oauth_verifier=9faf70a7#_=_
-        #   Server: Apache
-        #   Set-Cookie: uaid=uaid%3DzYJO0qNUJxUC0ql_C6IPCkCCIa55%26_now%3D1447773288%26_slt%3DTSZwl-vt%26_kid%3D1%26_ver%3D1%26_mac%3D3wBW15GxuEumOJESnbx9-pG49VminC_niynI_EralJY.; expires=Sat, 17-Dec-2016 07:33:08 GMT; Max-Age=34186700; path=/; domain=.etsy.com; httponly
-        #   Set-Cookie: fve=1446888352.0; expires=Sat, 17-Dec-2016 07:33:08 GMT; Max-Age=34186700; path=/; domain=.etsy.com
-        #   Strict-Transport-Security: max-age=631138520; includeSubDomains; preload
-        #   X-Cnection: close
-        #   X-Content-Type-Options: nosniff
-        #   X-Frame-Options: SAMEORIGIN
-        #   X-Recruiting: Is code your craft? https://www.etsy.com/careers
-        #   X-XSS-Protection: 1; mode=block; report=/beacon/csp.php
-        #   Content-Length: 0
-        #   ----------------------------------------------------------
-
-
-        # Obtain an access token from the OAuth provider
-    oauth = OAuth1Session(client_key = client_key,
-                          client_secret = client_secret,
-                          resource_owner_key = resource_owner_key,
-                          resource_owner_secret = resource_owner_secret,
-                          verifier = verifier)
-    oauth_tokens = oauth.fetch_access_token(access_token_url)
-    access_token = oauth_tokens.get('oauth_token')
-    access_token_secret = oauth_tokens.get('oauth_token_secret')
-    return access_token, access_token_secret
-
-
-def get_protected_resource(protected_url):
-    oauth = OAuth1Session(client_key = ETSY_CLIENT_KEY,
-                          client_secret = ETSY_CLIENT_SECRET,
-                          resource_owner_key = AUTHORIZED_OAUTH_TOKEN,
-                          resource_owner_secret = AUTHORIZED_OAUTH_TOKEN_SECRET)
-    return oauth.get(protected_url, verify=VERIFY_CERT)
-
-def delete_protected_resource(protected_url):
-    oauth = OAuth1Session(client_key = ETSY_CLIENT_KEY,
-                          client_secret = ETSY_CLIENT_SECRET,
-                          resource_owner_key = AUTHORIZED_OAUTH_TOKEN,
-                          resource_owner_secret = AUTHORIZED_OAUTH_TOKEN_SECRET)
-    return oauth.delete(protected_url, verify=VERIFY_CERT)
-
-
-def put_protected_resource(protected_url, raw_data):
-    data = json.loads(raw_data)
-
-    body = {}
-    url_arays = {}
-        
-    for i in data.keys():
-        if type(data[i]) is list:
-            url_arays[i] = data[i]
-        else:
-            body[i] = data[i]
- 
- 
-    oauth = OAuth1Session(client_key = ETSY_CLIENT_KEY,
-                          client_secret = ETSY_CLIENT_SECRET,
-                          resource_owner_key = AUTHORIZED_OAUTH_TOKEN,
-                          resource_owner_secret = AUTHORIZED_OAUTH_TOKEN_SECRET,
-                          signature_type='body')
-
-    if len(url_arays) > 0:
-        final_url = ''
-        for i in url_arays.keys():
-            if final_url == '':
-                final_url += protected_url + '?'
+TAXONOMY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../shared/modules/etsy/taxonomy.json')
+OUT_FILE = 'prop-sets.json'
+CACHE_DIR = 'prop-sets.cache'
+TTL = 7 * 24 * 3600
+CONCURRENCY = 8
+    # Etsy API limit is 10 requests per second
+RATE = 8
+RETRIES = 5
+
+
+class RateLimiter(object):
+    """ Spaces the requests of all threads to the rate per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class PropertySetFetcher(object):
+    """ Cached property sets of taxonomy ids, fetched through one pooled, rate limited OAuth session
+    """
+
+    def __init__(self, client_key, client_secret, user_token=None, user_secret=None, api_url=ETSY_API_URL,
+                 cache_dir=CACHE_DIR, ttl=TTL, concurrency=CONCURRENCY, rate=RATE):
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.session = OAuth1Session(client_key=client_key, client_secret=client_secret,
+                                     resource_owner_key=user_token, resource_owner_secret=user_secret)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = {'cached': 0, 'not_modified': 0, 'fetched': 0, 'changed': 0, 'retries': 0, 'failed': 0}
+        self.stats_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def cache_path(self, taxonomy_id):
+        return os.path.join(self.cache_dir, '%s.json' % taxonomy_id)
+
+    def load_entry(self, taxonomy_id):
+        try:
+            with open(self.cache_path(taxonomy_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_entry(self, taxonomy_id, entry):
+        path = self.cache_path(taxonomy_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(path + '.tmp', path)
+
+    def request(self, taxonomy_id, headers):
+        """ GET the property set, retry 429 responses after their Retry-After
+        """
+        for attempt in range(RETRIES):
+            self.limiter.wait()
+            r = self.session.get(self.api_url + '/property_sets', params={'taxonomy_id': taxonomy_id},
+                                 headers=headers, verify=VERIFY_CERT)
+            if r.status_code != 429:
+                return r
+            self.count('retries')
+            time.sleep(float(r.headers.get('Retry-After', 1)))
+        return r
+
+    def fetch(self, taxonomy_id):
+        """ Cache entry of the taxonomy id - {'fetched', 'changed', 'last_modified', 'etag', 'body'}
+        (requested when missing or older than the TTL), whether its body changed
+        """
+        entry = self.load_entry(taxonomy_id)
+        if entry is not None and time.time() - entry['fetched'] < self.ttl:
+            self.count('cached')
+            return entry, False
+
+        headers = {}
+        if entry is not None:
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+        r = self.request(taxonomy_id, headers)
+        if r.status_code == 304 and entry is not None:
+            self.count('not_modified')
+            entry['fetched'] = time.time()
+            self.save_entry(taxonomy_id, entry)
+            return entry, False
+        if r.status_code != 200:
+            raise Exception('Property set of taxonomy %s: %d %s' % (taxonomy_id, r.status_code, r.text))
+
+        self.count('fetched')
+        body = r.json()
+        changed = entry is None or entry['body'] != body
+        now = time.time()
+        entry = {'fetched': now, 'changed': now if changed else entry['changed'],
+                 'last_modified': r.headers.get('Last-Modified'), 'etag': r.headers.get('ETag'), 'body': body}
+        self.save_entry(taxonomy_id, entry)
+        if changed:
+            self.count('changed')
+        return entry, changed
+
+    def try_fetch(self, taxonomy_id):
+        """ (fetch() result, None) or (None, error message) of the taxonomy id
+        """
+        try:
+            return self.fetch(taxonomy_id), None
+        except Exception as e:
+            self.count('failed')
+            return None, str(e)
+
+    def fetch_all(self, taxonomy_ids):
+        """ {taxonomy_id: property set} of the fetched ids, whether any of them changed,
+        {taxonomy_id: error message} of the failed ones
+        """
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            results = list(executor.map(self.try_fetch, taxonomy_ids))
+        prop_sets = {}
+        changed = False
+        failed = {}
+        for taxonomy_id, (result, error) in zip(taxonomy_ids, results):
+            if result is None:
+                failed[taxonomy_id] = error
             else:
-                final_url += '&'
-            final_url += quote(i) + '='
-            final_url += ','.join([quote(u) for u in url_arays[i]])
-    else:
-        final_url = protected_url
-    #final_url = protected_url + '?' + 'tags=foo,bar,baz'
-    return oauth.put(final_url, data=body, verify=VERIFY_CERT)
-
-
-def post_protected_resource(protected_url, raw_data):
-    data = json.loads(raw_data)
-
-    body = {}
-    url_arays = {}
-        
-    for i in data.keys():
-        if type(data[i]) is list:
-            url_arays[i] = data[i]
-        else:
-            if i[:7] == 'base64:':
-                key = i[7:]
-                binary = base64.b64decode(data[i])
-                body[key] = binary
-            else:
-                body[i] = (None, data[i])
- 
- 
-    oauth = OAuth1Session(client_key = ETSY_CLIENT_KEY,
-                          client_secret = ETSY_CLIENT_SECRET,
-                          resource_owner_key = AUTHORIZED_OAUTH_TOKEN,
-                          resource_owner_secret = AUTHORIZED_OAUTH_TOKEN_SECRET
-                          )
-
-    if len(url_arays) > 0:
-        final_url = ''
-        for i in url_arays.keys():
-            if final_url == '':
-                final_url += protected_url + '?'
-            else:
-                final_url += '&'
-            final_url += quote(i) + '='
-            final_url += ','.join([quote(str(u)) for u in url_arays[i]])
-    else:
-        final_url = protected_url
-    #final_url = protected_url + '?' + 'tags=foo,bar,baz'
-    return oauth.post(final_url, files=body, verify=VERIFY_CERT)
-
-
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--resource", default = '/shops/EtsyTestAppShop/listings/draft')
-parser.add_argument("--method", default = 'get')
-parser.add_argument("--data")
-parser.add_argument("--authorize", action="store_true")
-parser.add_argument("--user-token")
-parser.add_argument("--user-secret")
-parser.add_argument("--client-token", required=True)
-parser.add_argument("--client-secret", required=True)
-
-args = parser.parse_args()
-
-ETSY_CLIENT_KEY = args.client_token
-ETSY_CLIENT_SECRET = args.client_secret
-
-# hack - do not verify certs
-if 'NODE_TLS_REJECT_UNAUTHORIZED' in os.environ and os.environ['NODE_TLS_REJECT_UNAUTHORIZED'] == '0':
-    VERIFY_CERT = False
-
-if args.authorize:
-        # authorize user, create new tokens
-    access_token, access_token_secret = get_access_token(ETSY_CLIENT_KEY, ETSY_CLIENT_SECRET, ETSY_REQUEST_TOKEN_URL, ETSY_ACCES_TOKEN_URL, CALLBACK_URI)
-    print('access_token =', access_token)
-    print('access_token_secret =', access_token_secret)
-
-else:
-    if args.user_token == None:
-        print("Error: --user-token argument expected")
-        exit(1)
-    AUTHORIZED_OAUTH_TOKEN = args.user_token
-    if args.user_secret == None:
-        print("Error: --user-secret argument expected")
-        exit(1)
-    AUTHORIZED_OAUTH_TOKEN_SECRET = args.user_secret
-
-        # get/put.. resource
-    if args.resource[0:4] == '/v2/':
-        args.resource = args.resource[3:]
-
-    if args.method == 'get':
-        r = get_protected_resource(ETSY_API_URL + args.resource)
-
-    elif args.method == 'put':
-        if args.data == None:
-            print("Error: --data DATA argument expected")
-            exit(1)
-        #data = {"description": "Ahoj :-)", "materials": ["air"], "last_modified_tsz": "1458033722", "title": "My Modified Listing", "state": "draft"}
-        r = put_protected_resource(ETSY_API_URL + args.resource, args.data)
-
-    elif args.method == 'post':
-        if args.data == None:
-            print("Error: --data DATA argument expected")
-            exit(1)
-        #data = {"description": "Ahoj :-)", "materials": ["air"], "last_modified_tsz": "1458033722", "title": "My Modified Listing", "state": "draft"}
-        r = post_protected_resource(ETSY_API_URL + args.resource, args.data)
-
-    elif args.method == 'delete':
-        r = delete_protected_resource(ETSY_API_URL + args.resource)
-    else:
-        print("Error: unsupported method ", args.method)
-        exit(1)
-
-    #pprint(vars(r))
-    print("\tStatus-code:\t" + str(r.status_code) + "\n", file=sys.stderr)
-    for n, v in r.headers.items():
-        print("\t" + n + "\t" + v, file=sys.stderr)
-    print("", file=sys.stderr)
-    print(r.text)
-
-
+                entry, entry_changed = result
+                prop_sets[taxonomy_id] = entry['body']
+                changed = changed or entry_changed
+        return prop_sets, changed, failed
+
+
+def taxonomy_ids(path):
+    with open(path) as f:
+        return sorted((key for key in json.load(f) if key.isdigit()), key=int)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fetch property sets of all taxonomy ids into prop-sets.json")
+    parser.add_argument("--client-token", required=True)
+    parser.add_argument("--client-secret", required=True)
+    parser.add_argument("--user-token")
+    parser.add_argument("--user-secret")
+    parser.add_argument("--api-url", default=ETSY_API_URL, help="Etsy API or a local stand-in server")
+    parser.add_argument("--taxonomy", default=TAXONOMY_FILE, help="taxonomy JSON, its keys are the taxonomy ids")
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--ttl", type=float, default=TTL, help="seconds a cached property set is used unchecked")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second")
+    args = parser.parse_args()
+
+    # hack - do not verify certs
+    if os.environ.get('NODE_TLS_REJECT_UNAUTHORIZED') == '0':
+        VERIFY_CERT = False
+
+    fetcher = PropertySetFetcher(args.client_token, args.client_secret, args.user_token, args.user_secret,
+                                 args.api_url.rstrip('/'), args.cache_dir, args.ttl, args.concurrency, args.rate)
+    start = time.monotonic()
+    prop_sets, changed, failed = fetcher.fetch_all(taxonomy_ids(args.taxonomy))
+    if changed or not os.path.exists(args.out):
+        with open(args.out, 'w') as out:
+            json.dump(prop_sets, out)
+    print("%d property sets in %.1f s: %s" % (len(prop_sets), time.monotonic() - start,
+                                              ', '.join('%s %d' % item for item in fetcher.stats.items())),
+          file=sys.stderr)
+    for taxonomy_id, error in failed.items():
+        print("taxonomy %s failed: %s" % (taxonomy_id, error), file=sys.stderr)
+    if failed:
+        sys.exit(1)
@@ -1,8 +1,24 @@
 #!/usr/bin/python3
+import argparse
+import csv
+import itertools
 import json
+import multiprocessing
+import os
+import pickle
 import re
 import psycopg2
 
+# Audit the scaling options of the variations in the hive database against the Etsy property sets
+# (prop-sets.json, compiled to a cached index). Variation id ranges are checked by a process pool,
+# every finished range is checkpointed to the state file, an interrupted run resumes from it.
+# --since checks only variations of products modified or synced since the last finished run.
+# Prints the OK / not found / mismatch totals, --json and --csv write them per taxonomy and property.
+#
+# Usage:
+#    ./scaling.py --json audit.json --csv audit.csv
+#    ./scaling.py --since --processes 8 --dsn "dbname=test_hive_00 user=hive host=hive_db00"
+
 
 RECIPIENT_RE = '(.*)-  *(Men|Women|Unisex Adults|Teen Boys|Teen Girls|Teens|Boys|Girls|Children|Baby Boys|Baby Girls|Babies|Birds|Cats|Dogs|Pets) *$'
 SCALING_UNITS = {
@@ -138,63 +154,104 @@ def debug(*args):
     pass
     #print("\t**", *args)
 
-def get_scale(value, formatted_value, property_id, taxonomy_id, recipient_name, prop_set):
+PRICE_RE = re.compile(r'(.*)\[US\$[0-9.]*\]\s*$')
+RECIPIENT_RE = re.compile(RECIPIENT_RE)
+    # compiled index of the prop-sets, rebuilt when prop-sets.json changes
+INDEX_CACHE = '%s.index.pickle'
+INDEX_VERSION = 1
+
+
+def union_options(recipient_results):
+    """ Options of all recipients, in the order of the first occurrence
+    """
+    all_opt = {}
+    for pr in recipient_results:
+        for o in recipient_results[pr][0]['options']:
+            all_opt[o] = 1
+    return list(all_opt)
+
+
+def compile_options(options):
+    """ (frozenset of the options, {scaling option name: first option of the name})
+    Options without a known name (eg. 344-346 of property 501) are not matched by a prefix.
+    """
+    by_name = {}
+    for o in options:
+        name = SCALING_OPTIONS.get(str(o))
+        if name is not None:
+            by_name.setdefault(name, o)
+    return frozenset(options), by_name
+
+
+def build_index(prop_set):
+    """ taxonomy_id -> property_id -> recipient_id -> compiled options of the prop-sets
+
+    The recipient aliases are resolved, the None recipient holds the options used for missing
+    or unknown recipients (all options of the property, or the union of all recipients).
+    """
+    index = {}
+    for taxonomy_id, taxonomy in prop_set.items():
+        properties = index[taxonomy_id] = {}
+        for property_id, qualifiers in (taxonomy['results'][0]['qualifiers'] or {}).items():
+            property_data = qualifiers[0]
+            recipient_results = property_data['results']
+            if recipient_results is None:
+                properties[property_id] = {None: compile_options(property_data['options'])}
+                continue
+            recipients = properties[property_id] = {None: compile_options(union_options(recipient_results))}
+            aliases = property_data['aliases'] or {}
+            for recipient_id in RECIPIENTS.values():
+                alias = str(aliases[recipient_id]) if recipient_id in aliases else recipient_id
+                if alias in recipient_results:
+                    recipients[recipient_id] = compile_options(recipient_results[alias][0]['options'])
+    return index
+
+
+def load_index(path):
+    """ Compiled index of the prop-sets JSON file, from its cache file while it is newer than the JSON
+    """
+    cache = INDEX_CACHE % path
+    try:
+        if os.path.getmtime(cache) >= os.path.getmtime(path):
+            with open(cache, 'rb') as f:
+                version, index = pickle.load(f)
+            if version == INDEX_VERSION:
+                return index
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        pass
+    with open(path) as f:
+        index = build_index(json.load(f))
+    with open(cache, 'wb') as f:
+        pickle.dump((INDEX_VERSION, index), f, pickle.HIGHEST_PROTOCOL)
+    return index
+
+
+def get_scale(value, formatted_value, property_id, taxonomy_id, recipient_id, index):
     if taxonomy_id is None:
         return None
     # get options
-    property_id = str(property_id)
-    taxonomy_id = str(taxonomy_id)
-    recipient_name = str(recipient_name)
-    if recipient_name in RECIPIENTS:
-        recipient_id = RECIPIENTS[recipient_name]
-    else:
-        recipient_id = None
-
-
-    if property_id not in prop_set[taxonomy_id]['results'][0]['qualifiers']:
+    properties = index.get(str(taxonomy_id))
+    if properties is None:
+        debug("No property set found")
+        return None
+    recipients = properties.get(str(property_id))
+    if recipients is None:
         debug("No qualifiers found")
         return None
-    property_data = prop_set[taxonomy_id]['results'][0]['qualifiers'][property_id][0]
-    recipient_results = property_data['results']
-    if recipient_results is None:
-        options = property_data['options']
-    else:
-        if recipient_id is None:
-            debug("Required recipient_id is missing")
-            possible_recipients = property_data['results'].keys()
-            all_opt = {}
-            for pr in possible_recipients:
-                for o in recipient_results[pr][0]['options']:
-                    all_opt[o] = 1
-            options = list(all_opt.keys())
-        else:
-            if property_data['aliases'] is not None and  recipient_id in property_data['aliases']:
-                alias = str(property_data['aliases'][recipient_id])
-            else:
-                alias = recipient_id
-
-            if alias in recipient_results:
-                options = recipient_results[alias][0]['options']         # [301, 354, 355, 353, 305]
-            else:
-                possible_recipients = property_data['results'].keys()
-                all_opt = {}
-                for pr in possible_recipients:
-                    for o in recipient_results[pr][0]['options']:
-                        all_opt[o] = 1
-                options = list(all_opt.keys())
+    options, by_name = recipients.get(str(recipient_id), recipients[None])
 
     debug("Options: ", options)
 
     fv = formatted_value
 
     # strip price
-    m = re.match('(.*)\[US\$[0-9.]*\]\s*$', fv)
+    m = PRICE_RE.match(fv)
     if m != None:
         fv = m.group(1)
         debug('Price stripped:', fv)
 
     # strip recip
-    m = re.search(RECIPIENT_RE, fv)
+    m = RECIPIENT_RE.search(fv)
     if m != None:
         fv = m.group(1)
         debug('Recipient stripped:', fv)
@@ -208,13 +265,7 @@ def get_scale(value, formatted_value, property_id, taxonomy_id, recipient_name,
 
     if prefix != '':
         debug('Found prefix:', prefix)
-        for o in options:
-            debug('Checking option:', o)
-            if SCALING_OPTIONS[str(o)] == prefix:
-                debug('Found scaling option by prefix:', prefix, o)
-                return o
-        else:
-            return None
+        return by_name.get(prefix)
     elif postfix != '':
             debug('Found postfix:', postfix)
             # match postfixes to scaling option
@@ -233,61 +284,196 @@ def get_scale(value, formatted_value, property_id, taxonomy_id, recipient_name,
     return
 
 
-#with open('ps-recip.json') as f:
-with open('prop-sets.json') as f:
-    prop_set = json.load(f)
+VARIATIONS_QUERY = (
+    "SELECT v.id, v.scaling_option_id, v.property_id, pp.taxonomy_id, v.recipient_id, o.value, o.formatted_value "
+    "FROM variations v "
+    "LEFT JOIN variation_options o ON o.variation_id = v.id "
+    "LEFT JOIN product_properties pp ON pp.id = v.product_id "
+    "WHERE v.id >= %(start)s AND v.id < %(end)s "
+    "AND (%(since)s::timestamptz IS NULL OR pp._hive_last_modified_tsz >= %(since)s OR pp._hive_last_sync >= %(since)s) "
+    "ORDER BY v.id, o.sequence, o.id"
+)
+    # rows per round trip of the server-side cursor
+BATCH_SIZE = 10000
+    # variation ids per task of the process pool
+RANGE_SIZE = 100000
+DSN = "dbname=hive user=hive"
+#DSN = "dbname=test_hive_00 user=hive password=H1ve2015 host=hive_db00"
+PROP_SETS = 'prop-sets.json'
+#PROP_SETS = 'ps-recip.json'
+STATE_FILE = 'scaling-audit.state.json'
+RESULTS = ['ok', 'missing', 'mismatch']
 
 
-#conn = psycopg2.connect("dbname=test_hive_00 user=hive password=H1ve2015 host=hive_db00")
-conn = psycopg2.connect("dbname=hive user=hive")
-cur_variation_id = conn.cursor()
-cur_variation_id.execute("SELECT id from variations")
+def variations(conn, start, end, since=None):
+    """ Stream (variation_id, scaling_option_id, property_id, taxonomy_id, recipient_id, [(value, formatted_value)])
+    of the variations with start <= id < end (touched since the time) in one pass
 
+    A named (server-side) cursor keeps the result on the server, it is fetched in BATCH_SIZE batches
+    and grouped by variation - one query instead of one per variation.
+    """
+    cur = conn.cursor(name='scaling_variations')
+    cur.itersize = BATCH_SIZE
+    cur.execute(VARIATIONS_QUERY, {'start': start, 'end': end, 'since': since})
+    for var_id, rows in itertools.groupby(cur, key=lambda row: row[0]):
+        rows = list(rows)
+        yield rows[0][:5] + ([row[5:] for row in rows if row[5] is not None],)
+    cur.close()
 
-while True:
-    row = cur_variation_id.fetchone()
-    if row is None:
-        break
-    var_id = str(row[0])
 
+def check_variation(options, property_id, taxonomy_id, recipient_id, index):
+    """ Scaling option of the first option it is found for, None if not found
+    """
+    for (value, formatted_value) in options:
+        debug("value:", value, ", formatted_value:", formatted_value, ", property_id:", property_id, ", taxonomy_id:", taxonomy_id, ", recipient_id:", recipient_id)
+        scale = get_scale(value, formatted_value, property_id, taxonomy_id, recipient_id, index)
+        if scale is not None:
+            return scale
+    return None
 
-    cur_options = conn.cursor()
-    cur_options.execute("SELECT o.value, o.formatted_value, v.property_id, p1.property_value as taxonomy_id, p2.property_value as recipient_id, v.scaling_option_id "
-    "FROM variation_options o "
-    "JOIN variations v ON v.id = o.variation_id "
-    "LEFT JOIN (SELECT id, property_value FROM products WHERE property_name = 'taxonomy_id') p1 ON v.product_id = p1.id "
-    "LEFT JOIN (SELECT id, property_value FROM products WHERE property_name = 'recipient') p2 ON v.product_id = p2.id "
-    "WHERE v.id = " + var_id
-    )
 
-    final_scale = None
-    scaling_option = None
-    while True:
-        row = cur_options.fetchone()
-        if row is None:
-            break
-        (value, formatted_value, property_id, taxonomy_id, recipient_id, scaling_option) = row
-        debug("value:", value, ", formatted_value:", formatted_value, ", property_id:", property_id, ", taxonomy_id:", taxonomy_id, ", recipient_id:", recipient_id, ", scaling_option:", scaling_option)
-        scale = get_scale(value, formatted_value,property_id, taxonomy_id, recipient_id,  prop_set)
-        if scale is not None:
-            final_scale = scale
-            break
+#--------------------------------------------------------------------------------
+# audit - variation id ranges over a process pool, checkpointed to the state file
 
-    if scaling_option == final_scale:
-        print("OK")
-    elif final_scale is None:
-        print("We have not found it, boon has", var_id)
+worker = {}
+
+
+def init_worker(dsn, prop_sets):
+    """ Pool process initializer - own connection and the compiled index
+    """
+    worker['conn'] = psycopg2.connect(dsn)
+    worker['index'] = load_index(prop_sets)
+
+
+def audit_range(task):
+    """ Check the variations of the range, return (start, {"taxonomy_id:property_id": [ok, missing, mismatch]})
+    """
+    start, end, since = task
+    conn = worker['conn']
+    counts = {}
+    for var_id, scaling_option, property_id, taxonomy_id, recipient_id, options in variations(conn, start, end, since):
+        if not options:
+            # nothing to check, OK as in the former per variation query (it had no row for the scaling option)
+            scaling_option = None
+        final_scale = check_variation(options, property_id, taxonomy_id, recipient_id, worker['index'])
+        if scaling_option == final_scale:
+            result = 0
+        elif final_scale is None:
+            debug("We have not found it, boon has", var_id)
+            result = 1
+        else:
+            debug("ERROR: ", scaling_option, "!=", final_scale, "variation_id:", var_id)
+            result = 2
+        key = '%s:%s' % (taxonomy_id, property_id)
+        counts.setdefault(key, [0, 0, 0])[result] += 1
+    conn.rollback()
+    return start, counts
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path, state):
+    """ Write the state file atomically - an interrupted write keeps the previous checkpoint
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def new_run(dsn, since, range_size):
+    """ State of a new audit run: its start time (database clock), the since time and the ranges to check
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT now(), min(id), max(id) FROM variations")
+    started, min_id, max_id = cur.fetchone()
+    conn.close()
+    ranges = range(min_id, max_id + 1, range_size) if min_id is not None else []
+    return {'started': started.isoformat(), 'since': since, 'range_size': range_size,
+            'pending': list(ranges), 'done': {}}
+
+
+def summarize(run):
+    """ Summary of the checked ranges of the run, rows sorted by taxonomy and property
+    """
+    totals = dict.fromkeys(RESULTS, 0)
+    merged = {}
+    for counts in run['done'].values():
+        for key, values in counts.items():
+            row = merged.setdefault(key, [0, 0, 0])
+            for i, n in enumerate(values):
+                row[i] += n
+    rows = []
+    for key, values in merged.items():
+        taxonomy_id, property_id = key.split(':')
+        rows.append(dict(taxonomy_id=taxonomy_id, property_id=property_id, **dict(zip(RESULTS, values))))
+        for result, n in zip(RESULTS, values):
+            totals[result] += n
+    rows.sort(key=lambda row: (row['taxonomy_id'], row['property_id']))
+    return {'started': run['started'], 'since': run['since'], 'totals': totals, 'rows': rows}
+
+
+def audit(dsn, prop_sets, processes, range_size, state_path, since_last_run=False, restart=False):
+    """ Audit all variations (or the ones touched since the last finished run), resume an interrupted run
+    """
+    state = load_state(state_path)
+    run = None if restart else state.get('run')
+    if run is None:
+        since = state.get('last_run') if since_last_run else None
+        if since_last_run and since is None:
+            print("No finished run in %s, checking all variations" % state_path)
+        run = state['run'] = new_run(dsn, since, range_size)
+        save_state(state_path, state)
     else:
-        print("ERROR: ", scaling_option, "!=", final_scale, "variation_id:", var_id)
+        print("Resuming the run started %s, %d ranges left" % (run['started'], len(run['pending'])))
 
-    cur_options.close()
+    # a new index cache is written once here, not by every pool process
+    load_index(prop_sets)
+    tasks = [(start, start + run['range_size'], run['since']) for start in run['pending']]
+    with multiprocessing.Pool(processes, init_worker, (dsn, prop_sets)) as pool:
+        for start, counts in pool.imap_unordered(audit_range, tasks):
+            run['pending'].remove(start)
+            run['done'][str(start)] = counts
+            save_state(state_path, state)
 
+    summary = summarize(run)
+    state['last_run'] = run['started']
+    del state['run']
+    save_state(state_path, state)
+    return summary
 
-#
-#
-#SELECT o.value, o.formatted_value, v.property_id, p1.property_value as taxonomy_id, p2.property_value as recipient_id, v.scaling_option_id
-#	FROM variation_options o
-#		JOIN variations v ON v.id = o.variation_id
-#		LEFT JOIN (SELECT id, property_value FROM products WHERE property_name = 'taxonomy_id') p1 ON v.product_id = p1.id
-#		LEFT JOIN (SELECT id, property_value FROM products WHERE property_name = 'recipient') p2 ON v.product_id = p2.id
-#	WHERE v.property_id = 100;
+
+def write_csv(summary, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['taxonomy_id', 'property_id'] + RESULTS)
+        writer.writeheader()
+        writer.writerows(summary['rows'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Audit scaling options of variations against the prop-sets")
+    parser.add_argument("--dsn", default=DSN, help="hive database")
+    parser.add_argument("--prop-sets", default=PROP_SETS, help="property sets JSON (cached index next to it)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="pool processes")
+    parser.add_argument("--range-size", type=int, default=RANGE_SIZE, help="variation ids per task")
+    parser.add_argument("--state", default=STATE_FILE, help="checkpoint file, an interrupted run resumes from it")
+    parser.add_argument("--since", action="store_true",
+                        help="check only variations of products modified or synced since the last finished run")
+    parser.add_argument("--restart", action="store_true", help="discard an interrupted run")
+    parser.add_argument("--json", help="write the summary to this JSON file")
+    parser.add_argument("--csv", help="write the counts per taxonomy and property to this CSV file")
+    args = parser.parse_args()
+
+    summary = audit(args.dsn, args.prop_sets, args.processes, args.range_size, args.state, args.since, args.restart)
+    print("OK: %(ok)d, not found: %(missing)d, mismatch: %(mismatch)d" % summary['totals'])
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(summary, out, indent=2)
+    if args.csv:
+        write_csv(summary, args.csv)
@@ -0,0 +1,137 @@
+import importlib.util
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip('requests_oauthlib')
+
+# PropertySetFetcher against a local http.server stand-in of GET /v2/property_sets
+#
+# Usage:
+#    cd QA/oauth1 && python3 -m pytest -q test_fetch_prop_sets.py
+
+spec = importlib.util.spec_from_file_location(
+    'fetch_prop_sets', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fetch_prop-sets.py'))
+fetch_prop_sets = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fetch_prop_sets)
+
+
+class StandIn(object):
+    """ Property sets served by the stand-in: {taxonomy_id: (status, etag, body)}, 429 responses to send first
+    """
+
+    def __init__(self):
+        self.prop_sets = {}
+        self.rate_limited = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def respond(self, taxonomy_id, headers):
+        with self.lock:
+            self.requests.append((taxonomy_id, headers.get('If-None-Match')))
+            if self.rate_limited.get(taxonomy_id):
+                self.rate_limited[taxonomy_id] -= 1
+                return 429, {'Retry-After': '0'}, b'You have exceeded your API limit\n'
+            status, etag, body = self.prop_sets[taxonomy_id]
+        if status != 200:
+            return status, {}, b'Server error\n'
+        if headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag, 'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    stand_in = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            taxonomy_id = parse_qs(url.query)['taxonomy_id'][0]
+            status, headers, body = stand_in.respond(taxonomy_id, self.headers)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    stand_in.api_url = 'http://127.0.0.1:%d/v2' % httpd.server_address[1]
+    yield stand_in
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetcher(server, cache_dir, ttl):
+    return fetch_prop_sets.PropertySetFetcher('key', 'secret', api_url=server.api_url, cache_dir=str(cache_dir),
+                                              ttl=ttl, concurrency=2, rate=1000)
+
+
+def cached_body(cache_dir, taxonomy_id):
+    with open(os.path.join(str(cache_dir), '%s.json' % taxonomy_id)) as f:
+        return json.load(f)['body']
+
+
+def test_cached_within_ttl(server, tmpdir):
+    server.prop_sets['1'] = (200, '"a"', {'count': 1})
+    assert fetcher(server, tmpdir, 3600).fetch_all(['1']) == ({'1': {'count': 1}}, True, {})
+    cached = fetcher(server, tmpdir, 3600)
+    assert cached.fetch_all(['1']) == ({'1': {'count': 1}}, False, {})
+    assert cached.stats['cached'] == 1
+    assert len(server.requests) == 1
+
+
+def test_not_modified_keeps_entry(server, tmpdir):
+    server.prop_sets['1'] = (200, '"a"', {'count': 1})
+    fetcher(server, tmpdir, 0).fetch_all(['1'])
+    revalidated = fetcher(server, tmpdir, 0)
+    assert revalidated.fetch_all(['1']) == ({'1': {'count': 1}}, False, {})
+    assert revalidated.stats['not_modified'] == 1
+    assert server.requests[-1] == ('1', '"a"')
+    assert cached_body(tmpdir, '1') == {'count': 1}
+
+
+def test_changed_body_rewrites_entry(server, tmpdir):
+    server.prop_sets['1'] = (200, '"a"', {'count': 1})
+    fetcher(server, tmpdir, 0).fetch_all(['1'])
+    server.prop_sets['1'] = (200, '"b"', {'count': 2})
+    refreshed = fetcher(server, tmpdir, 0)
+    assert refreshed.fetch_all(['1']) == ({'1': {'count': 2}}, True, {})
+    assert refreshed.stats['changed'] == 1
+    assert cached_body(tmpdir, '1') == {'count': 2}
+
+
+def test_rate_limited_is_retried(server, tmpdir):
+    server.prop_sets['1'] = (200, '"a"', {'count': 1})
+    server.rate_limited['1'] = 2
+    retrying = fetcher(server, tmpdir, 0)
+    assert retrying.fetch_all(['1']) == ({'1': {'count': 1}}, True, {})
+    assert retrying.stats['retries'] == 2
+    assert len(server.requests) == 3
+
+
+def test_failures_per_id(server, tmpdir):
+    server.prop_sets['1'] = (200, '"a"', {'count': 1})
+    server.prop_sets['2'] = (500, None, None)
+    server.prop_sets['3'] = (200, '"c"', {'count': 3})
+    failing = fetcher(server, tmpdir, 0)
+    prop_sets, changed, failed = failing.fetch_all(['1', '2', '3'])
+    assert prop_sets == {'1': {'count': 1}, '3': {'count': 3}}
+    assert changed
+    assert list(failed) == ['2'] and '500' in failed['2']
+    assert failing.stats['failed'] == 1
@@ -0,0 +1,167 @@
+import itertools
+import json
+import os
+
+import pytest
+
+import scaling
+from scaling import audit_range, build_index, get_scale
+
+# Unit tests of the scaling option lookup on the property sets of the shared Etsy module and of the audit,
+# no database needed
+#
+# Usage:
+#    cd QA/oauth1 && python3 -m pytest -q test_scaling.py
+
+PROPERTY_SETS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../../shared/modules/etsy/variations/data/PROPERTY_SETS.json')
+
+
+def qualifier(data):
+    """ Qualifier of the shared module format in the GET /v2/property_sets format (recipients in 1 element lists)
+    """
+    results = data['results']
+    return {'options': data['options'], 'aliases': data['aliases'],
+            'results': None if results is None else {recipient: [{'options': recipient_data['options']}]
+                                                     for recipient, recipient_data in results.items()}}
+
+
+@pytest.fixture(scope='module')
+def index():
+    with open(PROPERTY_SETS) as f:
+        data = json.load(f)
+    prop_sets = {taxonomy_id: {'results': [{'qualifiers': {property_id: [qualifier(q)]
+                                                           for property_id, q in properties.items()}}]}
+                 for taxonomy_id, properties in itertools.chain([('base', data['base'])],
+                                                                data['propertySets'].items())}
+    return build_index(prop_sets)
+
+
+def test_unnamed_options(index):
+    # property 501 has the options 344-346 without a scaling option name
+    options, by_name = index['base']['501'][None]
+    assert options == frozenset([344, 345, 346])
+    assert by_name == {}
+
+
+@pytest.mark.parametrize('value, formatted_value, property_id, scale', [
+    ('10', '10 g', 511, 333),
+    ('M', 'M', 100, 301),
+    ('10', '10 cm', 100, 328),
+    ('10', '10 parsecs', 100, None),
+])
+def test_get_scale(index, value, formatted_value, property_id, scale):
+    assert get_scale(value, formatted_value, property_id, 'base', None, index) == scale
+
+
+class FakeConnection(object):
+    def rollback(self):
+        pass
+
+
+def test_audit_range_results(index, monkeypatch):
+    rows = [
+        (1, 333, 511, 'base', None, [('10', '10 g')]),
+        (2, None, 511, 'base', None, [('10', '10 parsecs')]),
+        (3, 333, 511, 'base', None, [('10', '10 parsecs')]),
+        (4, 332, 511, 'base', None, [('10', '10 g')]),
+        # no options - OK whatever its scaling option, as the former per variation query
+        (5, 333, 511, 'base', None, []),
+    ]
+    monkeypatch.setattr(scaling, 'variations', lambda conn, start, end, since: iter(rows))
+    monkeypatch.setitem(scaling.worker, 'conn', FakeConnection())
+    monkeypatch.setitem(scaling.worker, 'index', index)
+    assert audit_range((1, 100, None)) == (1, {'base:511': [3, 1, 1]})
+
+
+def test_summarize_merges_ranges():
+    run = {'started': '2026-10-18T10:00:00+00:00', 'since': None, 'done': {
+        '1': {'25:100': [3, 1, 0], '47:511': [1, 0, 2]},
+        '101': {'25:100': [2, 0, 1]},
+        '201': {},
+    }}
+    assert scaling.summarize(run) == {
+        'started': '2026-10-18T10:00:00+00:00', 'since': None,
+        'totals': {'ok': 6, 'missing': 1, 'mismatch': 3},
+        'rows': [dict(taxonomy_id='25', property_id='100', ok=5, missing=1, mismatch=1),
+                 dict(taxonomy_id='47', property_id='511', ok=1, missing=0, mismatch=2)],
+    }
+
+
+class SerialPool(object):
+    """ multiprocessing.Pool running the tasks in this process, without the worker initializer
+    """
+    def __init__(self, processes, initializer, initargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, func, tasks):
+        return map(func, tasks)
+
+
+@pytest.fixture
+def audit_env(monkeypatch):
+    """ audit() without a database: ranges of new runs and the checked tasks are recorded
+    """
+    env = {'new_runs': [], 'tasks': [], 'interrupt_at': None}
+
+    def new_run(dsn, since, range_size):
+        env['new_runs'].append(since)
+        return {'started': 'run%d' % len(env['new_runs']), 'since': since, 'range_size': range_size,
+                'pending': [1, 11, 21, 31], 'done': {}}
+
+    def audit_range(task):
+        if task[0] == env['interrupt_at']:
+            raise KeyboardInterrupt
+        env['tasks'].append(task)
+        return task[0], {'25:100': [1, 0, 0]}
+
+    monkeypatch.setattr(scaling, 'new_run', new_run)
+    monkeypatch.setattr(scaling, 'audit_range', audit_range)
+    monkeypatch.setattr(scaling, 'load_index', lambda path: {})
+    monkeypatch.setattr(scaling.multiprocessing, 'Pool', SerialPool)
+    return env
+
+
+def test_interrupted_run_resumed(audit_env, tmpdir):
+    state_path = str(tmpdir.join('state.json'))
+    audit_env['interrupt_at'] = 21
+    with pytest.raises(KeyboardInterrupt):
+        scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path)
+    state = scaling.load_state(state_path)
+    assert 'last_run' not in state
+    assert state['run']['pending'] == [21, 31]
+    assert sorted(state['run']['done']) == ['1', '11']
+
+    audit_env['interrupt_at'] = None
+    del audit_env['tasks'][:]
+    summary = scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path)
+    assert audit_env['new_runs'] == [None]
+    assert audit_env['tasks'] == [(21, 31, None), (31, 41, None)]
+    assert summary['totals'] == {'ok': 4, 'missing': 0, 'mismatch': 0}
+    assert scaling.load_state(state_path) == {'last_run': 'run1'}
+
+
+def test_since_last_run(audit_env, tmpdir):
+    state_path = str(tmpdir.join('state.json'))
+    scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path, since_last_run=True)
+    scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path, since_last_run=True)
+    assert audit_env['new_runs'] == [None, 'run1']
+    assert audit_env['tasks'][-1] == (31, 41, 'run1')
+    assert scaling.load_state(state_path) == {'last_run': 'run2'}
+
+
+def test_restart_discards_interrupted_run(audit_env, tmpdir):
+    state_path = str(tmpdir.join('state.json'))
+    audit_env['interrupt_at'] = 11
+    with pytest.raises(KeyboardInterrupt):
+        scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path)
+    audit_env['interrupt_at'] = None
+    summary = scaling.audit('dsn', 'prop-sets.json', 2, 10, state_path, restart=True)
+    assert audit_env['new_runs'] == [None, None]
+    assert summary['started'] == 'run2' and summary['totals']['ok'] == 4
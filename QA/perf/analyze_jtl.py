@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import csv
+import datetime
+import io
+import json
+import re
+import sys
+
+from histogram import Histogram
+from pgcopy import open_input
+
+# One pass analyzer of JMeter results (JTL CSV, also written by load_journey.py --jtl)
+# Memory does not grow with the file: every label, time window and the journeys have a histogram,
+# only the journeys in progress (one per thread) are kept row by row - multi-GB files are fine.
+#
+# Reports per label count, error rate, mean, p50/p90/p99/p99.9 and max, the same for journeys
+# (sum of the steps of one thread up to the last step, --last-label) and throughput and errors
+# per time window. --journeys writes the journey sums like the former sum_calls.pl,
+# --json writes all histograms for later comparison.
+# --resources joins the server samples of sample_resources.py - the means of the --resource-metric
+# metrics per time window are added to the window table (and to --json).
+#
+# Usage:
+#    ./analyze_jtl.py results.csv
+#    ./analyze_jtl.py --window 10 --resources resources.csv --resource-metric 'proc\.web\.' results.csv
+#    ./analyze_jtl.py --window 10 --json summary.json results-1.csv.gz results-2.csv.zst
+#    ./analyze_jtl.py --journeys journeys.csv < results.csv
+
+LAST_LABEL = '34 /logout'
+WINDOW = 60
+PERCENTILES = [50, 90, 99, 99.9]
+    # source.name regexps of the resource metrics shown per window by default
+RESOURCE_METRICS = [r'^pg\.activity\.(active|waiting)$', r'^pg\.statements\.exec_ms_per_s$', r'^rabbit\.messages$',
+                    r'^proc\.\w+\.cpu$']
+JTL_FIELDS = ['timeStamp', 'elapsed', 'label', 'responseCode', 'threadName', 'success', 'bytes', 'grpThreads',
+              'allThreads', 'Latency', 'SampleCount', 'ErrorCount', 'Connect']
+
+
+class Series():
+    """ Histogram of elapsed times (microseconds) with error and byte counts
+    """
+    def __init__(self):
+        self.histogram = Histogram()
+        self.errors = 0
+        self.bytes = 0
+
+    def record(self, elapsed, success, size):
+        self.histogram.record(elapsed)
+        if not success:
+            self.errors += 1
+        self.bytes += size
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+        self.bytes += other.bytes
+        return self
+
+    def error_rate(self):
+        return self.errors / self.histogram.count if self.histogram.count else 0
+
+    def to_dict(self):
+        return {'histogram': self.histogram.to_dict(), 'errors': self.errors, 'bytes': self.bytes}
+
+    @staticmethod
+    def from_dict(data):
+        series = Series()
+        series.histogram = Histogram.from_dict(data['histogram'])
+        series.errors = data['errors']
+        series.bytes = data['bytes']
+        return series
+
+
+class Analyzer():
+    """ Aggregates samples to per label, per journey and per time window series
+
+    :param window: time window length in seconds
+    :param last_label: label ending a journey of a thread
+    :param journeys: csv writer of the journey sums (sum_calls.pl format) or None
+    """
+    def __init__(self, window=WINDOW, last_label=LAST_LABEL, journeys=None):
+        self.window = window
+        self.last_label = last_label
+        self.labels = collections.OrderedDict()
+        self.journey = Series()
+        self.windows = {}
+        self.start = None
+        self.end = None
+        self.resources = {}
+        self._open = {}
+        self._journeys = journeys
+        if journeys:
+            journeys.writerow(JTL_FIELDS)
+
+    def add(self, timestamp, elapsed, label, thread, success, size, row=None):
+        """ Add one sample
+
+        :param timestamp: start of the sample in milliseconds since the epoch
+        :param elapsed: elapsed time in microseconds
+        :param row: JTL fields of the sample, for the journey output
+        """
+        series = self.labels.get(label)
+        if series is None:
+            series = self.labels[label] = Series()
+        series.record(elapsed, success, size)
+
+        window = timestamp // 1000 // self.window * self.window
+        series = self.windows.get(window)
+        if series is None:
+            series = self.windows[window] = Series()
+        series.record(elapsed, success, size)
+        if self.start is None or timestamp < self.start:
+            self.start = timestamp
+        if self.end is None or timestamp + elapsed // 1000 > self.end:
+            self.end = timestamp + elapsed // 1000
+
+        journey = self._open.get(thread)
+        opened = journey is None
+        if opened:
+            journey = self._open[thread] = {'elapsed': 0, 'success': True, 'bytes': 0, 'row': row}
+            if row:
+                journey['latency'] = 0
+        journey['elapsed'] += elapsed
+        journey['success'] = journey['success'] and success
+        journey['bytes'] += size
+        if row:
+            journey['latency'] += int(row['Latency'] or 0)
+            # the last label ends an open journey, the first sample of a thread starts one (as sum_calls.pl)
+        if label == self.last_label and not opened:
+            del self._open[thread]
+            self.journey.record(journey['elapsed'], journey['success'], journey['bytes'])
+            if self._journeys and journey['row']:
+                first = dict(journey['row'], elapsed=journey['elapsed'] // 1000, bytes=journey['bytes'],
+                             Latency=journey['latency'])
+                first['timeStamp'] = datetime.datetime.fromtimestamp(int(first['timeStamp']) / 1000,
+                                                                    datetime.timezone.utc).strftime('%m/%d/%Y %H:%M:%S')
+                self._journeys.writerow([first.get(field, '') for field in JTL_FIELDS])
+
+    def add_jtl(self, lines):
+        """ Add samples of JTL CSV lines (with the header line)
+        """
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        index = {name: i for i, name in enumerate(header)}
+        try:
+            timestamp, elapsed, label, thread, success, size = [
+                index[name] for name in ['timeStamp', 'elapsed', 'label', 'threadName', 'success', 'bytes']]
+        except KeyError as e:
+            raise ValueError('JTL file without %s column' % e)
+        keep_row = self._journeys is not None
+        for fields in reader:
+            if len(fields) != len(header):
+                continue
+            self.add(int(fields[timestamp]), int(fields[elapsed]) * 1000, fields[label], fields[thread],
+                     fields[success] == 'true', int(fields[size] or 0),
+                     dict(zip(header, fields)) if keep_row else None)
+
+    def add_resources(self, lines):
+        """ Add sample_resources.py CSV lines (with the header line), summed per time window and metric
+        """
+        reader = csv.reader(lines)
+        if next(reader, None) is None:
+            return
+        for fields in reader:
+            if len(fields) != 4:
+                continue
+            timestamp, source, name, value = fields
+            try:
+                value = float(value)
+            except ValueError:
+                # query texts
+                continue
+            window = int(timestamp) // 1000 // self.window * self.window
+            sums = self.resources.setdefault(window, {})
+            metric = sums.setdefault(source + '.' + name, [0, 0])
+            metric[0] += value
+            metric[1] += 1
+
+    def resource_means(self, window):
+        """ {metric: mean value} of the resource samples of the time window
+        """
+        return {metric: total / count for metric, (total, count) in self.resources.get(window, {}).items()}
+
+    def resource_metrics(self, patterns=RESOURCE_METRICS):
+        """ Sampled metrics matching any of the regexps, sorted
+        """
+        metrics = set()
+        for sums in self.resources.values():
+            metrics.update(sums)
+        return sorted(metric for metric in metrics if any(re.search(pattern, metric) for pattern in patterns))
+
+    def duration(self):
+        """ Seconds from the first sample start to the last sample end
+        """
+        return (self.end - self.start) / 1000 if self.start is not None else 0
+
+    def total(self):
+        total = Series()
+        for series in self.labels.values():
+            total.merge(series)
+        return total
+
+    def to_dict(self):
+        return {
+            'start': self.start, 'end': self.end, 'window': self.window,
+            'labels': collections.OrderedDict((label, series.to_dict()) for label, series in self.labels.items()),
+            'journey': self.journey.to_dict(),
+            'windows': [[window, self.windows[window].to_dict()] for window in sorted(self.windows)],
+            'resources': [[window, self.resource_means(window)] for window in sorted(self.windows)
+                          if window in self.resources],
+        }
+
+
+def format_row(name, series, width=60):
+    h = series.histogram
+    return '%-*s %8d %6.2f%% %9.1f %s %9.1f\n' % (
+        width, name[:width], h.count, series.error_rate() * 100, h.mean() / 1000,
+        ' '.join('%9.1f' % (h.percentile(p) / 1000) for p in PERCENTILES), (h.max or 0) / 1000)
+
+
+def print_report(analyzer, out, resource_metrics=RESOURCE_METRICS):
+    """ Per label, journey and time window tables, times in milliseconds
+
+    :param resource_metrics: regexps of the resource metrics added to the time window table
+    """
+    percentiles = ' '.join('%9s' % ('p%g' % p) for p in PERCENTILES)
+    out.write('%-60s %8s %7s %9s %s %9s\n' % ('label', 'count', 'errors', 'mean', percentiles, 'max'))
+    for label, series in analyzer.labels.items():
+        out.write(format_row(label, series))
+    total = analyzer.total()
+    out.write(format_row('TOTAL', total))
+    if analyzer.journey.histogram.count:
+        out.write(format_row('journey (up to %s)' % analyzer.last_label, analyzer.journey))
+    duration = analyzer.duration()
+    out.write('duration %.1fs, %.1f requests/s, %d journeys unfinished (times in ms)\n' % (
+        duration, total.histogram.count / duration if duration else 0, len(analyzer._open)))
+
+    if len(analyzer.windows) > 1:
+        metrics = analyzer.resource_metrics(resource_metrics)
+        out.write('\n%-20s %8s %10s %7s %9s %9s%s\n' % (
+            'window (UTC)', 'count', 'requests/s', 'errors', 'p50', 'p99',
+            ''.join(' %*s' % (max(9, len(metric)), metric) for metric in metrics)))
+        for window in sorted(analyzer.windows):
+            series = analyzer.windows[window]
+            h = series.histogram
+            means = analyzer.resource_means(window)
+            out.write('%-20s %8d %10.1f %6.2f%% %9.1f %9.1f%s\n' % (
+                datetime.datetime.fromtimestamp(window, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), h.count,
+                h.count / analyzer.window, series.error_rate() * 100, h.percentile(50) / 1000,
+                h.percentile(99) / 1000,
+                ''.join(' %*.1f' % (max(9, len(metric)), means[metric]) if metric in means
+                        else ' %*s' % (max(9, len(metric)), '-') for metric in metrics)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency percentiles, error rates and throughput of JTL files")
+    parser.add_argument("files", nargs='*', help="JTL CSV files, .gz/.zst are decompressed (default: stdin)")
+    parser.add_argument("--window", type=int, default=WINDOW, help="throughput window in seconds")
+    parser.add_argument("--last-label", default=LAST_LABEL, help="label of the last step of a journey")
+    parser.add_argument("--journeys", help="write per journey sums to this CSV file")
+    parser.add_argument("--json", help="write the histograms to this JSON file")
+    parser.add_argument("--resources", help="sample_resources.py CSV file joined by time window")
+    parser.add_argument("--resource-metric", action='append',
+                        help="regexp of source.name resource metrics shown per window (default: %s)" % ', '.join(
+                            RESOURCE_METRICS).replace('%', '%%'))
+    args = parser.parse_args()
+
+    journeys = open(args.journeys, 'w', newline='') if args.journeys else None
+    try:
+        analyzer = Analyzer(args.window, args.last_label, csv.writer(journeys, lineterminator='\n') if journeys else None)
+        try:
+            if not args.files:
+                analyzer.add_jtl(sys.stdin)
+            for path in args.files:
+                with open_input(path) as f:
+                    analyzer.add_jtl(io.TextIOWrapper(f, newline=''))
+            if args.resources:
+                with open_input(args.resources) as f:
+                    analyzer.add_resources(io.TextIOWrapper(f, newline=''))
+        except ValueError as e:
+            parser.error(str(e))
+    finally:
+        if journeys:
+            journeys.close()
+
+    print_report(analyzer, sys.stdout, args.resource_metric or RESOURCE_METRICS)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(analyzer.to_dict(), out)
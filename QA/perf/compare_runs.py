@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import argparse
+import datetime
+import io
+import json
+import math
+import re
+import statistics
+import sys
+
+from analyze_jtl import WINDOW, Analyzer, Series
+from pgcopy import open_input
+
+# Perf regression gate - compares a load run with a stored baseline run, exits 1 on regression
+#
+# A run is a JTL file (JMeter, load_journey.py --jtl) or its analyze_jtl.py --json summary.
+# "save" stores the histograms of the selected labels as the baseline, "check" compares a run with it:
+#   - p95 of a label regresses when it grows by more than --p95-tolerance percent and the growth
+#     is significant - the confidence intervals of both p95 do not overlap. The bounds are the order
+#     statistics around the 95th rank (binomial, distribution free), so small samples need bigger
+#     differences to fail and noise of a few slow requests does not.
+#   - throughput regresses when it drops by more than --throughput-tolerance percent and the upper
+#     confidence bound of requests/s (from the per window counts) is below the baseline
+#   - error rate regresses when it grows by more than --error-tolerance percentage points
+#
+# Usage:
+#    ./compare_runs.py save results.csv --baseline baseline.json --label 'products/search' --label sections
+#    ./compare_runs.py check results.csv --baseline baseline.json --p95-tolerance 15
+
+JOURNEY = 'journey'
+P95 = 95
+    # two sided 95% confidence
+Z = 1.96
+P95_TOLERANCE = 10
+THROUGHPUT_TOLERANCE = 10
+ERROR_TOLERANCE = 1
+MIN_COUNT = 20
+
+
+def load_run(path, window=WINDOW):
+    """ analyze_jtl.py summary of a JTL file, or the summary itself if path is a .json file
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    analyzer = Analyzer(window)
+    with open_input(path) as f:
+        analyzer.add_jtl(io.TextIOWrapper(f, newline=''))
+    return analyzer.to_dict()
+
+
+def run_series(run):
+    """ {label: Series} of the run, the journey under JOURNEY
+    """
+    series = {label: Series.from_dict(data) for label, data in run['labels'].items()}
+    if run['journey']['histogram']['count']:
+        series[JOURNEY] = Series.from_dict(run['journey'])
+    return series
+
+
+def select_labels(run, patterns):
+    """ Run summary restricted to the labels matching any of the patterns (all labels without patterns)
+    """
+    if not patterns:
+        return run
+    return dict(run, labels={label: data for label, data in run['labels'].items()
+                             if any(re.search(pattern, label) for pattern in patterns)})
+
+
+def quantile_bounds(histogram, percent):
+    """ (lower, upper) confidence bound of the percentile: values at ranks n*p -+ Z*sqrt(n*p*(1-p))
+    """
+    p = percent / 100
+    n = histogram.count
+    spread = Z * math.sqrt(n * p * (1 - p))
+    return histogram.value_at_rank(math.floor(n * p - spread)), histogram.value_at_rank(math.ceil(n * p + spread))
+
+
+def throughput(run):
+    """ (requests/s, upper confidence bound) of the run, the bound from the per window counts
+    """
+    counts = [data['histogram']['count'] for _, data in run['windows']]
+    duration = (run['end'] - run['start']) / 1000 if run['start'] is not None else 0
+    # windows hold all samples, labels of a baseline may be only some of them
+    total = sum(counts)
+    rate = total / duration if duration else 0
+    # first and last window are partial
+    full = counts[1:-1]
+    if len(full) < 2:
+        return rate, rate
+    mean = statistics.mean(full) / run['window']
+    return rate, max(rate, mean + Z * statistics.stdev(full) / run['window'] / math.sqrt(len(full)))
+
+
+def compare(baseline, run, p95_tolerance, throughput_tolerance, error_tolerance, min_count, out):
+    """ Print the comparison table, return number of regressions
+    """
+    regressions = 0
+    base_series = run_series(baseline)
+    run_series_ = run_series(run)
+    out.write('%-60s %10s %10s %8s %8s %8s  %s\n' % ('label', 'base p95', 'run p95', 'change', 'base err', 'run err',
+                                                     'result'))
+    for label, base in base_series.items():
+        current = run_series_.get(label)
+        if current is None:
+            out.write('%-60s %10s\n' % (label[:60], 'missing in the run - REGRESSION'))
+            regressions += 1
+            continue
+        base_p95 = base.histogram.percentile(P95)
+        run_p95 = current.histogram.percentile(P95)
+        change = (run_p95 - base_p95) / base_p95 * 100 if base_p95 else 0
+        result = []
+        if base.histogram.count < min_count or current.histogram.count < min_count:
+            result.append('too few samples')
+        else:
+            base_upper = quantile_bounds(base.histogram, P95)[1]
+            run_lower = quantile_bounds(current.histogram, P95)[0]
+            if run_p95 > base_p95 * (1 + p95_tolerance / 100) and run_lower > base_upper:
+                result.append('p95 REGRESSION')
+            if (current.error_rate() - base.error_rate()) * 100 > error_tolerance:
+                result.append('errors REGRESSION')
+        regressions += sum(1 for r in result if r.endswith('REGRESSION'))
+        out.write('%-60s %10.1f %10.1f %7.1f%% %7.2f%% %7.2f%%  %s\n' % (
+            label[:60], base_p95 / 1000, run_p95 / 1000, change, base.error_rate() * 100,
+            current.error_rate() * 100, ', '.join(result) or 'ok'))
+
+    base_rate, _ = throughput(baseline)
+    run_rate, run_upper = throughput(run)
+    result = 'ok'
+    if run_rate < base_rate * (1 - throughput_tolerance / 100) and run_upper < base_rate:
+        result = 'REGRESSION'
+        regressions += 1
+    out.write('throughput %.1f requests/s, baseline %.1f requests/s (%+.1f%%)  %s\n' % (
+        run_rate, base_rate, (run_rate - base_rate) / base_rate * 100 if base_rate else 0, result))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare a load run with a baseline, exit 1 on regression")
+    parser.add_argument("command", choices=['save', 'check'], help="save the run as baseline, or check it")
+    parser.add_argument("run", help="JTL file (.gz/.zst are decompressed) or analyze_jtl.py --json summary")
+    parser.add_argument("--baseline", required=True, help="baseline JSON file")
+    parser.add_argument("--label", action='append', help="regexp of labels stored to the baseline (default: all)")
+    parser.add_argument("--window", type=int, default=WINDOW, help="throughput window in seconds (JTL input)")
+    parser.add_argument("--p95-tolerance", type=float, default=P95_TOLERANCE,
+                        help="allowed p95 growth in percent")
+    parser.add_argument("--throughput-tolerance", type=float, default=THROUGHPUT_TOLERANCE,
+                        help="allowed throughput drop in percent")
+    parser.add_argument("--error-tolerance", type=float, default=ERROR_TOLERANCE,
+                        help="allowed error rate growth in percentage points")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT, help="labels with fewer samples are not checked")
+    args = parser.parse_args()
+
+    try:
+        run = load_run(args.run, args.window)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == 'save':
+        baseline = dict(select_labels(run, args.label), source=args.run,
+                        created=datetime.datetime.now(datetime.timezone.utc).isoformat())
+        if not baseline['labels']:
+            parser.error('no label matches --label')
+        with open(args.baseline, 'w') as out:
+            json.dump(baseline, out)
+        print('saved %d labels to %s' % (len(baseline['labels']), args.baseline))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, run, args.p95_tolerance, args.throughput_tolerance, args.error_tolerance,
+                              args.min_count, sys.stdout)
+        if regressions:
+            print('%d regression(s) against %s' % (regressions, args.baseline))
+            sys.exit(1)
@@ -1,5 +1,17 @@
 #!/usr/bin/python3
 import argparse
+import operator
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import psycopg2
+
+from pgcopy import WRITE_BUFFER_SIZE, copy_chunks, load_chunks, open_output, shard_ranges, write_chunks
+
+    # bulk load helper is shared with the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+from modules.bulkload import deferred_indexes  # noqa: E402
 
 USR_COUNT = 0
 VARIATIONS_PER_PRODUCT = 6
@@ -37,267 +49,425 @@ COMMIT;
 DELETE FROM task_queue;
 """
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--shop-count", required=True)
-args = parser.parse_args()
-USR_COUNT = int(args.shop_count)
-
-
-    # Structure
-print(HEADERS)
-print(CLEANUP)
-
-    # Channels
-print(r"""
---
--- Data for Name: channels; Type: TABLE DATA; Schema: public; Owner: hive
---
-
-COPY channels (id, name) FROM stdin;
-1	Etsy
-\.""")
-
-    # Accounts
-print(r"SELECT pg_catalog.setval('account_id_seq', " + str(USR_COUNT) + ", true);")
-print(r'COPY accounts (id, company_id, channel_id, property_name, property_value) FROM stdin;')
-for i in range(1, USR_COUNT + 1):
-    print(str(i) + '	' + str(i) + '	1	token	MyAccesToken1')
-    print(str(i) + '	' + str(i) + '	1	tokenSecret	MyAccessTokenSecret1')
-print(r'\.')
-
-    # Image data
-print(r"""
---
--- Data for Name: image_data; Type: TABLE DATA; Schema: public; Owner: hive
---
-
-COPY image_data (image_id, image, mime, filename) FROM stdin;
-\.
-""")
-
-print(r"SELECT pg_catalog.setval('image_id_seq', " + str(PRODUCT_COUNT * USR_COUNT) + ", true);")
-print(r"""
---
--- Data for Name: images; Type: TABLE DATA; Schema: public; Owner: hive
---
+MODIFIED_AT = '2016-03-31 15:43:17.11947+00'
+
+    # (property_name, property_value, modified_at) of a product row, in dump order
+    # value '{listing_id}' is replaced by zero padded product id, '{variation}' by the next variation id
+PRODUCT_PROPERTIES = [
+    ('listing_id', '{listing_id}', MODIFIED_AT),
+    ('title', 'Best gadget {listing_id}', MODIFIED_AT),
+    ('category_path', '["Art"]', MODIFIED_AT),
+    ('category_path_ids', '[68887312]', MODIFIED_AT),
+    ('category_id', '68933642', MODIFIED_AT),
+    ('recipient', 'men', MODIFIED_AT),
+    ('occasion', 'anniversary', MODIFIED_AT),
+    ('non_taxable', 'false', MODIFIED_AT),
+    ('file_data', '', MODIFIED_AT),
+    ('used_manufacturer', 'false', MODIFIED_AT),
+    ('ending_tsz', '1460803506', MODIFIED_AT),
+    ('who_made', 'i_did', MODIFIED_AT),
+    ('original_creation_tsz', '1450266306', MODIFIED_AT),
+    ('state', 'active', MODIFIED_AT),
+    ('description', 'invisible gloves', MODIFIED_AT),
+    ('last_modified_tsz', '1450269283', MODIFIED_AT),
+    ('is_private', 'false', MODIFIED_AT),
+    ('should_auto_renew', 'false', MODIFIED_AT),
+    ('url', 'https://www.etsy.com/listing/260850358/nothing-to-see-here2?utm_source=etsytestapp&utm_medium=api&utm_campaign=api', MODIFIED_AT),
+    ('quantity', '1', MODIFIED_AT),
+    ('language', 'en-US', MODIFIED_AT),
+    ('is_supply', 'false', MODIFIED_AT),
+    ('num_favorers', '0', MODIFIED_AT),
+    ('when_made', 'before_1996', MODIFIED_AT),
+    ('taxonomy_id', '1490', MODIFIED_AT),
+    ('state_tsz', '1450266306', MODIFIED_AT),
+    ('taxonomy_path', '["Shoes","Unisex Adult Shoes","Boots","Walking & Hiking Boots"]', MODIFIED_AT),
+    ('price', '5.15', MODIFIED_AT),
+    ('user_id', '75630222', MODIFIED_AT),
+    ('has_variations', 'true', MODIFIED_AT),
+    ('currency_code', 'CZK', MODIFIED_AT),
+    ('is_customizable', 'false', MODIFIED_AT),
+    ('is_digital', 'false', MODIFIED_AT),
+    ('creation_tsz', '1450266306', MODIFIED_AT),
+    ('views', '0', MODIFIED_AT),
+    ('_HIVE_thumbnails_url', 'https://img0.etsystatic.com/110/0/11980898/il_75x75.865542738_jgog.jpg', MODIFIED_AT),
+    ('_HIVE_top_category', 'Clothing', MODIFIED_AT),
+    ('tags', '["Tag01","Tag02","Tag03"]', MODIFIED_AT),
+    ('materials', '["wool","cotton"]', MODIFIED_AT),
+    ('style', '["Geek","Sport"]', MODIFIED_AT),
+] + [('variation', '{variation}', MODIFIED_AT)] * VARIATIONS_PER_PRODUCT + [
+    ('_HIVE_photos', '[1]', MODIFIED_AT),
+    ('_HIVE_tags', 'german', '2016-04-26 09:37:44.06121+00'),
+    ('_HIVE_variations_with_price', 'false', '2016-04-25 22:12:22.582802+00'),
+]
+
+SECTIONS = [
+    b'15183328\tOn Sale',
+    b'15180189\tHoliday Gifts',
+    b'17365192\tSummer Sale',
+    b'18790753\tde',
+    b'18787742\tbbbaa',
+    b'18790755\teeee',
+]
+
+ACCOUNT_ROWS = b'%d\t%d\t1\ttoken\tMyAccesToken1\n%d\t%d\t1\ttokenSecret\tMyAccessTokenSecret1\n'
+IMAGE_ROW = b'%d\t%d\t865542738\thttps://img0.etsystatic.com/110/0/11980898/il_75x75.865542738_jgog.jpg\thttps://img0.etsystatic.com/110/0/11980898/il_fullxfull.865542738_jgog.jpg\t1\n'
+PRODUCT_VARIATION_ROWS = b'%d\t%d\tis_available\ttrue\n%d\t%d\tprice\t5.15\n'
+SHOP_ROWS = (b'%d\t%d\tchannelShopId\t8545731\n'
+             b'%d\t%d\tname\tHiveDemo\n'
+             b'%d\t%d\t_lastSyncAttempt\t1459433943\n'
+             b'%d\t%d\t_total\t500\n'
+             b'%d\t%d\t_sync\tsync\n'
+             b'%d\t%d\t_done\t500\n')
+
+CHANNEL_ROWS = b'1\tEtsy\n'
+VARIATION_ROWS = (b'1\tColor\tBlue\n'
+                  b'2\tColor\tGreen\n'
+                  b'3\tColor\tRed\n'
+                  b'4\tFabric\twool\n'
+                  b'5\tFabric\tcotton\n')
+
+    # variation_combinations rows of one product: (n-th variation of the product, variation id)
+VARIATION_COMBINATIONS = [(0, 1), (0, 4), (1, 1), (1, 5), (2, 2), (2, 4), (3, 2), (3, 5), (4, 3), (4, 4), (5, 3), (5, 5)]
+
+
+def product_template():
+    """ Build bytes %-template of all rows of one product and the getter of its arguments.
+
+    The template is filled by `template % getter(values)`, where values are
+    (product_id, listing_id, variation_1, ... variation_n) - all as bytes.
+    b'{shop}' placeholder is left in the template, it is replaced once per shop.
+    """
+    rows = []
+    args = []
+    variation = 2
+    for name, value, modified_at in PRODUCT_PROPERTIES:
+        args.append(0)
+        if value == '{variation}':
+            value = '%b'
+            args.append(variation)
+            variation += 1
+        elif '{listing_id}' in value:
+            value = value.replace('%', '%%').replace('{listing_id}', '%b')
+            args.append(1)
+        else:
+            value = value.replace('%', '%%')
+        rows.append('%b\t{shop}\t' + name + '\t' + value + '\t' + modified_at + '\n')
+    return ''.join(rows).encode('utf-8'), operator.itemgetter(*args)
+
+
+def variation_combinations_template():
+    """ Build bytes %-template of variation_combinations rows of one product and the getter of its arguments.
+    The getter picks the arguments from the ids of the product variations, in order.
+    """
+    template = b''.join(b'%d\t' + str(variation_id).encode() + b'\n' for _, variation_id in VARIATION_COMBINATIONS)
+    return template, operator.itemgetter(*[n for n, _ in VARIATION_COMBINATIONS])
+
+
+def setval(sequence, value):
+    return b"SELECT pg_catalog.setval('%b', %d, true);\n" % (sequence.encode(), value)
+
+
+def gen_channels(shops):
+    yield CHANNEL_ROWS
+
+
+def gen_accounts(shops):
+    yield b''.join([ACCOUNT_ROWS % (i, i, i, i) for i in shops])
+
+
+def gen_images(shops):
+    for shop in shops:
+        first = first_product_id(shop)
+        yield b''.join([IMAGE_ROW % (i, i) for i in range(first, first + PRODUCT_COUNT)])
+
+
+def gen_product_variations(shops):
+    per_shop = PRODUCT_COUNT * VARIATIONS_PER_PRODUCT
+    for shop in shops:
+        first = first_variation_id(shop)
+        yield b''.join([PRODUCT_VARIATION_ROWS % (i, i, i, i) for i in range(first, first + per_shop)])
+
+
+def gen_products(shops):
+    template, getter = product_template()
+    for shop in shops:
+        # fill in shop id once per shop, product ids are filled in per product
+        shop_template = template.replace(b'{shop}', str(shop).encode())
+        first = first_product_id(shop)
+        chunk = []
+        for product_id in range(first, first + PRODUCT_COUNT):
+            variation = (product_id - 1) * VARIATIONS_PER_PRODUCT + 1
+            values = (b'%d' % product_id, b'%04d' % product_id) + \
+                tuple([b'%d' % v for v in range(variation, variation + VARIATIONS_PER_PRODUCT)])
+            chunk.append(shop_template % getter(values))
+        yield b''.join(chunk)
+
+
+def gen_shop_sections(shops):
+    rows = [b'%d\t%d\t' + s.replace(b'%', b'%%') + b'\n' for s in SECTIONS]
+    for shop in shops:
+        first = (shop - 1) * len(SECTIONS) + 1
+        yield b''.join([row % (first + n, shop) for n, row in enumerate(rows)])
+
+
+def gen_shops(shops):
+    yield b''.join([SHOP_ROWS % ((shop,) * 12) for shop in shops])
+
+
+def gen_variations(shops):
+    yield VARIATION_ROWS
+
+
+def gen_variation_combinations(shops):
+    template, getter = variation_combinations_template()
+    per_shop = PRODUCT_COUNT * VARIATIONS_PER_PRODUCT
+    for shop in shops:
+        first = first_variation_id(shop)
+        yield b''.join([template % getter(range(i, i + VARIATIONS_PER_PRODUCT))
+                        for i in range(first, first + per_shop, VARIATIONS_PER_PRODUCT)])
+
+
+    # table -> (COPY column list, rows generator)
+COPY_TABLES = {
+    'channels': ('id, name', gen_channels),
+    'accounts': ('id, company_id, channel_id, property_name, property_value', gen_accounts),
+    'images': ('id, product_id, channel_image_id, thumbnail_url, fullsize_url, rank', gen_images),
+    'product_variations': ('id, variation_combination_id, property_name, property_value', gen_product_variations),
+    'products': ('id, shop_id, property_name, property_value, modified_at', gen_products),
+    'shop_sections': ('id, shop_id, section_id, value', gen_shop_sections),
+    'shops': ('id, account_id, property_name, property_value', gen_shops),
+    'variations': ('id, variation_name, variation_value', gen_variations),
+    'variation_combinations': ('id, variation_id', gen_variation_combinations),
+}
+    # tables with fixed content, loaded once before the shards
+STATIC_TABLES = ['channels', 'variations']
+    # tables generated per shop, each shard of shops is generated and loaded independently
+SHARDED_TABLES = ['accounts', 'shops', 'shop_sections', 'products', 'product_variations', 'variation_combinations', 'images']
 
-COPY images (id, product_id, channel_image_id, thumbnail_url, fullsize_url, rank) FROM stdin;""")
 
-for i in range(1, (PRODUCT_COUNT * USR_COUNT) + 1):
-    print(str(i) + '\t' + str(i) + '\t' + r'865542738	https://img0.etsystatic.com/110/0/11980898/il_75x75.865542738_jgog.jpg	https://img0.etsystatic.com/110/0/11980898/il_fullxfull.865542738_jgog.jpg	1')
-print(r'\.')
-print(r"SELECT pg_catalog.setval('product_id_seq', " + str(USR_COUNT) + ", true);")
-
-    # Product variations
-var_cnt = USR_COUNT * VARIATIONS_PER_PRODUCT * PRODUCT_COUNT
-print(r"SELECT pg_catalog.setval('product_variation_id_seq', " + str(var_cnt) + ", true);")
-print(r'COPY product_variations (id, variation_combination_id, property_name, property_value) FROM stdin;')
-for i in range(1, var_cnt + 1):
-    print(str(i) + '\t' + str(i) + '\t' + 'is_available	true')
-    print(str(i) + '\t' + str(i) + '\t' + 'price	5.15')
-print(r'\.')
-
-
-    # Products
-print(r"""
---
--- Data for Name: products; Type: TABLE DATA; Schema: public; Owner: hive
---
+def first_product_id(shop):
+    return (shop - 1) * PRODUCT_COUNT + 1
 
-COPY products (id, shop_id, property_name, property_value, modified_at) FROM stdin;""")
-
-prod_variation = 1; product_id = 1
-for shop in range(1, USR_COUNT + 1):
-    for product in range(PRODUCT_COUNT):
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'listing_id	' + '{:04d}'.format(product_id) + '	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'title	Best gadget ' + '{:04d}'.format(product_id) + '	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'category_path	["Art"]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'category_path_ids	[68887312]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'category_id	68933642	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'recipient	men	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'occasion	anniversary	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'non_taxable	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'file_data		2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'used_manufacturer	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'ending_tsz	1460803506	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'who_made	i_did	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'original_creation_tsz	1450266306	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'state	active	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'description	invisible gloves	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'last_modified_tsz	1450269283	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'is_private	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'should_auto_renew	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'url	https://www.etsy.com/listing/260850358/nothing-to-see-here2?utm_source=etsytestapp&utm_medium=api&utm_campaign=api	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'quantity	1	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'language	en-US	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'is_supply	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'num_favorers	0	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'when_made	before_1996	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'taxonomy_id	1490	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'state_tsz	1450266306	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'taxonomy_path	["Shoes","Unisex Adult Shoes","Boots","Walking & Hiking Boots"]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'price	5.15	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'user_id	75630222	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'has_variations	true	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'currency_code	CZK	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'is_customizable	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'is_digital	false	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'creation_tsz	1450266306	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'views	0	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'_HIVE_thumbnails_url	https://img0.etsystatic.com/110/0/11980898/il_75x75.865542738_jgog.jpg	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'_HIVE_top_category	Clothing	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'tags	["Tag01","Tag02","Tag03"]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'materials	["wool","cotton"]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'style	["Geek","Sport"]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'variation	' + str(prod_variation) + '	2016-03-31 15:43:17.11947+00'); prod_variation += 1
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'_HIVE_photos	[1]	2016-03-31 15:43:17.11947+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'_HIVE_tags	german	2016-04-26 09:37:44.06121+00')
-        print(str(product_id) + '\t' + str(shop) + '\t' + r'_HIVE_variations_with_price	false	2016-04-25 22:12:22.582802+00')
-        product_id += 1
-print(r'\.')
-
-print(r"""
---
--- Name: shop_id_seq; Type: SEQUENCE SET; Schema: public; Owner: hive
---
 
-SELECT pg_catalog.setval('shop_id_seq', """ + str(USR_COUNT) + """, true);
-""")
+def first_variation_id(shop):
+    return (shop - 1) * PRODUCT_COUNT * VARIATIONS_PER_PRODUCT + 1
 
-    # shop sections
-print(r"""
---
--- Data for Name: shop_sections; Type: TABLE DATA; Schema: public; Owner: hive
---
 
-COPY shop_sections (id, shop_id, section_id, value) FROM stdin;""")
-i = 0
-for section in range(1, USR_COUNT + 1):
-    sections = [
-        '15183328	On Sale',
-        '15180189	Holiday Gifts',
-        '17365192	Summer Sale',
-        '18790753	de',
-        '18787742	bbbaa',
-        '18790755	eeee',
+def sequences(shop_count):
+    """ Return [(sequence, value)] to set after the data are loaded
+    """
+    return [
+        ('account_id_seq', shop_count),
+        ('image_id_seq', PRODUCT_COUNT * shop_count),
+        ('product_id_seq', shop_count),
+        ('product_variation_id_seq', shop_count * VARIATIONS_PER_PRODUCT * PRODUCT_COUNT),
+        ('shop_id_seq', shop_count),
+        ('shop_sections_id_seq', len(SECTIONS) * shop_count),
+        ('task_queue_id_seq', 1),
+        ('variation_id_seq', 5),
+        ('variation_combinations_id_seq', shop_count * PRODUCT_COUNT * VARIATIONS_PER_PRODUCT),
     ]
-    for s in sections:
-        i += 1
-        print(str(i) + '\t' + str(section) + '\t' + s)
-print(r'\.')
 
 
-print(r"""
---
--- Name: shop_sections_id_seq; Type: SEQUENCE SET; Schema: public; Owner: hive
---
+def copy_statement(table):
+    return b'COPY ' + table.encode() + b' (' + COPY_TABLES[table][0].encode() + b') FROM stdin;\n'
 
-SELECT pg_catalog.setval('shop_sections_id_seq', """ + str(len(sections) * USR_COUNT)+ """, true);
-""")
 
+def copy_block(table, shops):
+    """ Yield COPY statement, rows and end-of-data marker of one table
+    """
+    yield copy_statement(table)
+    yield from COPY_TABLES[table][1](shops)
+    yield b'\\.\n'
 
-    # Shops
-print(r"""
---
--- Data for Name: shops; Type: TABLE DATA; Schema: public; Owner: hive
---
-
-COPY shops (id, account_id, property_name, property_value) FROM stdin;""")
-for shop in range(1, USR_COUNT + 1):
-    s = str(shop) 
-    print(s + '\t' + s + '\t' + 'channelShopId	8545731')
-    print(s + '\t' + s + '\t' + 'name	HiveDemo')
-    print(s + '\t' + s + '\t' + '_lastSyncAttempt	1459433943')
-    print(s + '\t' + s + '\t' + '_total	500')
-    print(s + '\t' + s + '\t' + '_sync	sync')
-    print(s + '\t' + s + '\t' + '_done	500')
-print(r'\.')
 
+def table_comment(table):
+    return b'\n--\n-- Data for Name: ' + table.encode() + b'; Type: TABLE DATA; Schema: public; Owner: hive\n--\n\n'
 
-    # task queue
-print(r"""
---
--- Data for Name: task_queue; Type: TABLE DATA; Schema: public; Owner: hive
---
 
-COPY task_queue (id, company_id, channel_id, operation, operation_data, created_at, state, state_expires_at, retry, parent_id, suspension_point, result, modified) FROM stdin;
-\.
+def sequence_comment(sequence):
+    return b'\n--\n-- Name: ' + sequence.encode() + b'; Type: SEQUENCE SET; Schema: public; Owner: hive\n--\n\n'
 
 
---
--- Name: task_queue_id_seq; Type: SEQUENCE SET; Schema: public; Owner: hive
---
+def gen_dump(shop_count):
+    """ Yield the whole SQL dump as a sequence of bytes chunks
+    """
+    seq = dict(sequences(shop_count))
+    shops = range(1, shop_count + 1)
 
-SELECT pg_catalog.setval('task_queue_id_seq', 1, true);
-""")
+        # Structure
+    yield HEADERS.encode() + b'\n'
+    yield CLEANUP.encode() + b'\n'
 
-    # users
-print(r"""
---
--- Data for Name: user_profiles; Type: TABLE DATA; Schema: public; Owner: hive
---
+        # Channels
+    yield table_comment('channels')
+    yield from copy_block('channels', shops)
 
-COPY user_profiles (user_id, property_name, property_value) FROM stdin;
-\.
+        # Accounts
+    yield setval('account_id_seq', seq['account_id_seq'])
+    yield from copy_block('accounts', shops)
 
-""")
+        # Image data
+    yield table_comment('image_data')
+    yield b'COPY image_data (image_id, image, mime, filename) FROM stdin;\n\\.\n\n'
 
+    yield setval('image_id_seq', seq['image_id_seq'])
+    yield table_comment('images')
+    yield from copy_block('images', shops)
+    yield setval('product_id_seq', seq['product_id_seq'])
 
-    # variations
-print(r"""
---
--- Name: variation_id_seq; Type: SEQUENCE SET; Schema: public; Owner: hive
---
+        # Product variations
+    yield setval('product_variation_id_seq', seq['product_variation_id_seq'])
+    yield from copy_block('product_variations', shops)
 
-SELECT pg_catalog.setval('variation_id_seq', 5, true);
+        # Products
+    yield table_comment('products')
+    yield from copy_block('products', shops)
 
+    yield sequence_comment('shop_id_seq') + setval('shop_id_seq', seq['shop_id_seq']) + b'\n'
 
---
--- Data for Name: variations; Type: TABLE DATA; Schema: public; Owner: hive
---
+        # shop sections
+    yield table_comment('shop_sections')
+    yield from copy_block('shop_sections', shops)
 
-COPY variations (id, variation_name, variation_value) FROM stdin;
-1	Color	Blue
-2	Color	Green
-3	Color	Red
-4	Fabric	wool
-5	Fabric	cotton
-\.
-""")
+    yield sequence_comment('shop_sections_id_seq') + setval('shop_sections_id_seq', seq['shop_sections_id_seq']) + b'\n'
 
-    # variation_combinations
-print(r"""
+        # Shops
+    yield table_comment('shops')
+    yield from copy_block('shops', shops)
 
---
--- Data for Name: variation_combinations; Type: TABLE DATA; Schema: public; Owner: hive
--- (maps product_variation -> variation)
-
-COPY variation_combinations (id, variation_id) FROM stdin;""")
-i = 1
-for x in range(USR_COUNT * PRODUCT_COUNT):
-    print(str(i) + '\t1')
-    print(str(i) + '\t4'); i += 1
-    print(str(i) + '\t1')
-    print(str(i) + '\t5'); i += 1
-    print(str(i) + '\t2')
-    print(str(i) + '\t4'); i += 1
-    print(str(i) + '\t2')
-    print(str(i) + '\t5'); i += 1
-    print(str(i) + '\t3')
-    print(str(i) + '\t4'); i += 1
-    print(str(i) + '\t3')
-    print(str(i) + '\t5'); i += 1
-print(r'\.')
-print("""
---
--- Name: variation_combinations_id_seq; Type: SEQUENCE SET; Schema: public; Owner: hive
---
+        # task queue
+    yield table_comment('task_queue')
+    yield b'COPY task_queue (id, company_id, channel_id, operation, operation_data, created_at, state, state_expires_at, retry, parent_id, suspension_point, result, modified) FROM stdin;\n\\.\n\n'
+    yield sequence_comment('task_queue_id_seq') + setval('task_queue_id_seq', seq['task_queue_id_seq']) + b'\n'
 
-SELECT pg_catalog.setval('variation_combinations_id_seq', """ + str(USR_COUNT * PRODUCT_COUNT * VARIATIONS_PER_PRODUCT) + """, true);
-""")
+        # users
+    yield table_comment('user_profiles')
+    yield b'COPY user_profiles (user_id, property_name, property_value) FROM stdin;\n\\.\n\n\n'
 
+        # variations
+    yield sequence_comment('variation_id_seq') + setval('variation_id_seq', seq['variation_id_seq']) + b'\n'
+    yield table_comment('variations')
+    yield from copy_block('variations', shops)
+    yield b'\n'
+
+        # variation_combinations
+    yield b'\n\n--\n-- Data for Name: variation_combinations; Type: TABLE DATA; Schema: public; Owner: hive\n-- (maps product_variation -> variation)\n\n'
+    yield from copy_block('variation_combinations', shops)
+    yield sequence_comment('variation_combinations_id_seq') + \
+        setval('variation_combinations_id_seq', seq['variation_combinations_id_seq']) + b'\n'
+
+
+def load_shard(dsn, table, shops):
+    """ Generate rows of one table for a shard of shops and COPY them to the database over own connection
+    """
+    load_chunks(dsn, table, COPY_TABLES[table][0], COPY_TABLES[table][1](shops))
+    return table, shops
+
+
+def load_dump(dsn, shop_count, jobs, shard_count):
+    """ Load the dataset directly to the database, no intermediate dump file
+
+    Static tables are copied over one connection, then every (table, shard) pair
+    is generated and copied by a pool of processes, each with its own connection.
+    Sequences are set at the end.
+    """
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(HEADERS + CLEANUP)
+    conn.autocommit = False
+    for table in STATIC_TABLES:
+        copy_chunks(conn, table, COPY_TABLES[table][0], COPY_TABLES[table][1](None))
+    conn.commit()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(load_shard, dsn, table, shops)
+                   for table in SHARDED_TABLES for shops in shard_ranges(shop_count, shard_count)]
+        for future in as_completed(futures):
+            table, shops = future.result()
+            print('loaded', table, 'shops', shops.start, '-', shops.stop - 1, file=sys.stderr)
+
+    for sequence, value in sequences(shop_count):
+        cur.execute('SELECT pg_catalog.setval(%s, %s, true)', [sequence, value])
+    conn.commit()
+    conn.close()
+
+
+def shard_file_name(table, shard_no):
+    return table + '.' + '{:04d}'.format(shard_no) + '.copy'
+
+
+def write_shard(output_dir, table, shard_no, shops):
+    """ Write rows of one table for a shard of shops to <output_dir>/<table>.<shard_no>.copy
+    The file holds COPY text data only, shard files of a table can be concatenated.
+    """
+    with open(os.path.join(output_dir, shard_file_name(table, shard_no)), 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+        write_chunks(out, COPY_TABLES[table][1](shops))
+    return table, shops
+
+
+def write_shards(output_dir, shop_count, jobs, shard_count):
+    """ Generate the dataset as per shard COPY files by a pool of processes
+
+    <output_dir> gets:
+        00-pre.sql            - cleanup and static tables
+        <table>.<shard>.copy  - COPY text data of each shard
+        99-post.sql           - sequences
+        load.sql              - psql script loading all of the above (run it from <output_dir>)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shards = list(enumerate(shard_ranges(shop_count, shard_count), 1))
+
+    with open(os.path.join(output_dir, '00-pre.sql'), 'wb') as out:
+        write_chunks(out, [HEADERS.encode(), CLEANUP.encode()])
+        for table in STATIC_TABLES:
+            write_chunks(out, copy_block(table, None))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(write_shard, output_dir, table, shard_no, shops)
+                   for table in SHARDED_TABLES for shard_no, shops in shards]
+        for future in as_completed(futures):
+            table, shops = future.result()
+            print('written', table, 'shops', shops.start, '-', shops.stop - 1, file=sys.stderr)
+
+    with open(os.path.join(output_dir, '99-post.sql'), 'wb') as out:
+        write_chunks(out, [setval(sequence, value) for sequence, value in sequences(shop_count)])
+
+    with open(os.path.join(output_dir, 'load.sql'), 'w') as out:
+        out.write('\\set ON_ERROR_STOP 1\n\\i 00-pre.sql\n')
+        for table in SHARDED_TABLES:
+            for shard_no, _ in shards:
+                out.write('\\copy ' + table + ' (' + COPY_TABLES[table][0] + ") FROM '" +
+                          shard_file_name(table, shard_no) + "'\n")
+        out.write('\\i 99-post.sql\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shop-count", required=True)
+    parser.add_argument("--output", help="write the dump to this file instead of stdout, .gz/.zst are compressed")
+    parser.add_argument("--output-dir", help="write per shard COPY files and load.sql to this directory")
+    parser.add_argument("--dsn", help="load the data directly to this database instead of writing a dump")
+    parser.add_argument("--bulk", action='store_true',
+                        help="drop indexes and foreign keys for the --dsn load, rebuild them after")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes for --output-dir and --dsn")
+    parser.add_argument("--shards", type=int, help="number of shop ranges (default: --jobs)")
+    args = parser.parse_args()
+    USR_COUNT = int(args.shop_count)
+    shard_count = args.shards or args.jobs
+
+    if args.dsn and args.bulk:
+        with deferred_indexes(args.dsn, STATIC_TABLES + SHARDED_TABLES, args.jobs):
+            load_dump(args.dsn, USR_COUNT, args.jobs, shard_count)
+    elif args.dsn:
+        load_dump(args.dsn, USR_COUNT, args.jobs, shard_count)
+    elif args.output_dir:
+        write_shards(args.output_dir, USR_COUNT, args.jobs, shard_count)
+    else:
+        if args.output:
+            out = open_output(args.output)
+        else:
+            out = open(sys.stdout.fileno(), 'wb', buffering=WRITE_BUFFER_SIZE, closefd=False)
+        with out:
+            write_chunks(out, gen_dump(USR_COUNT))
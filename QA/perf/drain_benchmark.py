@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+
+import psycopg2
+
+from analyze_jtl import PERCENTILES, Series, format_row
+from sample_resources import FIELDS
+from sync_benchmark import start_product
+
+    # product control and the Etsy emulator of the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+from modules.rabbit import Rabbit, setup_rabbit  # noqa: E402
+from tests.base import HIVE_DATABASE_URL, BaseTestClass, set_pg_environment  # noqa: E402
+import tests.vela_control as vela  # noqa: E402
+
+# Task queue drain benchmark - how fast the manager and workers sync thousands of shops at once
+# (as after a deploy). For every number of worker processes:
+#   - stops the product, loads --shops empty Etsy shops of the perf dataset (gen_shops.py --products 0
+#     run by the Python >= 3.8 of --perf-python), sets the emulator scenario perf_drain (any shop id
+#     is a shop without listings) and starts the product with QA_WORKER_PROCESSES workers
+#   - publishes syncShop messages of all the shops to <db>.manager-tasks (as trigger_etsy_shop_sync)
+#   - every --interval seconds samples task_queue rows by operation and state, shops by sync_status
+#     and the ready messages of the manager queue, until every shop finished its sync
+# Reports the drain time, the peak queue depth (unfinished task_queue rows) and the latency
+# distribution of the shops from the publish of the message to the task_queue row (intake) and to
+# the end of the shop sync (shops.last_sync_timestamp). Shops failing the sync count as errors - not
+# up_to_date at the end, or their last syncShop task failed or aborted (no retry left) without a new
+# last_sync_timestamp, these finish when the sample sees the failed task.
+# --samples writes the samples in the sample_resources.py format.
+#
+# Usage:
+#    ./drain_benchmark.py --shops 5000 --workers 1,2,4,8 --json drain.json
+#    ./drain_benchmark.py --shops 1000 --samples drain-samples.csv
+#    ./drain_benchmark.py --shops 1000 --perf-python /usr/bin/python3.8
+
+SHOPS = 1000
+WORKERS = '1'
+SCENARIO = 'perf_drain'
+DB_NAME = 'db1'
+INTERVAL = 1
+TIMEOUT = 3600
+GEN_SHOPS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gen_shops.py')
+    # gen_shops.py needs Python >= 3.8, the harness running this script may be older - the interpreter
+    # of the perf tools environment (requirements.txt of QA/perf)
+PERF_PYTHON = os.environ.get('QA_PERF_PYTHON',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'venv', 'bin', 'python'))
+SYNC_SHOP = 'syncShop'
+FINISHED_STATES = ['done', 'failed', 'aborted']
+FAILED_STATES = ('failed', 'aborted')
+SYNCING = 'sync'
+UP_TO_DATE = 'up_to_date'
+
+TASKS_SQL = """
+SELECT operation, coalesce(state, 'new'), count(*) FROM task_queue GROUP BY 1, 2
+"""
+    # shops finish with a new last_sync_timestamp (syncFinished, setShopStatus) and not in sync, or fail
+    # when their last syncShop task (a retry replaces the failed one by a new task) failed or aborted
+SHOPS_SQL = """
+WITH last_task AS (
+    SELECT DISTINCT ON (operation_data) operation_data, state FROM task_queue
+    WHERE operation = %(operation)s AND created_at >= %(start)s
+    ORDER BY operation_data, id DESC
+), shop AS (
+    SELECT s.id, s.sync_status, coalesce(s.last_sync_timestamp >= %(start)s AND s.sync_status <> %(syncing)s,
+                                         false) AS synced, t.state IN %(failed)s AS failed
+    FROM shops s LEFT JOIN last_task t ON t.operation_data = s.id::text
+)
+SELECT sync_status, count(*), count(*) FILTER (WHERE synced),
+    coalesce(array_agg(id) FILTER (WHERE failed AND NOT synced), '{}')
+FROM shop GROUP BY 1
+"""
+LATENCY_SQL = """
+SELECT s.id, s.sync_status, s.last_sync_timestamp,
+    (SELECT min(t.created_at) FROM task_queue t
+     WHERE t.operation = %s AND t.operation_data = s.id::text AND t.created_at >= %s)
+FROM shops s
+"""
+
+
+def load_shops(shops, perf_python=PERF_PYTHON):
+    """ Replace the hive database data by shops Etsy shops without products
+    """
+    subprocess.check_call([perf_python, GEN_SHOPS, '--etsy-shops', str(shops), '--products', '0',
+                           '--dsn', HIVE_DATABASE_URL])
+
+
+class Sampler():
+    """ Samples of task_queue and shops, written to a sample_resources.py CSV writer
+    """
+    def __init__(self, conn, start, started, queue, writer=None):
+        self.cur = conn.cursor()
+        self.start = start
+        self.started = started
+        self.queue = queue
+        self.writer = writer
+        self.rabbit = Rabbit()
+        self.peak = 0
+        self.peak_sync_shop = 0
+        self.failed = {}  # {shop id: seconds after started its failed sync was seen}
+
+    def sample(self):
+        """ Sample now, return (finished shops - synced or failed, all shops)
+        """
+        timestamp = int(time.time() * 1000)
+        values = []
+        self.cur.execute(TASKS_SQL)
+        pending = pending_sync_shop = 0
+        for operation, state, count in self.cur.fetchall():
+            values.append(('task_queue', '%s.%s' % (operation, state), count))
+            if state not in FINISHED_STATES:
+                pending += count
+                if operation == SYNC_SHOP:
+                    pending_sync_shop += count
+        values.append(('task_queue', 'pending', pending))
+        self.peak = max(self.peak, pending)
+        self.peak_sync_shop = max(self.peak_sync_shop, pending_sync_shop)
+
+        self.cur.execute(SHOPS_SQL, {'operation': SYNC_SHOP, 'start': self.start, 'syncing': SYNCING,
+                                     'failed': FAILED_STATES})
+        finished = shops = 0
+        failed = set()
+        for status, count, synced, failed_ids in self.cur.fetchall():
+            values.append(('shops', status, count))
+            shops += count
+            finished += synced
+            failed.update(failed_ids)
+        now = time.monotonic() - self.started
+        for shop in failed:
+            self.failed.setdefault(shop, now)
+        finished += len(failed)
+        values.append(('shops', 'finished', finished))
+        values.append(('shops', 'failed', len(failed)))
+
+        try:
+            for name, (messages, _) in self.rabbit.queue_depths([self.queue]).items():
+                values.append(('rabbit', 'queue.%s.ready' % name, messages))
+        except Exception as e:
+            print('cannot sample %s: %s' % (self.queue, e), file=sys.stderr)
+        if self.writer:
+            for source, name, value in values:
+                self.writer.writerow([timestamp, source, name, value])
+        return finished, shops
+
+
+def latencies(conn, start, published, failed):
+    """ (intake, sync) latency series of the shops and seconds from start to the last finished sync
+
+    :param start: database time of the first publish
+    :param published: {shop id: seconds of its publish after start}
+    :param failed: {shop id: seconds after start its failed sync was seen} of the shops failed without sync
+    """
+    intake = Series()
+    sync = Series()
+    drain = 0
+    cur = conn.cursor()
+    cur.execute(LATENCY_SQL, [SYNC_SHOP, start])
+    for shop, status, last_sync, created in cur.fetchall():
+        if shop not in published:
+            continue
+        offset = published[shop]
+        if created is not None:
+            intake.record(max(0, int(((created - start).total_seconds() - offset) * 1000000)), True, 0)
+        if shop in failed:
+            finished, ok = failed[shop], False
+        else:
+            finished, ok = (last_sync - start).total_seconds(), status == UP_TO_DATE
+        sync.record(max(0, int((finished - offset) * 1000000)), ok, 0)
+        drain = max(drain, finished)
+    return intake, sync, drain
+
+
+def benchmark(shops, workers, db_name, interval, timeout, writer, perf_python=PERF_PYTHON):
+    product = BaseTestClass()
+    product.stop_all()
+    setup_rabbit()
+    load_shops(shops, perf_python)
+    product.set_etsy_testcase(SCENARIO)
+    start_product(workers, scenario='drain_benchmark shops=%d workers=%d' % (shops, workers))
+
+    set_pg_environment('HIVE')
+    conn = psycopg2.connect('')
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT clock_timestamp()')
+        start = cur.fetchone()[0]
+        started = time.monotonic()
+        published = {}
+        vela.trigger_etsy_shops_sync(((shop, shop) for shop in range(1, shops + 1)), db_name,
+                                     lambda message: published.__setitem__(int(message['operationData']),
+                                                                           time.monotonic() - started))
+        publish_seconds = time.monotonic() - started
+
+        sampler = Sampler(conn, start, started, '%s.manager-tasks' % db_name, writer)
+        while True:
+            finished, total = sampler.sample()
+            if finished >= total:
+                break
+            if time.monotonic() - started > timeout:
+                raise Exception('%d of %d shops not synced in %d s' % (total - finished, total, timeout))
+            time.sleep(interval)
+
+        intake, sync, drain = latencies(conn, start, published, sampler.failed)
+    finally:
+        conn.close()
+    return {'shops': shops, 'workers': workers, 'publish_seconds': publish_seconds, 'drain_seconds': drain,
+            'shops_per_s': shops / drain if drain else 0, 'peak_queue': sampler.peak,
+            'peak_sync_shop_queue': sampler.peak_sync_shop, 'failed': sync.errors,
+            'intake': intake.to_dict(), 'sync': sync.to_dict()}
+
+
+def print_result(result, out):
+    out.write('\n%d shops, %d workers: published in %.1f s, drained in %.1f s (%.1f shops/s), '
+              'peak queue depth %d tasks (%d syncShop), %d shops failed\n' % (
+                  result['shops'], result['workers'], result['publish_seconds'], result['drain_seconds'],
+                  result['shops_per_s'], result['peak_queue'], result['peak_sync_shop_queue'], result['failed']))
+    percentiles = ' '.join('%9s' % ('p%g' % p) for p in PERCENTILES)
+    out.write('%-40s %8s %7s %9s %s %9s\n' % ('latency from publish (ms)', 'count', 'errors', 'mean', percentiles,
+                                              'max'))
+    out.write(format_row('intake (task_queue row)', Series.from_dict(result['intake']), 40))
+    out.write(format_row('sync (shop synced)', Series.from_dict(result['sync']), 40))
+    out.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync many shops at once, measure the task queue drain")
+    parser.add_argument("--shops", type=int, default=SHOPS, help="number of shops synced at once")
+    parser.add_argument("--workers", default=WORKERS, help="comma separated numbers of worker processes")
+    parser.add_argument("--db-name", default=DB_NAME, help="database of the <db>.manager-tasks queue")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between samples")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT, help="seconds of one drain before failing")
+    parser.add_argument("--samples", help="write the samples to this CSV file (sample_resources.py format)")
+    parser.add_argument("--json", help="write the results with the latency histograms to this JSON file")
+    parser.add_argument("--perf-python", default=PERF_PYTHON,
+                        help="Python >= 3.8 of the perf tools running gen_shops.py ($QA_PERF_PYTHON)")
+    args = parser.parse_args()
+
+    try:
+        workers = [int(n) for n in args.workers.split(',')]
+    except ValueError:
+        parser.error('--workers are comma separated numbers')
+
+    samples = open(args.samples, 'w', newline='') if args.samples else None
+    try:
+        writer = None
+        if samples:
+            writer = csv.writer(samples, lineterminator='\n')
+            writer.writerow(FIELDS)
+        results = []
+        for n in workers:
+            result = benchmark(args.shops, n, args.db_name, args.interval, args.timeout, writer, args.perf_python)
+            print_result(result, sys.stdout)
+            results.append(result)
+    finally:
+        if samples:
+            samples.close()
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out)
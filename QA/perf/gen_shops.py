@@ -0,0 +1,772 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import datetime
+import decimal
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import psycopg2
+
+from pgcopy import copy_chunks, copy_options, encode_rows, open_output, shard_ranges, write_chunks
+
+    # bulk load helper is shared with the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+from modules.bulkload import deferred_indexes  # noqa: E402
+
+if sys.version_info < (3, 8):
+    # math.prod, datetime.fromisoformat - see requirements.txt of QA/perf
+    sys.exit('gen_shops.py needs Python >= 3.8')
+
+# Perf dataset generator for the current hive schema (product_properties, product_offerings,
+# variations, variation_options, shopify_products ...), copy_shops.py generates the old
+# property_name/property_value layout.
+#
+# Shops 1..etsy_shops are Etsy shops, the following shopify_shops are Shopify shops.
+# Every shop has its own account.
+#
+# The shape of the shops (listings per shop, variations, options and images per product,
+# text lengths) is drawn from a profile - one of PROFILES or a JSON file with the same keys.
+# Every shop has its own RNG seeded by the profile seed and the shop id, the dataset is
+# the same for the same profile regardless of --jobs and --shards.
+#
+# --append adds the shops to an existing dataset instead of replacing it: all ids start
+# above the current values of the id sequences, and the sequences are moved at the end.
+#
+# Usage:
+#    ./gen_shops.py --etsy-shops 100 --shopify-shops 20 --output perf.sql      (perf.sql.gz, perf.sql.zst compress)
+#    ./gen_shops.py --etsy-shops 10000 --profile lognormal --seed 7 --output-dir perf-data
+#    ./gen_shops.py --etsy-shops 1000 --append --dsn "host=localhost dbname=hive user=hive"
+#    ./gen_shops.py --etsy-shops 1000 --output-dir perf-data --jobs 8      (then: cd perf-data; psql -f load.sql)
+#    ./gen_shops.py --etsy-shops 1000 --dsn "host=localhost dbname=hive user=hive" --jobs 8
+#    ./gen_shops.py --etsy-shops 1000 --format binary --output-dir perf-data   (PGCOPY files, loaded by \copy)
+
+    # shape of the generated dataset, see make_layout()
+Layout = collections.namedtuple('Layout', 'etsy_shops shopify_shops profile base sizes first_products first_images '
+                                          'max_variations max_options max_images')
+    # drawn properties of one product, options holds number of options of each variation
+Plan = collections.namedtuple('Plan', 'options images title_words tags description_words')
+
+    # distributions: {'dist': 'fixed', 'value': n}
+    #                {'dist': 'weighted', 'values': [[value, weight], ...]}
+    #                {'dist': 'lognormal', 'mu': mu, 'sigma': sigma, 'min': n, 'max': n}
+    #                {'dist': 'zipf', 's': exponent, 'min': n, 'max': n}
+PROFILES = {
+        # every shop and product the same
+    'uniform': {
+        'seed': 1,
+        'products': {'dist': 'fixed', 'value': 500},
+        'variations': {'dist': 'fixed', 'value': 2},
+        'options': {'dist': 'fixed', 'value': 3},
+        'images': {'dist': 'fixed', 'value': 1},
+        'title_words': {'dist': 'fixed', 'value': 4},
+        'tags': {'dist': 'fixed', 'value': 3},
+        'description_words': {'dist': 'fixed', 'value': 20},
+    },
+        # long tail of shop sizes - median shop has about 30 listings, a few have tens of thousands
+    'lognormal': {
+        'seed': 1,
+        'products': {'dist': 'lognormal', 'mu': 3.4, 'sigma': 1.6, 'min': 1, 'max': 50000},
+        'variations': {'dist': 'weighted', 'values': [[0, 45], [1, 35], [2, 20]]},
+        'options': {'dist': 'weighted', 'values': [[1, 5], [2, 25], [3, 25], [4, 15], [5, 10], [6, 8], [8, 7],
+                                                   [12, 5]]},
+        'images': {'dist': 'weighted', 'values': [[1, 15], [2, 10], [3, 15], [4, 15], [5, 20], [7, 10], [10, 15]]},
+        'title_words': {'dist': 'lognormal', 'mu': 2.3, 'sigma': 0.5, 'min': 1, 'max': 25},
+        'tags': {'dist': 'weighted', 'values': [[0, 5], [3, 10], [5, 15], [8, 15], [13, 55]]},
+        'description_words': {'dist': 'lognormal', 'mu': 4.5, 'sigma': 1.0, 'min': 1, 'max': 3000},
+    },
+        # power law of shop sizes, most shops are tiny
+    'zipf': {
+        'seed': 1,
+        'products': {'dist': 'zipf', 's': 1.1, 'min': 1, 'max': 50000},
+        'variations': {'dist': 'weighted', 'values': [[0, 45], [1, 35], [2, 20]]},
+        'options': {'dist': 'zipf', 's': 1.0, 'min': 1, 'max': 12},
+        'images': {'dist': 'zipf', 's': 0.8, 'min': 1, 'max': 10},
+        'title_words': {'dist': 'lognormal', 'mu': 2.3, 'sigma': 0.5, 'min': 1, 'max': 25},
+        'tags': {'dist': 'weighted', 'values': [[0, 5], [3, 10], [5, 15], [8, 15], [13, 55]]},
+        'description_words': {'dist': 'lognormal', 'mu': 4.5, 'sigma': 1.0, 'min': 1, 'max': 3000},
+    },
+}
+
+WORDS = ('vintage handmade leather wool cotton silk linen summer winter gift wedding boho rustic '
+         'minimalist knitted crochet ceramic wooden silver gold copper necklace ring earrings bracelet '
+         'scarf hat gloves bag pouch wallet mug bowl vase print poster card sticker candle soap '
+         'blanket pillow toy doll custom personalized classic modern floral geometric striped').split()
+TAG_WORDS = [word for word in WORDS if len(word) <= 20]
+MAX_TITLE_LENGTH = 140
+MAX_TAGS = 13
+
+HEADERS = """
+SET statement_timeout = 0;
+SET lock_timeout = 0;
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+SET check_function_bodies = false;
+SET client_min_messages = warning;
+SET search_path = public, pg_catalog;
+"""
+CLEANUP = """
+TRUNCATE accounts, aggregates, attributes, channels, images, product_offering_options, product_offerings,
+    product_properties, shopify_products, shops, shop_sections, sync_shop, task_queue, user_profiles,
+    variation_options, variations, vela_images CASCADE;
+"""
+
+LAST_MODIFIED = datetime.datetime.fromisoformat('2015-12-16 13:34:43+01:00')
+HIVE_MODIFIED = datetime.datetime.fromisoformat('2017-01-01 01:00:00+01:00')
+CREATED = datetime.datetime.fromisoformat('2015-03-15 22:03:29+01:00')
+ENDING = datetime.datetime.fromisoformat('2018-01-04 09:42:25+01:00')
+STATE_CHANGED = datetime.datetime.fromisoformat('2017-09-04 09:42:25+02:00')
+LAST_SYNC = datetime.datetime.fromisoformat('2018-01-03 17:15:27+01:00')
+MATERIALS = ['wool', 'cotton']
+PRICE = decimal.Decimal('5.15')
+
+SECTIONS = [
+    (15183328, 'On Sale'),
+    (15180189, 'Holiday Gifts'),
+    (17365192, 'Summer Sale'),
+    (18790753, 'de'),
+    (18787742, 'bbbaa'),
+    (18790755, 'eeee'),
+]
+
+    # (property_id, formatted_name, [(value_id, value)]) of the first and the second variation of a product
+VARIATION_PROPERTIES = [
+    (200, 'Primary color', [(1, 'Beige'), (2, 'Blue'), (3, 'Bronze'), (4, 'Green'), (5, 'Brown'), (6, 'Clear'),
+                            (7, 'Copper'), (8, 'Gold'), (9, 'Red'), (10, 'Grey'), (11, 'Orange'), (12, 'Pink')]),
+    (502, 'Fabric', [(2723346448 + n, value) for n, value in enumerate([
+        'wool', 'cotton', 'silk', 'linen', 'denim', 'velvet',
+        'satin', 'tweed', 'fleece', 'jersey', 'lace', 'leather'])]),
+]
+MAX_VARIATIONS = len(VARIATION_PROPERTIES)
+MAX_OPTIONS = min(len(values) for _, _, values in VARIATION_PROPERTIES)
+
+ETSY_THUMBNAIL_URL = 'https://img1.etsystatic.com/207/0/14458117/il_75x75.%d_nv0d.jpg'
+ETSY_FULLSIZE_URL = 'https://img1.etsystatic.com/207/0/14458117/il_fullxfull.%d_nv0d.jpg'
+SHOPIFY_THUMBNAIL_URL = 'https://cdn.shopify.com/s/files/1/perf/products/%d_small.jpg'
+SHOPIFY_FULLSIZE_URL = 'https://cdn.shopify.com/s/files/1/perf/products/%d.jpg'
+
+    # channel ids are derived from hive ids, so they are unique too
+ETSY_SHOP_ID = 14000000
+ETSY_USER_ID = 106000000
+LISTING_ID = 100000000
+CHANNEL_IMAGE_ID = 1300000000
+SHOPIFY_SHOP_ID = 20000000
+SHOPIFY_PRODUCT_ID = 9000000000
+
+    # sequences of the generated ids, ids of a new dataset start above their last values
+ID_SEQUENCES = ['account_id_seq', 'shop_id_seq', 'shop_sections_id_seq', 'image_id_seq', 'product_id_seq',
+                'shopify_products_id_seq', 'variation_id_seq', 'variation_option_id_seq', 'product_offering_id_seq',
+                'product_offering_option_id_seq']
+
+
+@functools.lru_cache()
+def zipf_cum_weights(exponent, low, high):
+    return list(itertools.accumulate(1 / k ** exponent for k in range(low, high + 1)))
+
+
+def sample(rng, dist):
+    """ Draw one integer from a profile distribution
+    """
+    kind = dist['dist']
+    if kind == 'fixed':
+        return dist['value']
+    if kind == 'weighted':
+        values, weights = zip(*dist['values'])
+        return rng.choices(values, weights)[0]
+    if kind == 'lognormal':
+        value = round(rng.lognormvariate(dist['mu'], dist['sigma']))
+    elif kind == 'zipf':
+        value = rng.choices(range(dist['min'], dist['max'] + 1),
+                            cum_weights=zipf_cum_weights(dist['s'], dist['min'], dist['max']))[0]
+    else:
+        raise ValueError('unknown distribution ' + kind)
+    return min(max(value, dist['min']), dist['max'])
+
+
+def dist_max(dist):
+    """ Upper bound of a distribution - ids are allocated for the largest possible product
+    """
+    if dist['dist'] == 'fixed':
+        return dist['value']
+    if dist['dist'] == 'weighted':
+        return max(value for value, _ in dist['values'])
+    if 'max' not in dist:
+        raise ValueError(dist['dist'] + ' distribution needs max')
+    return dist['max']
+
+
+def load_profile(name):
+    """ Return a built-in profile or a profile from a JSON file, missing keys are taken from 'uniform'
+    """
+    if name in PROFILES:
+        return dict(PROFILES[name])
+    with open(name) as fp:
+        return dict(PROFILES['uniform'], **json.load(fp))
+
+
+def prefix_sums(values, start=1):
+    sums = []
+    for value in values:
+        sums.append(start)
+        start += value
+    return sums
+
+
+def make_layout(etsy_shops, shopify_shops, profile, base=None):
+    """ Draw the number of products of every shop and compute the first ids of every shop
+
+    Ids of product children (variations, options, offerings) are computed from the product id
+    with a stride of the largest possible product, so only the shop sizes have to be known
+    up front to give every shard disjoint ids.
+
+    :param base: {sequence: last used id} of ID_SEQUENCES, the generated ids start above them
+    """
+    base = base or dict.fromkeys(ID_SEQUENCES, 0)
+    max_variations = dist_max(profile['variations'])
+    max_options = dist_max(profile['options'])
+    if max_variations > MAX_VARIATIONS:
+        raise ValueError('at most %d variations per product' % MAX_VARIATIONS)
+    if max_options > MAX_OPTIONS:
+        raise ValueError('at most %d options per variation' % MAX_OPTIONS)
+    max_images = dist_max(profile['images'])
+
+    first_shop = base['shop_id_seq'] + 1
+    sizes = [sample(random.Random('%s:size:%d' % (profile['seed'], shop)), profile['products'])
+             for shop in range(first_shop, first_shop + etsy_shops + shopify_shops)]
+    first_products = (prefix_sums(sizes[:etsy_shops], base['product_id_seq'] + 1) +
+                      prefix_sums(sizes[etsy_shops:], base['shopify_products_id_seq'] + 1))
+    first_images = prefix_sums([size * max_images for size in sizes], base['image_id_seq'] + 1)
+    return Layout(etsy_shops, shopify_shops, profile, base, sizes, first_products, first_images,
+                  max_variations, max_options, max_images)
+
+
+def product_plans(layout, shop):
+    """ Draw the plans of all products of a shop, the same plans for every table generator
+    """
+    profile = layout.profile
+    rng = random.Random('%s:%d' % (profile['seed'], shop))
+    plans = []
+    for _ in range(layout.sizes[shop_index(layout, shop)]):
+        options = tuple(sample(rng, profile['options']) for _ in range(sample(rng, profile['variations'])))
+        plans.append(Plan(options, sample(rng, profile['images']), sample(rng, profile['title_words']),
+                          min(sample(rng, profile['tags']), MAX_TAGS), sample(rng, profile['description_words'])))
+    return plans
+
+
+def shop_count(layout):
+    return layout.etsy_shops + layout.shopify_shops
+
+
+def all_shops(layout):
+    first = layout.base['shop_id_seq'] + 1
+    return range(first, first + shop_count(layout))
+
+
+def shop_index(layout, shop):
+    """ Position of the shop among the generated shops, Etsy shops go first
+    """
+    return shop - layout.base['shop_id_seq'] - 1
+
+
+def shop_shards(layout, shard_count):
+    first = layout.base['shop_id_seq']
+    return [range(first + shops.start, first + shops.stop) for shops in shard_ranges(shop_count(layout), shard_count)]
+
+
+def max_offerings(layout):
+    """ Offerings of the largest product - one per combination of variation options
+    """
+    return layout.max_options ** layout.max_variations
+
+
+def account_id(layout, shop):
+    return layout.base['account_id_seq'] + shop_index(layout, shop) + 1
+
+
+def first_section_id(layout, shop):
+    return layout.base['shop_sections_id_seq'] + shop_index(layout, shop) * len(SECTIONS) + 1
+
+
+def first_product_id(layout, shop):
+    """ First product_properties (Etsy shop) or shopify_products (Shopify shop) id of a shop
+    """
+    return layout.first_products[shop_index(layout, shop)]
+
+
+def first_image_id(layout, shop):
+    return layout.first_images[shop_index(layout, shop)]
+
+
+def variation_id(layout, product_id, k):
+    return (layout.base['variation_id_seq'] +
+            (product_id - layout.base['product_id_seq'] - 1) * layout.max_variations + k + 1)
+
+
+def option_id(layout, variation, j):
+    return (layout.base['variation_option_id_seq'] +
+            (variation - layout.base['variation_id_seq'] - 1) * layout.max_options + j + 1)
+
+
+def offering_id(layout, product_id, n):
+    return (layout.base['product_offering_id_seq'] +
+            (product_id - layout.base['product_id_seq'] - 1) * max_offerings(layout) + n + 1)
+
+
+def offering_option_id(layout, offering, k):
+    return (layout.base['product_offering_option_id_seq'] +
+            (offering - layout.base['product_offering_id_seq'] - 1) * layout.max_variations + k + 1)
+
+
+def is_etsy(layout, shop):
+    return shop_index(layout, shop) < layout.etsy_shops
+
+
+def etsy_shops(layout, shops):
+    return [shop for shop in shops if is_etsy(layout, shop)]
+
+
+def shopify_shops(layout, shops):
+    return [shop for shop in shops if not is_etsy(layout, shop)]
+
+
+def photos(image_id, count):
+    """ Photos array of a product with the first image id
+    """
+    return list(range(image_id, image_id + count))
+
+
+def words(product_id, count):
+    return ' '.join(WORDS[(product_id * 7 + i * 13) % len(WORDS)] for i in range(count))
+
+
+def tags(product_id, count):
+    return [TAG_WORDS[(product_id + i * 5) % len(TAG_WORDS)] for i in range(count)]
+
+
+def gen_channels(layout, shops):
+    yield [(1, 'Etsy'), (2, 'Shopify')]
+
+
+def gen_accounts(layout, shops):
+    yield ([(account_id(layout, shop), 1, shop, 'MyAccesToken%d' % shop, 'MyAccessTokenSecret%d' % shop)
+            for shop in etsy_shops(layout, shops)] +
+           [(account_id(layout, shop), 2, shop, 'shpat_perf%d' % shop, None) for shop in shopify_shops(layout, shops)])
+
+
+def gen_shops(layout, shops):
+    yield ([(shop, account_id(layout, shop), 'PerfEtsyShop%d' % shop, str(ETSY_SHOP_ID + shop), 'up_to_date', 0, 0, 0, 0, False, LAST_SYNC,
+             False, None, True, False, 0, 0, str(ETSY_USER_ID + shop), None, CREATED)
+            for shop in etsy_shops(layout, shops)] +
+           [(shop, account_id(layout, shop), 'PerfShopifyShop%d' % shop, str(SHOPIFY_SHOP_ID + shop), 'up_to_date', 0, 0, 0, 0, False,
+             LAST_SYNC, False, None, False, False, 0, 0, None, 'perf-shop-%d.myshopify.com' % shop, CREATED)
+            for shop in shopify_shops(layout, shops)])
+
+
+def gen_shop_sections(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_section_id(layout, shop)
+        yield [(first + n, shop, section_id, value) for n, (section_id, value) in enumerate(SECTIONS)]
+
+
+def gen_images(layout, shops):
+    for shop in shops:
+        if is_etsy(layout, shop):
+            thumbnail_url, fullsize_url = ETSY_THUMBNAIL_URL, ETSY_FULLSIZE_URL
+        else:
+            thumbnail_url, fullsize_url = SHOPIFY_THUMBNAIL_URL, SHOPIFY_FULLSIZE_URL
+        first = first_image_id(layout, shop)
+        rows = []
+        for n, plan in enumerate(product_plans(layout, shop)):
+            image = first + n * layout.max_images
+            rows.extend([(i, str(CHANNEL_IMAGE_ID + i), thumbnail_url % (CHANNEL_IMAGE_ID + i),
+                          fullsize_url % (CHANNEL_IMAGE_ID + i), None, shop)
+                         for i in range(image, image + plan.images)])
+        yield rows
+
+
+def gen_product_properties(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        image = first_image_id(layout, shop)
+        rows = []
+        for n, plan in enumerate(product_plans(layout, shop)):
+            product_id = first + n
+            rows.append((product_id, shop, False, None, str(LISTING_ID + product_id), 'active', None, LAST_MODIFIED,
+                         HIVE_MODIFIED, photos(image + n * layout.max_images, plan.images),
+                         words(product_id, plan.title_words)[:MAX_TITLE_LENGTH],
+                         words(product_id, plan.description_words), CREATED, ENDING, str(PRICE), '1', STATE_CHANGED,
+                         1490, str(SECTIONS[n % len(SECTIONS)][0]), tags(product_id, plan.tags), MATERIALS, True, [],
+                         LAST_SYNC, True))
+        yield rows
+
+
+def gen_shopify_products(layout, shops):
+    for shop in shopify_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        image = first_image_id(layout, shop)
+        rows = []
+        for n, plan in enumerate(product_plans(layout, shop)):
+            product_id = first + n
+            rows.append((product_id, shop, str(SHOPIFY_PRODUCT_ID + product_id), words(product_id, plan.title_words),
+                         '<p>' + words(product_id, plan.description_words) + '</p>',
+                         photos(image + n * layout.max_images, plan.images), LAST_MODIFIED, False, None, False, None,
+                         [], LAST_SYNC, tags(product_id, plan.tags), 'Gloves', 'Hive Perf', CREATED))
+        yield rows
+
+
+def gen_variations(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        rows = []
+        for product_id, plan in enumerate(product_plans(layout, shop), first):
+            rows.extend([(variation_id(layout, product_id, k), product_id, k == 0, VARIATION_PROPERTIES[k][0],
+                          VARIATION_PROPERTIES[k][1], None, None, False, False, False)
+                         for k in range(len(plan.options))])
+        yield rows
+
+
+def gen_variation_options(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        rows = []
+        for product_id, plan in enumerate(product_plans(layout, shop), first):
+            for k, options in enumerate(plan.options):
+                variation = variation_id(layout, product_id, k)
+                values = VARIATION_PROPERTIES[k][2]
+                rows.extend([(option_id(layout, variation, j), variation, values[j][0], values[j][1], None, None,
+                              None, j + 1) for j in range(options)])
+        yield rows
+
+
+def gen_product_offerings(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        rows = []
+        for product_id, plan in enumerate(product_plans(layout, shop), first):
+            rows.extend([(offering_id(layout, product_id, n), product_id, PRICE, '', 1, True)
+                         for n in range(math.prod(plan.options))])
+        yield rows
+
+
+def gen_product_offering_options(layout, shops):
+    for shop in etsy_shops(layout, shops):
+        first = first_product_id(layout, shop)
+        rows = []
+        for product_id, plan in enumerate(product_plans(layout, shop), first):
+                # offering per combination of options, combination holds option index of each variation
+            for n, combination in enumerate(itertools.product(*[range(options) for options in plan.options])):
+                offering = offering_id(layout, product_id, n)
+                for k, j in enumerate(combination):
+                    option = option_id(layout, variation_id(layout, product_id, k), j)
+                    rows.append((offering_option_id(layout, offering, k), offering, option))
+        yield rows
+
+
+    # table -> ([(column, type)], generator of row chunks)
+COPY_TABLES = {
+    'channels': ([('id', 'int8'), ('name', 'text')], gen_channels),
+    'accounts': ([('id', 'int8'), ('channel_id', 'int8'), ('company_id', 'int8'), ('oauth_token', 'text'),
+                  ('oauth_token_secret', 'text')], gen_accounts),
+    'shops': ([('id', 'int8'), ('account_id', 'int8'), ('name', 'text'), ('channel_shop_id', 'text'),
+               ('sync_status', 'text'), ('to_download', 'int4'), ('downloaded', 'int4'), ('to_upload', 'int4'),
+               ('uploaded', 'int4'), ('rabbit', 'bool'), ('last_sync_timestamp', 'timestamptz'), ('invalid', 'bool'),
+               ('error', 'text'), ('inventory', 'bool'), ('applying_operations', 'bool'), ('to_apply', 'int4'),
+               ('applied', 'int4'), ('channel_user_id', 'text'), ('domain', 'text'), ('created_at', 'timestamptz')],
+              gen_shops),
+    'shop_sections': ([('id', 'int8'), ('shop_id', 'int8'), ('section_id', 'int8'), ('value', 'text')],
+                      gen_shop_sections),
+    'images': ([('id', 'int8'), ('channel_image_id', 'text'), ('thumbnail_url', 'text'), ('fullsize_url', 'text'),
+                ('vela_image_id', 'int8'), ('shop_id', 'int8')], gen_images),
+    'product_properties': ([('id', 'int8'), ('shop_id', 'int8'), ('_hive_is_invalid', 'bool'),
+                            ('_hive_invalid_reason', 'text'), ('listing_id', 'text'), ('state', 'text'),
+                            ('modified_by_hive', 'bool'), ('last_modified_tsz', 'timestamptz'),
+                            ('_hive_last_modified_tsz', 'timestamptz'), ('photos', 'int8[]'), ('title', 'text'),
+                            ('description', 'text'), ('creation_tsz', 'timestamptz'), ('ending_tsz', 'timestamptz'),
+                            ('price', 'text'), ('quantity', 'text'), ('state_tsz', 'timestamptz'),
+                            ('taxonomy_id', 'int8'), ('section_id', 'text'), ('tags', 'text[]'),
+                            ('materials', 'text[]'), ('_hive_on_new_schema', 'bool'),
+                            ('_hive_changed_properties', 'text[]'), ('_hive_last_sync', 'timestamptz'),
+                            ('can_write_inventory', 'bool')], gen_product_properties),
+    'shopify_products': ([('id', 'int4'), ('shop_id', 'int8'), ('product_id', 'text'), ('title', 'text'),
+                          ('body_html', 'text'), ('photos', 'int8[]'), ('updated_at', 'timestamptz'),
+                          ('_hive_is_invalid', 'bool'), ('_hive_invalid_reason', 'text'),
+                          ('_hive_modified_by_hive', 'bool'), ('_hive_updated_at', 'timestamptz'),
+                          ('changed_properties', 'text[]'), ('last_sync', 'timestamptz'), ('tags', 'text[]'),
+                          ('product_type', 'text'), ('vendor', 'text'), ('published_at', 'timestamptz')],
+                         gen_shopify_products),
+    'variations': ([('id', 'int8'), ('product_id', 'int8'), ('first', 'bool'), ('property_id', 'int8'),
+                    ('formatted_name', 'text'), ('scaling_option_id', 'int8'), ('recipient_id', 'int8'),
+                    ('influences_price', 'bool'), ('influences_quantity', 'bool'), ('influences_sku', 'bool')],
+                   gen_variations),
+    'variation_options': ([('id', 'int8'), ('variation_id', 'int8'), ('value_id', 'int8'), ('value', 'text'),
+                           ('formatted_value', 'text'), ('price', 'numeric'), ('is_available', 'bool'),
+                           ('sequence', 'int4')], gen_variation_options),
+    'product_offerings': ([('id', 'int8'), ('product_id', 'int8'), ('price', 'numeric'), ('sku', 'text'),
+                           ('quantity', 'int4'), ('visibility', 'bool')], gen_product_offerings),
+    'product_offering_options': ([('id', 'int8'), ('product_offering_id', 'int8'), ('variation_option_id', 'int8')],
+                                 gen_product_offering_options),
+}
+    # tables with fixed content, loaded once before the shards
+STATIC_TABLES = ['channels']
+    # tables generated per shop in foreign key order - a shard is loaded by one transaction,
+    # the referenced rows of the shard are always copied before the referencing ones
+SHARDED_TABLES = ['accounts', 'shops', 'shop_sections', 'images', 'product_properties', 'shopify_products',
+                  'variations', 'variation_options', 'product_offerings', 'product_offering_options']
+
+
+def sequences(layout):
+    """ Return [(sequence, last allocated id)] to set after the data are loaded
+    """
+    products = sum(layout.sizes[:layout.etsy_shops])
+    allocated = {
+        'account_id_seq': shop_count(layout),
+        'shop_id_seq': shop_count(layout),
+        'shop_sections_id_seq': layout.etsy_shops * len(SECTIONS),
+        'image_id_seq': sum(layout.sizes) * layout.max_images,
+        'product_id_seq': products,
+        'shopify_products_id_seq': sum(layout.sizes) - products,
+        'variation_id_seq': products * layout.max_variations,
+        'variation_option_id_seq': products * layout.max_variations * layout.max_options,
+        'product_offering_id_seq': products * max_offerings(layout),
+        'product_offering_option_id_seq': products * max_offerings(layout) * layout.max_variations,
+    }
+    return [(sequence, layout.base[sequence] + allocated[sequence]) for sequence in ID_SEQUENCES]
+
+
+def current_ids(dsn):
+    """ Return {sequence: last used id} of ID_SEQUENCES
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    base = {}
+    for sequence in ID_SEQUENCES:
+        cur.execute('SELECT last_value, is_called FROM ' + sequence)
+        last_value, is_called = cur.fetchone()
+        base[sequence] = last_value if is_called else last_value - 1
+    conn.close()
+    return base
+
+
+def setval(sequence, value):
+    """ Empty tables leave the sequence to start at 1
+    """
+    return b"SELECT pg_catalog.setval('%b', %d, %b);\n" % (sequence.encode(), max(value, 1),
+                                                          b'true' if value else b'false')
+
+
+def table_columns(table):
+    return ', '.join(column for column, _ in COPY_TABLES[table][0])
+
+
+def table_data(layout, table, shops, binary=False):
+    """ Yield COPY data of the table rows of the shops
+    """
+    columns, generator = COPY_TABLES[table]
+    yield from encode_rows([column_type for _, column_type in columns], generator(layout, shops), binary)
+
+
+def copy_block(layout, table, shops):
+    """ Yield COPY statement, rows and end-of-data marker of one table
+    """
+    yield b'COPY ' + table.encode() + b' (' + table_columns(table).encode() + b') FROM stdin;\n'
+    yield from table_data(layout, table, shops)
+    yield b'\\.\n\n'
+
+
+def gen_pre(layout):
+    yield HEADERS.encode() + b'\n'
+    yield CLEANUP.encode() + b'\n'
+    for table in STATIC_TABLES:
+        yield from copy_block(layout, table, None)
+
+
+def gen_shard(layout, shops):
+    """ Yield SQL loading all sharded tables of the shops in one transaction
+    """
+    yield b'BEGIN;\n\n'
+    for table in SHARDED_TABLES:
+        yield from copy_block(layout, table, shops)
+    yield b'COMMIT;\n'
+
+
+def gen_binary_shard(shard_no):
+    """ Yield psql script loading binary files of a shard in one transaction
+    """
+    yield b'BEGIN;\n'
+    for table in SHARDED_TABLES:
+        yield ('\\copy ' + table + ' (' + table_columns(table) + ") FROM '" + binary_file_name(table, shard_no) +
+               "'" + copy_options(True) + '\n').encode()
+    yield b'COMMIT;\n'
+
+
+def gen_post(layout):
+    yield b'\n'
+    for sequence, value in sequences(layout):
+        yield setval(sequence, value)
+
+
+def gen_dump(layout):
+    """ Yield the whole SQL dump as a sequence of bytes chunks
+    """
+    yield from gen_pre(layout)
+    yield from gen_shard(layout, all_shops(layout))
+    yield from gen_post(layout)
+
+
+def load_shard(dsn, layout, shops, binary):
+    """ Generate and COPY all sharded tables of the shops over own connection, commit once
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        for table in SHARDED_TABLES:
+            copy_chunks(conn, table, table_columns(table), table_data(layout, table, shops, binary), binary)
+        conn.commit()
+    finally:
+        conn.close()
+    return shops
+
+
+def load_dataset(dsn, layout, jobs, shard_count, binary, append=False):
+    """ Load the dataset directly to the database, no intermediate dump file
+
+    Tables are truncated and static tables copied over one connection (unless appending),
+    then the shards are generated and copied by a pool of processes, each with its own
+    connection. Sequences are set at the end, after all shards are committed.
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(HEADERS)
+    if not append:
+        cur.execute(CLEANUP)
+        for table in STATIC_TABLES:
+            copy_chunks(conn, table, table_columns(table), table_data(layout, table, None))
+    conn.commit()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(load_shard, dsn, layout, shops, binary)
+                   for shops in shop_shards(layout, shard_count)]
+        for future in as_completed(futures):
+            shops = future.result()
+            print('loaded shops', shops.start, '-', shops.stop - 1, file=sys.stderr)
+
+    for sequence, value in sequences(layout):
+        cur.execute('SELECT pg_catalog.setval(%s, %s, %s)', [sequence, max(value, 1), value > 0])
+    conn.commit()
+    conn.close()
+
+
+def shard_file_name(shard_no):
+    return 'shard.' + '{:04d}'.format(shard_no) + '.sql'
+
+
+def binary_file_name(table, shard_no):
+    return table + '.' + '{:04d}'.format(shard_no) + '.pgcopy'
+
+
+def write_file(path, chunks):
+    with open_output(path) as out:
+        write_chunks(out, chunks)
+
+
+def write_shard(output_dir, layout, shard_no, shops, binary):
+    if binary:
+        for table in SHARDED_TABLES:
+            write_file(os.path.join(output_dir, binary_file_name(table, shard_no)),
+                       table_data(layout, table, shops, binary))
+        write_file(os.path.join(output_dir, shard_file_name(shard_no)), gen_binary_shard(shard_no))
+    else:
+        write_file(os.path.join(output_dir, shard_file_name(shard_no)), gen_shard(layout, shops))
+    return shops
+
+
+def write_dataset(output_dir, layout, jobs, shard_count, binary):
+    """ Generate the dataset as per shard SQL files by a pool of processes
+
+    <output_dir> gets:
+        00-pre.sql              - cleanup and static tables
+        shard.<shard>.sql       - all rows of the shard shops, one transaction
+        <table>.<shard>.pgcopy  - binary COPY data of the shard, with binary set (shard.<shard>.sql loads them)
+        99-post.sql             - sequences
+        load.sql                - psql script loading all of the above (run it from <output_dir>)
+    Shard files do not depend on each other, they can be loaded by parallel psql sessions.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shards = list(enumerate(shop_shards(layout, shard_count), 1))
+
+    write_file(os.path.join(output_dir, '00-pre.sql'), gen_pre(layout))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(write_shard, output_dir, layout, shard_no, shops, binary)
+                   for shard_no, shops in shards]
+        for future in as_completed(futures):
+            shops = future.result()
+            print('written shops', shops.start, '-', shops.stop - 1, file=sys.stderr)
+    write_file(os.path.join(output_dir, '99-post.sql'), gen_post(layout))
+
+    with open(os.path.join(output_dir, 'load.sql'), 'w') as out:
+        out.write('\\set ON_ERROR_STOP 1\n\\i 00-pre.sql\n')
+        for shard_no, _ in shards:
+            out.write('\\i ' + shard_file_name(shard_no) + '\n')
+        out.write('\\i 99-post.sql\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate perf dataset of the current hive schema")
+    parser.add_argument("--etsy-shops", type=int, default=100, help="number of Etsy shops")
+    parser.add_argument("--shopify-shops", type=int, default=0, help="number of Shopify shops")
+    parser.add_argument("--profile", default='uniform',
+                        help="shape of the shops, one of %s or a JSON file" % ', '.join(sorted(PROFILES)))
+    parser.add_argument("--seed", help="override the profile RNG seed")
+    parser.add_argument("--products", type=int, help="fixed number of products per shop, overrides the profile")
+    parser.add_argument("--variations", type=int,
+                        help="fixed number of variations per Etsy product (0-%d), overrides the profile" % MAX_VARIATIONS)
+    parser.add_argument("--options", type=int, help="fixed number of options per variation (1-%d), Etsy product "
+                                                    "gets options^variations offerings, overrides the profile" % MAX_OPTIONS)
+    parser.add_argument("--images", type=int, help="fixed number of images per product, overrides the profile")
+    parser.add_argument("--format", choices=['text', 'binary'], default='text',
+                        help="COPY data format, binary needs --output-dir or --dsn")
+    parser.add_argument("--output", help="write the SQL dump to this file instead of stdout, .gz/.zst are compressed")
+    parser.add_argument("--output-dir", help="write per shard SQL files and load.sql to this directory")
+    parser.add_argument("--dsn", help="load the data directly to this database instead of writing a dump")
+    parser.add_argument("--bulk", action='store_true',
+                        help="drop indexes and foreign keys for the --dsn load, rebuild them after")
+    parser.add_argument("--append", action='store_true',
+                        help="add the shops to the data already in --dsn instead of replacing them")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes for --output-dir and --dsn")
+    parser.add_argument("--shards", type=int, help="number of shop ranges (default: --jobs)")
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile)
+    if args.seed is not None:
+        profile['seed'] = args.seed
+    for key in ['products', 'variations', 'options', 'images']:
+        if getattr(args, key) is not None:
+            profile[key] = {'dist': 'fixed', 'value': getattr(args, key)}
+    if args.append and not args.dsn:
+        parser.error('--append needs --dsn')
+    base = current_ids(args.dsn) if args.append else None
+    try:
+        layout = make_layout(args.etsy_shops, args.shopify_shops, profile, base)
+    except ValueError as e:
+        parser.error(str(e))
+    shard_count = args.shards or args.jobs
+    binary = args.format == 'binary'
+    if binary and not (args.dsn or args.output_dir):
+        parser.error('--format binary needs --output-dir or --dsn')
+
+    if args.dsn and args.bulk:
+        with deferred_indexes(args.dsn, STATIC_TABLES + SHARDED_TABLES, args.jobs):
+            load_dataset(args.dsn, layout, args.jobs, shard_count, binary, args.append)
+    elif args.dsn:
+        load_dataset(args.dsn, layout, args.jobs, shard_count, binary, args.append)
+    elif args.output_dir:
+        write_dataset(args.output_dir, layout, args.jobs, shard_count, binary)
+    elif args.output:
+        write_file(args.output, gen_dump(layout))
+    else:
+        write_chunks(sys.stdout.buffer, gen_dump(layout))
@@ -0,0 +1,110 @@
+import math
+
+# Latency histogram with bounded relative error (HdrHistogram style)
+# Values are non-negative integers (microseconds). Every power of two range is split to
+# SUB_BUCKETS linear buckets, so the error of any recorded value is below 1 / SUB_BUCKETS
+# regardless of its size - percentiles of 50us and 50s are equally precise. Buckets are kept
+# in a dict, an empty histogram is small and histograms of runs/steps/processes can be merged.
+#
+# Usage:
+#    from histogram import Histogram
+#
+#    h = Histogram()
+#    h.record(elapsed_us)
+#    print(h.count, h.mean(), h.percentile(99), h.max)
+#    json.dump(h.to_dict(), fp)
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    """ Values below 2 * SUB_BUCKETS have own bucket, then SUB_BUCKETS buckets per power of two
+    """
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_range(index):
+    """ (lowest, highest) value of the bucket
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift = index // SUB_BUCKETS - 1
+    low = (index - shift * SUB_BUCKETS) << shift
+    return low, low + (1 << shift) - 1
+
+
+class Histogram():
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value, count=1):
+        value = int(value)
+        # bucket_index() inlined, this is the hot path of analyze_jtl.py
+        if value < 2 * SUB_BUCKETS:
+            if value < 0:
+                raise ValueError('negative value %d' % value)
+            index = value
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            index = shift * SUB_BUCKETS + (value >> shift)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """ Highest value of the bucket holding the percentile (never above max)
+        """
+        if not self.count:
+            return 0
+        return self.value_at_rank(math.ceil(self.count * percent / 100))
+
+    def value_at_rank(self, rank):
+        """ Value of the rank-th smallest recorded value (1 based, clamped to 1..count), as percentile()
+        """
+        rank = min(max(1, rank), self.count)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_range(index)[1], self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'counts': [[index, count] for index, count in sorted(self.counts.items())],
+                'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max}
+
+    @staticmethod
+    def from_dict(data):
+        h = Histogram()
+        h.counts = {index: count for index, count in data['counts']}
+        h.count = data['count']
+        h.total = data['total']
+        h.min = data['min']
+        h.max = data['max']
+        return h
@@ -0,0 +1,391 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import collections
+import csv
+import json
+import os
+import random
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import aiohttp
+import yarl
+
+from gen_shops import PROFILES, etsy_shops, first_product_id, load_profile, make_layout, shop_index
+from analyze_jtl import JTL_FIELDS, Analyzer, print_report
+
+# Load generator replaying the user journey of hive-perf.jmx (login, shops, product search paging,
+# bulk edit, logout) by asyncio virtual users - thousands of concurrent sessions from one process.
+#
+# The steps are read from the jmx, so the JMeter plan stays the single definition of the journey.
+# Virtual users come from the perf dataset of gen_shops.py: the same --etsy-shops/--profile/--seed
+# give the shop ids and product ids of the loaded data. User n logs in as user<company> of
+# data/hive-auth.sql and edits the first --edit-products products of its shop.
+#
+# A profile JSON may have a "load" object with the defaults of users, ramp_up, think_time, loops.
+#
+# Every virtual user has own cookie jar, all of them share one connection pool.
+#
+# --rate switches to open loop: the users only log in (the journey up to the first --open-steps step),
+# then the --open-steps requests are sent at the given arrival rate regardless of the responses -
+# a slow server does not slow the load down as with the closed loop of users. Latency is measured from
+# the intended send time (coordinated omission correction), so requests queued in the client or in the
+# server count in full. The report of the service time (from the actual send) is printed too.
+# The rate is requests/s, or a step function of rate:seconds segments.
+# Prints the analyze_jtl.py report of the run, --jtl writes the samples in JMeter CSV format,
+# --json writes the histograms like analyze_jtl.py --json.
+#
+# Usage:
+#    ./load_journey.py --etsy-shops 100 --base-url https://hive.example.com --login-url https://login.hive.example.com
+#    ./load_journey.py --etsy-shops 1000 --users 2000 --ramp-up 60 --think-time 2 --duration 600 --jtl results.csv
+#    ./load_journey.py --etsy-shops 100 --rate 50 --duration 300
+#    ./load_journey.py --etsy-shops 100 --rate 20:60,40:60,80:60,160:60 --open-steps 'products/search'
+
+JMX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hive-perf.jmx')
+    # defaults of the run, overridden by "load" of the profile and by the command line
+LOAD_DEFAULTS = {
+    'users': None,          # one virtual user per Etsy shop
+    'ramp_up': 1,           # seconds until all users are started
+    'think_time': 0,        # mean seconds between steps, exponentially distributed
+    'loops': 1,             # journeys per user (unless --duration)
+}
+EDIT_PRODUCTS = 200
+THREAD_GROUP = 'Thread Group 1'
+VARIABLE = re.compile(r'\$\{(\w+)\}')
+OPEN_STEPS = 'products/search'
+OPEN_DURATION = 60
+
+    # one HTTP request of the journey, domain is None for the default host
+Step = collections.namedtuple('Step', 'label method domain path query body headers')
+    # result of one step, elapsed from the intended send time in open loop mode, service from the actual one
+Sample = collections.namedtuple('Sample', 'timestamp elapsed label code thread success bytes latency connect service')
+
+
+def prop(element, name):
+    return element.findtext("*[@name='%s']" % name) or ''
+
+
+def parse_journey(jmx_file):
+    """ Enabled HTTP samplers of the jmx in plan order, with their own header managers
+
+    :return: (steps, {'domain': default host, 'port': default port})
+    """
+    root = ET.parse(jmx_file).getroot()
+    defaults = {'domain': '', 'port': ''}
+    for config in root.iter('ConfigTestElement'):
+        if config.get('testclass') == 'ConfigTestElement' and config.get('enabled') == 'true':
+            defaults = {'domain': prop(config, 'HTTPSampler.domain'), 'port': prop(config, 'HTTPSampler.port')}
+
+    steps = []
+    for tree in root.iter('hashTree'):
+        children = list(tree)
+        for i, sampler in enumerate(children):
+            if sampler.tag != 'HTTPSamplerProxy' or sampler.get('enabled') != 'true':
+                continue
+            headers = {}
+            if i + 1 < len(children) and children[i + 1].tag == 'hashTree':
+                for manager in children[i + 1].iter('HeaderManager'):
+                    for header in manager.iter('elementProp'):
+                        headers[prop(header, 'Header.name')] = prop(header, 'Header.value')
+            # aiohttp sets Accept-Encoding it can decode (the recorded one asks for brotli)
+            headers.pop('Accept-Encoding', None)
+            arguments = [(prop(argument, 'Argument.name'), prop(argument, 'Argument.value'))
+                         for argument in sampler.iter('elementProp') if argument.get('elementType') == 'HTTPArgument']
+            body = None
+            if prop(sampler, 'HTTPSampler.postBodyRaw') == 'true':
+                body = ''.join(value for _, value in arguments)
+                arguments = []
+            # arguments are not encoded (HTTPArgument.always_encode false), values in the jmx are
+            query = '&'.join(name + '=' + value for name, value in arguments)
+            steps.append(Step(sampler.get('testname'), prop(sampler, 'HTTPSampler.method'),
+                              prop(sampler, 'HTTPSampler.domain') or None, prop(sampler, 'HTTPSampler.path'),
+                              query, body, headers))
+    return steps, defaults
+
+
+def dataset_users(layout, edit_products, count=None):
+    """ Variables of the virtual users (shop, login, products_get, products_put), users go round the Etsy shops
+    """
+    shops = etsy_shops(layout, range(layout.base['shop_id_seq'] + 1,
+                                     layout.base['shop_id_seq'] + layout.etsy_shops + 1))
+    if not shops:
+        raise ValueError('the dataset has no Etsy shops')
+    users = []
+    for n in range(count or len(shops)):
+        shop = shops[n % len(shops)]
+        first = first_product_id(layout, shop)
+        products = range(first, first + min(edit_products, layout.sizes[shop_index(layout, shop)]))
+        users.append({
+            'shop': str(shop),
+            # company_id of the account is the shop id (gen_accounts)
+            'login': 'user%d' % shop,
+            'products_get': ','.join(str(product) for product in products),
+            'products_put': ','.join('"%d"' % product for product in products),
+        })
+    return users
+
+
+def substitute(text, variables):
+    return VARIABLE.sub(lambda m: variables.get(m.group(1), m.group()), text)
+
+
+class Recorder():
+    """ Feeds the samples to analyze_jtl.Analyzer, optionally writes them to JTL file
+
+    :param service: also collect the service times (open loop)
+    """
+    def __init__(self, jtl=None, service=False):
+        self.analyzer = Analyzer()
+        self.service = Analyzer() if service else None
+        self.active = 0
+        self.jtl = csv.writer(jtl, lineterminator='\n') if jtl else None
+        if self.jtl:
+            self.jtl.writerow(JTL_FIELDS)
+
+    def record(self, sample):
+        self.analyzer.add(sample.timestamp, sample.elapsed, sample.label, sample.thread, sample.success, sample.bytes)
+        if self.service:
+            self.service.add(sample.timestamp, sample.service, sample.label, sample.thread, sample.success,
+                             sample.bytes)
+        if self.jtl:
+            self.jtl.writerow([sample.timestamp, sample.elapsed // 1000, sample.label, sample.code, sample.thread,
+                               'true' if sample.success else 'false', sample.bytes, self.active, self.active,
+                               sample.latency // 1000, 1, 0 if sample.success else 1, sample.connect // 1000])
+
+
+def connect_tracer():
+    """ Trace config measuring the time of new connections, the request passes a dict as trace_request_ctx
+    """
+    async def start(session, ctx, params):
+        ctx.trace_request_ctx['connect_start'] = time.perf_counter()
+
+    async def end(session, ctx, params):
+        ctx.trace_request_ctx['connect'] += time.perf_counter() - ctx.trace_request_ctx['connect_start']
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(start)
+    trace.on_connection_create_end.append(end)
+    return trace
+
+
+def step_url(step, variables, urls):
+    url = urls.get(step.domain) or 'https://' + step.domain
+    url += substitute(step.path, variables)
+    if step.query:
+        url += '?' + substitute(step.query, variables)
+    return yarl.URL(url, encoded=True)
+
+
+async def run_step(session, step, variables, urls, thread, timeout, intended=None):
+    """ Send the request of the step, the sample times are measured from intended (perf_counter) if given
+    """
+    trace = {'connect': 0}
+    start = time.perf_counter()
+    intended = start if intended is None else intended
+    timestamp = int((time.time() - (start - intended)) * 1000)
+    latency = None
+    code, size, success = '', 0, False
+    body = substitute(step.body, variables).encode() if step.body is not None else None
+    try:
+        async with session.request(step.method, step_url(step, variables, urls), data=body, headers=step.headers,
+                                   timeout=timeout, trace_request_ctx=trace) as response:
+            latency = time.perf_counter() - start
+            size = len(await response.read())
+            code = str(response.status)
+            success = response.status < 400
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        code = e.__class__.__name__
+    end = time.perf_counter()
+    if latency is None:
+        latency = end - start
+    return Sample(timestamp, int((end - intended) * 1000000), step.label, code, thread, success, size,
+                  int((latency + start - intended) * 1000000), int(trace['connect'] * 1000000),
+                  int((end - start) * 1000000))
+
+
+async def run_user(n, variables, steps, urls, connector, recorder, settings, deadline):
+    thread = '%s-%d' % (THREAD_GROUP, n + 1)
+    rng = random.Random(n)
+    await asyncio.sleep(settings['ramp_up'] * n / settings['users'])
+    recorder.active += 1
+    try:
+        async with new_session(connector) as session:
+            loop = 0
+            while (loop < settings['loops'] if deadline is None else time.monotonic() < deadline):
+                for step in steps:
+                    recorder.record(await run_step(session, step, variables, urls, thread, settings['timeout']))
+                    if settings['think_time']:
+                        await asyncio.sleep(rng.expovariate(1 / settings['think_time']))
+                session.cookie_jar.clear()
+                loop += 1
+    finally:
+        recorder.active -= 1
+
+
+async def run_load(steps, users, urls, settings, recorder):
+    connector = aiohttp.TCPConnector(limit=settings['connections'], ssl=settings['ssl'])
+    deadline = time.monotonic() + settings['ramp_up'] + settings['duration'] if settings['duration'] else None
+    try:
+        await asyncio.gather(*[run_user(n, variables, steps, urls, connector, recorder, settings, deadline)
+                               for n, variables in enumerate(users)])
+    finally:
+        await connector.close()
+
+
+def parse_rate(spec, duration):
+    """ [(requests/s, seconds)] of "rate" (lasting duration) or "rate:seconds,rate:seconds,..."
+    """
+    segments = []
+    for part in spec.split(','):
+        rate, _, seconds = part.partition(':')
+        segments.append((float(rate), float(seconds) if seconds else duration))
+        if segments[-1][0] <= 0 or segments[-1][1] <= 0:
+            raise ValueError('rate and seconds must be positive: %s' % part)
+    return segments
+
+
+def arrival_times(segments):
+    """ Intended send times (seconds from the start) of a constant rate in every segment
+    """
+    start = 0
+    for rate, seconds in segments:
+        for n in range(int(rate * seconds)):
+            yield start + n / rate
+        start += seconds
+
+
+def new_session(connector):
+    return aiohttp.ClientSession(connector=connector, connector_owner=False, trace_configs=[connect_tracer()],
+                                 cookie_jar=aiohttp.CookieJar(unsafe=True))
+
+
+async def log_in(session, variables, prelude, urls, thread, timeout):
+    """ Run the steps before the open loop ones, return False if any of them failed
+    """
+    success = True
+    for step in prelude:
+        success = (await run_step(session, step, variables, urls, thread, timeout)).success and success
+    return success
+
+
+async def send_open(session, step, variables, urls, thread, recorder, settings, intended):
+    recorder.active += 1
+    try:
+        recorder.record(await run_step(session, step, variables, urls, thread, settings['timeout'], intended))
+    finally:
+        recorder.active -= 1
+
+
+async def run_open_loop(steps, users, urls, settings, recorder):
+    """ Log the users in, then send the open loop steps at the arrival times, round robin over steps and users
+    """
+    pattern = re.compile(settings['open_steps'])
+    first = next((i for i, step in enumerate(steps) if pattern.search(step.label)), None)
+    if first is None:
+        raise ValueError('no step matches %s' % settings['open_steps'])
+    prelude, open_steps = steps[:first], [step for step in steps if pattern.search(step.label)]
+
+    connector = aiohttp.TCPConnector(limit=settings['connections'], ssl=settings['ssl'])
+    sessions = [new_session(connector) for _ in users]
+    threads = ['%s-%d' % (THREAD_GROUP, n + 1) for n in range(len(users))]
+    try:
+        logged_in = await asyncio.gather(*[log_in(session, variables, prelude, urls, thread, settings['timeout'])
+                                           for session, variables, thread in zip(sessions, users, threads)])
+        if not all(logged_in):
+            print('warning: %d of %d users failed to log in' % (logged_in.count(False), len(users)), file=sys.stderr)
+
+        tasks = set()
+        start = time.perf_counter()
+        for n, offset in enumerate(arrival_times(settings['rate'])):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            user = n % len(users)
+            task = asyncio.ensure_future(send_open(sessions[user], open_steps[n % len(open_steps)], users[user], urls,
+                                                   threads[user], recorder, settings, start + offset))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        for session in sessions:
+            await session.close()
+        await connector.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay the hive-perf.jmx journey by asyncio virtual users")
+    parser.add_argument("--jmx", default=JMX_FILE, help="JMeter plan with the journey")
+    parser.add_argument("--etsy-shops", type=int, default=100, help="Etsy shops of the perf dataset (gen_shops.py)")
+    parser.add_argument("--profile", default='uniform',
+                        help="profile of the perf dataset, one of %s or a JSON file" % ', '.join(sorted(PROFILES)))
+    parser.add_argument("--seed", help="override the profile RNG seed")
+    parser.add_argument("--products", type=int, help="fixed number of products per shop, overrides the profile")
+    parser.add_argument("--edit-products", type=int, default=EDIT_PRODUCTS, help="products of the bulk edit steps")
+    parser.add_argument("--base-url", help="url of steps without own domain (default from the jmx)")
+    parser.add_argument("--login-url", help="url of steps with own domain (login)")
+    parser.add_argument("--users", type=int, help="virtual users (default: one per Etsy shop)")
+    parser.add_argument("--ramp-up", type=float, help="seconds until all users are started")
+    parser.add_argument("--think-time", type=float, help="mean seconds between steps")
+    parser.add_argument("--loops", type=int, help="journeys per user")
+    parser.add_argument("--duration", type=float, help="seconds to run after the ramp up instead of --loops")
+    parser.add_argument("--rate", help="open loop: requests/s, or step function rate:seconds,rate:seconds,...")
+    parser.add_argument("--open-steps", default=OPEN_STEPS, help="regexp of the steps sent in open loop")
+    parser.add_argument("--connections", type=int, default=0, help="connection pool size (0: unlimited)")
+    parser.add_argument("--timeout", type=float, default=60, help="request timeout in seconds")
+    parser.add_argument("--insecure", action='store_true', help="do not verify TLS certificates")
+    parser.add_argument("--jtl", help="write samples to this CSV file (JMeter format)")
+    parser.add_argument("--json", help="write the histograms to this JSON file (analyze_jtl.py --json format)")
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile)
+    if args.seed is not None:
+        profile['seed'] = args.seed
+    if args.products is not None:
+        profile['products'] = {'dist': 'fixed', 'value': args.products}
+    settings = dict(LOAD_DEFAULTS, **profile.get('load', {}))
+    for key in LOAD_DEFAULTS:
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    settings.update(duration=args.duration, connections=args.connections, ssl=not args.insecure,
+                    timeout=aiohttp.ClientTimeout(total=args.timeout), open_steps=args.open_steps)
+    try:
+        settings['rate'] = parse_rate(args.rate, args.duration or OPEN_DURATION) if args.rate else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    steps, defaults = parse_journey(args.jmx)
+    default_url = 'https://' + defaults['domain'] + (':' + defaults['port'] if defaults['port'] else '')
+    urls = {None: args.base_url or default_url}
+    if args.login_url:
+        urls.update((step.domain, args.login_url) for step in steps if step.domain)
+    try:
+        users = dataset_users(make_layout(args.etsy_shops, 0, profile), args.edit_products, settings['users'])
+    except ValueError as e:
+        parser.error(str(e))
+    settings['users'] = len(users)
+
+    jtl = open(args.jtl, 'w', newline='') if args.jtl else None
+    try:
+        recorder = Recorder(jtl, service=bool(settings['rate']))
+        if settings['rate']:
+            asyncio.run(run_open_loop(steps, users, urls, settings, recorder))
+        else:
+            asyncio.run(run_load(steps, users, urls, settings, recorder))
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if jtl:
+            jtl.close()
+
+    if recorder.service:
+        print('response time from the intended send time (coordinated omission corrected):')
+    print_report(recorder.analyzer, sys.stdout)
+    if recorder.service:
+        print('\nservice time from the actual send time (not corrected):')
+        print_report(recorder.service, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(recorder.analyzer.to_dict(), out)
@@ -0,0 +1,355 @@
+import datetime
+import decimal
+import functools
+import gzip
+import io
+import json
+import re
+import struct
+import subprocess
+
+import psycopg2
+
+# Helpers for streaming generated rows into Postgres with COPY ... FROM STDIN
+#
+# Usage:
+#    from pgcopy import copy_chunks
+#
+#    conn = psycopg2.connect(dsn)
+#    copy_chunks(conn, 'shop_sections', 'id, shop_id, section_id, value', gen_shop_sections(100))
+#    conn.commit()
+#
+# Rows given as tuples of python values are encoded by encode_rows() to COPY text
+# or PGCOPY binary format, according to the column types:
+#
+#    types = ['int8', 'int8', 'int8', 'text']
+#    copy_chunks(conn, 'shop_sections', columns, encode_rows(types, row_chunks, binary=True), binary=True)
+
+    # psycopg2 reads the COPY source in blocks of this size
+COPY_BLOCK_SIZE = 1024 * 1024
+    # size of the output file buffer, generators yield about one shop per chunk
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+    # gzip default, 9 is much slower for little gain on SQL dumps
+GZIP_LEVEL = 6
+
+    # signature, flags and header extension length of PGCOPY binary format
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+PG_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    # element type oids of binary arrays
+TYPE_OIDS = {'bool': 16, 'int8': 20, 'int4': 23, 'text': 25}
+
+TEXT_NULL = b'\\N'
+TEXT_SPECIAL = re.compile(rb'[\\\t\n\r]')
+TEXT_ESCAPES = {b'\\': b'\\\\', b'\t': b'\\t', b'\n': b'\\n', b'\r': b'\\r'}
+ARRAY_SPECIAL = re.compile(r'[\s{},"\\]')
+BINARY_NULL = struct.pack('!i', -1)
+
+
+def shard_ranges(shop_count, shard_count):
+    """ Split shops 1..shop_count to shard_count ranges of consecutive shop ids
+
+    Generators compute all row ids from the shop id, so every shard owns disjoint
+    id ranges - shards can be generated by separate processes and loaded in any order.
+    """
+    size = max(1, -(-shop_count // shard_count))
+    return [range(first, min(first + size, shop_count + 1)) for first in range(1, shop_count + 1, size)]
+
+
+def text_escape(value):
+    """ Escape a text field of COPY text format
+    """
+    if TEXT_SPECIAL.search(value):
+        return TEXT_SPECIAL.sub(lambda m: TEXT_ESCAPES[m.group()], value)
+    return value
+
+
+def text_array_element(value):
+    value = str(value)
+    if value == '' or value.upper() == 'NULL' or ARRAY_SPECIAL.search(value):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return value
+
+
+@functools.lru_cache(maxsize=1024)
+def text_timestamptz(value):
+    return value.isoformat(' ').encode()
+
+
+def text_bool(value):
+    return b't' if value else b'f'
+
+
+def text_int(value):
+    return b'%d' % value
+
+
+def text_str(value):
+    return text_escape(value.encode())
+
+
+def text_numeric(value):
+    return str(value).encode()
+
+
+def text_jsonb(value):
+    return text_escape(json.dumps(value).encode())
+
+
+def text_array(value):
+    return text_escape(('{' + ','.join(text_array_element(v) for v in value) + '}').encode())
+
+
+TEXT_ENCODERS = {
+    'bool': text_bool,
+    'int4': text_int,
+    'int8': text_int,
+    'numeric': text_numeric,
+    'text': text_str,
+    'timestamptz': text_timestamptz,
+    'jsonb': text_jsonb,
+    'int8[]': text_array,
+    'text[]': text_array,
+}
+
+
+def binary_field(data):
+    return struct.pack('!i', len(data)) + data
+
+
+def binary_bool(value):
+    return b'\x00\x00\x00\x01\x01' if value else b'\x00\x00\x00\x01\x00'
+
+
+def binary_int4(value):
+    return struct.pack('!ii', 4, value)
+
+
+def binary_int8(value):
+    return struct.pack('!iq', 8, value)
+
+
+def binary_str(value):
+    return binary_field(value.encode())
+
+
+@functools.lru_cache(maxsize=1024)
+def binary_timestamptz(value):
+    """ Microseconds since 2000-01-01 UTC
+    """
+    return struct.pack('!iq', 8, (value - PG_EPOCH) // datetime.timedelta(microseconds=1))
+
+
+def binary_numeric(value):
+    """ Numeric as base 10000 digits: ndigits, weight of the first digit, sign, display scale, digits
+    """
+    value = decimal.Decimal(value)
+    sign = 0x4000 if value < 0 else 0
+    dscale = max(-value.as_tuple().exponent, 0)
+    integer, _, fraction = format(abs(value), 'f').partition('.')
+    integer = integer.lstrip('0')
+    integer = integer.zfill(-(-len(integer) // 4) * 4)
+    fraction = fraction.ljust(-(-len(fraction) // 4) * 4, '0')
+    digits = [int(integer[i:i + 4]) for i in range(0, len(integer), 4)]
+    weight = len(digits) - 1
+    digits += [int(fraction[i:i + 4]) for i in range(0, len(fraction), 4)]
+    while digits and digits[0] == 0:
+        digits.pop(0)
+        weight -= 1
+    while digits and digits[-1] == 0:
+        digits.pop()
+    if not digits:
+        weight = 0
+    return binary_field(struct.pack('!hhHH%dH' % len(digits), len(digits), weight, sign, dscale, *digits))
+
+
+def binary_jsonb(value):
+    """ jsonb binary format is a version byte followed by the json text
+    """
+    return binary_field(b'\x01' + json.dumps(value).encode())
+
+
+def binary_array(element_type):
+    """ Return encoder of one dimensional arrays without NULLs
+    """
+    oid = TYPE_OIDS[element_type]
+    encode = BINARY_ENCODERS[element_type]
+
+    def encode_array(value):
+        if not value:
+            return binary_field(struct.pack('!iii', 0, 0, oid))
+        return binary_field(struct.pack('!iiiii', 1, 0, oid, len(value), 1) + b''.join([encode(v) for v in value]))
+    return encode_array
+
+
+BINARY_ENCODERS = {
+    'bool': binary_bool,
+    'int4': binary_int4,
+    'int8': binary_int8,
+    'numeric': binary_numeric,
+    'text': binary_str,
+    'timestamptz': binary_timestamptz,
+    'jsonb': binary_jsonb,
+}
+BINARY_ENCODERS['int8[]'] = binary_array('int8')
+BINARY_ENCODERS['text[]'] = binary_array('text')
+
+
+def encode_text(types, rows):
+    encoders = [TEXT_ENCODERS[t] for t in types]
+    return b''.join([b'\t'.join([TEXT_NULL if value is None else encode(value)
+                                 for encode, value in zip(encoders, row)]) + b'\n' for row in rows])
+
+
+def encode_binary(types, rows):
+    encoders = [BINARY_ENCODERS[t] for t in types]
+    field_count = struct.pack('!h', len(types))
+    return b''.join([field_count + b''.join([BINARY_NULL if value is None else encode(value)
+                                             for encode, value in zip(encoders, row)]) for row in rows])
+
+
+def encode_rows(types, row_chunks, binary=False):
+    """ Encode chunks of rows to COPY data, yield one bytes chunk per chunk of rows
+
+    :param types: column types - bool, int4, int8, numeric, text, timestamptz, jsonb, int8[], text[]
+    :param row_chunks: iterable of lists of row tuples, None is NULL
+    :param binary: PGCOPY binary format (with header and trailer) instead of text format
+    """
+    if binary:
+        yield PGCOPY_HEADER
+        for rows in row_chunks:
+            yield encode_binary(types, rows)
+        yield PGCOPY_TRAILER
+    else:
+        for rows in row_chunks:
+            yield encode_text(types, rows)
+
+
+def copy_options(binary):
+    return ' (FORMAT binary)' if binary else ''
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Read-only file-like object over an iterable of bytes chunks.
+    Chunks are pulled lazily, so the whole table is never held in memory.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._pos >= len(self._chunk):
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+            self._pos = 0
+        size = min(len(buffer), len(self._chunk) - self._pos)
+        buffer[:size] = self._chunk[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+
+def copy_chunks(conn, table, columns, chunks, binary=False):
+    """ Run COPY <table> (<columns>) FROM STDIN, read the data from bytes chunks
+
+    :param conn: psycopg2 connection, the caller commits
+    :param table: table name
+    :param columns: comma separated column names
+    :param chunks: iterable of bytes in COPY text format, or PGCOPY binary format if binary is set
+    """
+    cur = conn.cursor()
+    cur.copy_expert('COPY ' + table + ' (' + columns + ') FROM STDIN' + copy_options(binary), ChunkReader(chunks),
+                    size=COPY_BLOCK_SIZE)
+    cur.close()
+
+
+def load_chunks(dsn, table, columns, chunks, binary=False):
+    """ Open own connection, COPY chunks into the table and commit
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        copy_chunks(conn, table, columns, chunks, binary)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_chunks(out, chunks):
+    """ Write bytes chunks to a binary (buffered) stream
+    """
+    for chunk in chunks:
+        out.write(chunk)
+    out.flush()
+
+
+class ZstdWriter():
+    """
+    Binary file-like object compressing to a .zst file by the zstd command,
+    there is no zstd module in the standard library.
+    """
+    def __init__(self, path):
+        self._process = subprocess.Popen(['zstd', '-q', '-f', '-o', path], stdin=subprocess.PIPE)
+
+    def write(self, data):
+        return self._process.stdin.write(data)
+
+    def flush(self):
+        self._process.stdin.flush()
+
+    def close(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise IOError('zstd failed with exit code %d' % self._process.returncode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_output(path):
+    """ Open a binary output file, compressed by the file extension: .gz (gzip) or .zst (zstd)
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+    if path.endswith('.zst'):
+        return ZstdWriter(path)
+    return open(path, 'wb', buffering=WRITE_BUFFER_SIZE)
+
+
+class ZstdReader(io.RawIOBase):
+    """
+    Binary file-like object decompressing a .zst file by the zstd command
+    """
+    def __init__(self, path):
+        self._process = subprocess.Popen(['zstd', '-q', '-dc', path], stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._process.stdout.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            self._process.stdout.close()
+            if self._process.wait() != 0:
+                raise IOError('zstd failed with exit code %d' % self._process.returncode)
+        super().close()
+
+
+def open_input(path):
+    """ Open a binary input file, decompressed by the file extension: .gz (gzip) or .zst (zstd)
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        return io.BufferedReader(ZstdReader(path), WRITE_BUFFER_SIZE)
+    return open(path, 'rb', buffering=WRITE_BUFFER_SIZE)
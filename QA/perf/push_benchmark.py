@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+import argparse
+import json
+import os
+import sys
+import time
+
+import requests
+
+from sync_benchmark import (COMPANY_ID, EMPTY_SHOP_SQL, LISTINGS_PER_SECOND_TIMEOUT, MIN_TIMEOUT, POLL_INTERVAL,
+                            SCENARIO, SHOP_ID, load_conditions, start_product, wait_for_sync)
+
+    # product control, test data and the Etsy emulator of the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+from modules.hivedb import HiveDatabase, ShopInfoCols  # noqa: E402
+from modules.rabbit import setup_rabbit  # noqa: E402
+from tests.base import HIVE_DATABASE_URL, BaseTestClass, load_sql  # noqa: E402
+from tests.etsy_emulator_support import EtsyEmulatorInterface  # noqa: E402
+import tests.vela_control as vela  # noqa: E402
+
+# Bulk edit push throughput benchmark - how fast the worker writes a bulk change of a big shop to Etsy
+# For every shop size and number of worker processes:
+#   - stops the product, loads the shop without products (listings_empty) and the users (auth_01),
+#     sets the emulator scenario perf_sync_<size>, starts the product and imports the shop (syncShop)
+#   - for every emulator response delay (--delays ms, a fixed latency added to the --conditions of the
+#     emulator, see etsy-emulator/lib/conditions.js; 0 keeps their latency):
+#     logs in to the web API as --user, sends one bulk edit of all products (title.addBefore) to
+#     PUT /api/v1/shops/<shop>/products as the Sync Updates button does, waits until the operations
+#     are applied, triggers syncShop and waits until the shop is synced again
+# Reports the seconds of the apply and of the whole push (from the bulk edit request to the shop synced)
+# and, from EtsyEmulatorInterface.get_api_calls, the PUT/POST calls which reached the emulator:
+# their count, mean rate (first to last call) and the peak calls in one second, and the 429 responses
+# and injected errors of the emulator conditions.
+# Run it on the test instance (bin/qa-test environment), the product is left running.
+#
+# Usage:
+#    ./push_benchmark.py
+#    ./push_benchmark.py --sizes 10000 --workers 1,4 --delays 0,100,300 --json push.json
+#    ./push_benchmark.py --sizes 1000 --delays 0 --conditions etsy-like.json
+
+SIZES = '1000,10000'
+WORKERS = '1'
+DELAYS = '0,100,300'
+USER = 'user1'
+PASSWORD = 'pass1'
+AUTH_SQL = 'auth_01'
+TITLE_PREFIX = 'TEST '
+WRITE_METHODS = ['PUT', 'POST']
+
+
+def web_urls():
+    """ (login URL, web API URL) of the product, as BaseTestClass.setup_class
+    """
+    prod_host = os.environ.get('QA_PRODUCT_HOST', '127.0.0.1')
+    prod_port = os.environ.get('QA_WEB_HTTPS_PORT', '80')
+    login_host = os.environ.get('QA_PRODUCT_HOST_AUTH', prod_host)
+    return ('https://' + login_host + ':' + os.environ['QA_AUTH_HTTPS_PORT'] + '/api/v1/login',
+            'https://' + prod_host + ':' + prod_port + '/api/v1/')
+
+
+def log_in(login_url, user, password):
+    """ requests session with the session cookie of the user
+    """
+    session = requests.Session()
+    r = session.post(login_url, json={'username': user, 'password': password}, allow_redirects=False)
+    if r.status_code >= 400 or not session.cookies:
+        raise Exception('Login of %s failed: %d %s' % (user, r.status_code, r.text))
+    return session
+
+
+def wait_for_apply(hive_db, shop_id, timeout):
+    """ Wait until the worker applied the bulk operations of the shop
+    """
+    start = time.monotonic()
+    while hive_db.get_shop_info(shop_id, [ShopInfoCols.APPLYING_OPERATIONS])[0]:
+        if time.monotonic() - start > timeout:
+            raise Exception('Operations of shop %d not applied in %d s' % (shop_id, timeout))
+        time.sleep(POLL_INTERVAL)
+
+
+def write_calls(since):
+    """ Timestamps (ms) of the PUT/POST calls the emulator received since the time (ms)
+    """
+    return sorted(call['ts'] for call in EtsyEmulatorInterface().get_api_calls()
+                  if call['method'] in WRITE_METHODS and call['ts'] >= since)
+
+
+def run_push(session, api_url, hive_db, company_id, shop_id, size, timeout, conditions):
+    """ Bulk edit all products of the shop, wait for the push to Etsy, return the measurements
+    """
+    emulator = EtsyEmulatorInterface()
+    emulator.set_conditions(conditions)
+    product_ids = [str(row[0]) for row in hive_db.find_etsy_products(shop_id, '%')]
+    operations = [{'type': 'title.addBefore', 'value': TITLE_PREFIX, 'products': product_ids}]
+    last_sync_time = hive_db.get_shop_last_sync_time(shop_id)
+
+    since = int(time.time() * 1000)
+    start = time.monotonic()
+    r = session.put(api_url + 'shops/%d/products' % shop_id, json=operations)
+    if r.status_code != 200:
+        raise Exception('Bulk edit of shop %d failed: %d %s' % (shop_id, r.status_code, r.text))
+    wait_for_apply(hive_db, shop_id, timeout)
+    apply_seconds = time.monotonic() - start
+    vela.trigger_etsy_shop_sync(company_id, shop_id)
+    wait_for_sync(hive_db, shop_id, last_sync_time, size, timeout)
+    seconds = time.monotonic() - start
+    stats = emulator.get_conditions()['stats']
+
+    calls = write_calls(since)
+    duration = (calls[-1] - calls[0]) / 1000 if len(calls) > 1 else 0
+    per_second = {}
+    for ts in calls:
+        per_second[ts // 1000] = per_second.get(ts // 1000, 0) + 1
+    return {'products': len(product_ids), 'apply_seconds': apply_seconds, 'seconds': seconds,
+            'writes': len(calls), 'writes_per_s': len(calls) / duration if duration else 0,
+            'peak_writes_per_s': max(per_second.values(), default=0), 'rate_limited': stats['rate_limited'],
+            'errors': stats['errors']}
+
+
+def benchmark(size, workers, delays, conditions, user, password, company_id, shop_id, timeout):
+    """ Import a shop of size listings with the number of worker processes, push a bulk edit per delay
+    """
+    product = BaseTestClass()
+    product.stop_all()
+    setup_rabbit()
+    load_sql('HIVE', EMPTY_SHOP_SQL, retry=2)
+    load_sql('AUTH', AUTH_SQL, retry=2)
+    product.set_etsy_testcase(SCENARIO % size)
+    start_product(workers, size, 'push_benchmark %s workers=%d' % (SCENARIO % size, workers))
+
+    hive_db = HiveDatabase(HIVE_DATABASE_URL)
+    last_sync_time = hive_db.get_shop_last_sync_time(shop_id)
+    vela.trigger_etsy_shop_sync(company_id, shop_id)
+    wait_for_sync(hive_db, shop_id, last_sync_time, size, timeout)
+
+    login_url, api_url = web_urls()
+    session = log_in(login_url, user, password)
+    results = []
+    try:
+        for delay in delays:
+            push_conditions = dict(conditions, latency={'distribution': 'fixed', 'ms': delay}) if delay else conditions
+            results.append(dict(listings=size, workers=workers, delay_ms=delay,
+                                **run_push(session, api_url, hive_db, company_id, shop_id, size, timeout,
+                                           push_conditions)))
+    finally:
+        EtsyEmulatorInterface().set_conditions({})
+    return results
+
+
+def print_result(result, out):
+    out.write('%8d %7d %8d %9.1f %9.1f %8d %9.1f %8d %6d %6d\n' % (
+        result['listings'], result['workers'], result['delay_ms'], result['apply_seconds'], result['seconds'],
+        result['writes'], result['writes_per_s'], result['peak_writes_per_s'], result['rate_limited'],
+        result['errors']))
+    out.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk edit push throughput by shop size, workers and Etsy latency")
+    parser.add_argument("--sizes", default=SIZES, help="comma separated listings per shop (perf_sync_<size> scenarios)")
+    parser.add_argument("--workers", default=WORKERS, help="comma separated numbers of worker processes")
+    parser.add_argument("--delays", default=DELAYS, help="comma separated emulator response delays in ms")
+    parser.add_argument("--conditions", help="JSON file of the emulator conditions (etsy-emulator/lib/conditions.js)")
+    parser.add_argument("--user", default=USER, help="web user of the shop (auth_01)")
+    parser.add_argument("--password", default=PASSWORD, help="password of the web user")
+    parser.add_argument("--company-id", type=int, default=COMPANY_ID, help="company of the shop (listings_empty)")
+    parser.add_argument("--shop-id", type=int, default=SHOP_ID, help="shop to edit (listings_empty)")
+    parser.add_argument("--timeout", type=float, help="seconds of one import or push before failing "
+                                                      "(default: by the size)")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        workers = [int(n) for n in args.workers.split(',')]
+        delays = [int(delay) for delay in args.delays.split(',')]
+    except ValueError:
+        parser.error('--sizes, --workers and --delays are comma separated numbers')
+
+    conditions = load_conditions(args.conditions)
+    results = []
+    sys.stdout.write('%8s %7s %8s %9s %9s %8s %9s %8s %6s %6s\n' % (
+        'listings', 'workers', 'delay ms', 'apply s', 'push s', 'writes', 'writes/s', 'peak/s', '429s', 'errors'))
+    for size in sizes:
+        timeout = args.timeout or max(MIN_TIMEOUT, size / LISTINGS_PER_SECOND_TIMEOUT)
+        for n in workers:
+            for result in benchmark(size, n, delays, conditions, args.user, args.password, args.company_id,
+                                    args.shop_id, timeout):
+                print_result(result, sys.stdout)
+                results.append(result)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import psycopg2
+
+    # RabbitMQ helper is shared with the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+
+# Server side resource sampler for load tests - run it on the server host next to a load run
+# Every --interval seconds samples
+#   - pg: client connections by state (pg_stat_activity) and statement calls, rows and execution
+#     time per second (pg_stat_statements deltas, skipped without the extension), the same for the
+#     --top-queries statements with the most execution time, their text is written once as pg_query rows
+#   - rabbit: ready and unacknowledged messages per queue and their sum (rabbitmqadmin, needs the
+#     management plugin) or ready messages and consumers of --queues (AMQP passive declares)
+#   - proc: CPU percent and RSS of the product node processes (dist/<type>/server.js started by
+#     bin/hive/restart-product) summed per type - manager, web, worker, auth
+# and writes one CSV row per value: timeStamp (milliseconds since the epoch, the same for all values
+# of one sample, JTL time base), source, name, value. analyze_jtl.py --resources joins the file with
+# the request latencies by time window. A source failing (RabbitMQ down) is reported and skipped.
+#
+# Usage:
+#    ./sample_resources.py --output resources.csv --duration 600 &
+#    ./load_journey.py --etsy-shops 100 --duration 600 --jtl results.csv
+#    ./analyze_jtl.py --resources resources.csv results.csv
+#
+#    ./sample_resources.py --interval 5 --dsn 'host=db dbname=hive user=hive' --rabbit amqp --queues db1.manager-tasks
+
+INTERVAL = 1
+TOP_QUERIES = 5
+QUERY_TEXT_LENGTH = 200
+RABBITMQADMIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi', 'bin', 'rabbitmqadmin')
+SERVER_JS = re.compile(r'/dist/(\w+)/server\.js$')
+FIELDS = ['timeStamp', 'source', 'name', 'value']
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+ACTIVITY_SQL = """
+SELECT coalesce(state, 'unknown'), wait_event_type = 'Lock', count(*) FROM pg_stat_activity
+WHERE backend_type = 'client backend' AND pid <> pg_backend_pid()
+GROUP BY 1, 2
+"""
+    # total_time was split to plan and exec time in PostgreSQL 13
+STATEMENTS_SQL = """
+SELECT queryid, sum(calls), sum(rows), sum({time}), min(query) FROM pg_stat_statements
+WHERE queryid IS NOT NULL GROUP BY queryid
+"""
+
+
+class PgSampler():
+    """ pg_stat_activity counts and pg_stat_statements rates
+    """
+    source = 'pg'
+
+    def __init__(self, dsn, top_queries):
+        self.conn = psycopg2.connect(dsn)
+        self.conn.autocommit = True
+        self.top_queries = top_queries
+        self.last = None
+        self.written = set()
+        cur = self.conn.cursor()
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+        if cur.fetchone() is None:
+            print('pg_stat_statements is not installed, sampling connections only', file=sys.stderr)
+            self.statements_sql = None
+        else:
+            time_column = 'total_exec_time' if self.conn.server_version >= 130000 else 'total_time'
+            self.statements_sql = STATEMENTS_SQL.format(time=time_column)
+
+    def sample(self, seconds):
+        cur = self.conn.cursor()
+        cur.execute(ACTIVITY_SQL)
+        values = {'activity.' + state: 0 for state in ['active', 'idle', 'idle in transaction', 'waiting']}
+        total = 0
+        for state, waiting, count in cur.fetchall():
+            values['activity.' + state] = values.get('activity.' + state, 0) + count
+            if waiting:
+                values['activity.waiting'] += count
+            total += count
+        values['activity.total'] = total
+        if self.statements_sql:
+            cur.execute(self.statements_sql)
+            values.update(self.statement_rates(cur.fetchall(), seconds))
+        return values
+
+    def statement_rates(self, rows, seconds):
+        """ Calls, rows and execution ms per second since the last sample, total and of the top queries
+        """
+        current = {queryid: (calls, rows_, time_ms, query) for queryid, calls, rows_, time_ms, query in rows}
+        last, self.last = self.last, current
+        if last is None or not seconds:
+            return {}
+        deltas = []
+        for queryid, (calls, rows_, time_ms, query) in current.items():
+            previous = last.get(queryid)
+            # new statement, or statistics reset (pg_stat_statements_reset(), evicted entry)
+            if previous is None or calls < previous[0]:
+                previous = (0, 0, 0)
+            if calls > previous[0]:
+                deltas.append((float(time_ms - previous[2]), int(calls - previous[0]), int(rows_ - previous[1]),
+                               queryid, query))
+        values = {
+            'statements.calls_per_s': sum(d[1] for d in deltas) / seconds,
+            'statements.rows_per_s': sum(d[2] for d in deltas) / seconds,
+            'statements.exec_ms_per_s': sum(d[0] for d in deltas) / seconds,
+        }
+        for time_ms, calls, _, queryid, query in sorted(deltas, key=lambda d: d[0], reverse=True)[:self.top_queries]:
+            values['query.%s.calls_per_s' % queryid] = calls / seconds
+            values['query.%s.exec_ms_per_s' % queryid] = time_ms / seconds
+            if queryid not in self.written:
+                self.written.add(queryid)
+                values[('pg_query', str(queryid))] = ' '.join(query.split())[:QUERY_TEXT_LENGTH]
+        return values
+
+
+class RabbitAdminSampler():
+    """ Messages of all queues of the vhost by rabbitmqadmin (management HTTP API)
+    """
+    source = 'rabbit'
+
+    def __init__(self):
+        self.command = [RABBITMQADMIN]
+        for option, variable in [('-H', 'QA_RABBIT_HOST'), ('-V', 'QA_RABBIT_VHOST'), ('-u', 'QA_RABBIT_USER'),
+                                 ('-p', 'QA_RABBIT_PASSWORD')]:
+            if os.environ.get(variable):
+                self.command += [option, os.environ[variable]]
+        self.command += ['-f', 'raw_json', 'list', 'queues', 'name', 'messages_ready', 'messages_unacknowledged']
+
+    def sample(self, seconds):
+        queues = json.loads(subprocess.check_output(self.command, timeout=10))
+        values = {'messages': 0}
+        for queue in queues:
+            ready = queue.get('messages_ready') or 0
+            unacked = queue.get('messages_unacknowledged') or 0
+            values['queue.%s.ready' % queue['name']] = ready
+            values['queue.%s.unacked' % queue['name']] = unacked
+            values['messages'] += ready + unacked
+        return values
+
+
+class RabbitAmqpSampler():
+    """ Ready messages and consumers of the given queues by passive declares
+    """
+    source = 'rabbit'
+
+    def __init__(self, queues):
+        from modules.rabbit import Rabbit
+        self.rabbit = Rabbit()
+        self.queues = queues
+
+    def sample(self, seconds):
+        values = {'messages': 0}
+        for name, (messages, consumers) in self.rabbit.queue_depths(self.queues).items():
+            values['queue.%s.ready' % name] = messages
+            values['queue.%s.consumers' % name] = consumers
+            values['messages'] += messages
+        return values
+
+
+def product_processes(product_dir=None):
+    """ {pid: process type} of the running node servers, the type from their dist/<type>/server.js
+    """
+    processes = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                args = f.read().decode(errors='replace').rstrip('\0').split('\0')
+        except OSError:
+            continue
+        match = SERVER_JS.search(args[-1])
+        if match and (product_dir is None or args[-1].startswith(product_dir)):
+            processes[int(pid)] = match.group(1)
+    return processes
+
+
+def process_stat(pid):
+    """ (start time, CPU ticks, RSS bytes) of the process, None if it is gone
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # fields after the command (may contain spaces), from the state field 3 on
+    fields = stat[stat.rindex(')') + 2:].split()
+    return int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21]) * PAGE_SIZE
+
+
+class ProcessSampler():
+    """ CPU percent and RSS of the product processes summed per type, processes are looked up every sample
+    """
+    source = 'proc'
+
+    def __init__(self, product_dir=None):
+        self.product_dir = product_dir
+        self.last = {}
+
+    def sample(self, seconds):
+        values = {}
+        current = {}
+        for pid, process_type in product_processes(self.product_dir).items():
+            stat = process_stat(pid)
+            if stat is None:
+                continue
+            start, ticks, rss = stat
+            current[pid] = (start, ticks)
+            values.setdefault(process_type + '.processes', 0)
+            values[process_type + '.processes'] += 1
+            values[process_type + '.rss_mb'] = values.get(process_type + '.rss_mb', 0) + rss / 1024 / 1024
+            last = self.last.get(pid)
+            # restarted processes (same pid, other start time) are measured from the next sample
+            if last is not None and last[0] == start and seconds:
+                cpu = (ticks - last[1]) / CLOCK_TICKS / seconds * 100
+                values[process_type + '.cpu'] = values.get(process_type + '.cpu', 0) + cpu
+        self.last = current
+        return values
+
+
+def run(samplers, writer, flush, interval, duration):
+    """ Sample every interval seconds (without drift) until the duration ends or SIGTERM/SIGINT
+    """
+    stop = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+    failed = set()
+    start = time.monotonic()
+    last = None
+    tick = 0
+    while not stop and (duration is None or tick * interval <= duration):
+        now = time.monotonic()
+        timestamp = int(time.time() * 1000)
+        seconds = now - last if last is not None else 0
+        last = now
+        for sampler in samplers:
+            try:
+                values = sampler.sample(seconds)
+            except Exception as e:
+                if sampler not in failed:
+                    print('%s sampling failed: %s' % (sampler.source, e), file=sys.stderr)
+                    failed.add(sampler)
+                continue
+            failed.discard(sampler)
+            for name, value in values.items():
+                source, name = name if isinstance(name, tuple) else (sampler.source, name)
+                writer.writerow([timestamp, source, name, round(value, 3) if isinstance(value, float) else value])
+        flush()
+        tick += 1
+        try:
+            time.sleep(max(0, start + tick * interval - time.monotonic()))
+        except KeyboardInterrupt:
+            break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sample database, queue and process resources during a load test")
+    parser.add_argument("--output", help="CSV file (default: stdout)")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between samples")
+    parser.add_argument("--duration", type=float, help="seconds to sample (default: until interrupted)")
+    parser.add_argument("--dsn", default='', help="libpq connection string (default: PG* environment)")
+    parser.add_argument("--no-pg", action='store_true', help="do not sample PostgreSQL")
+    parser.add_argument("--top-queries", type=int, default=TOP_QUERIES,
+                        help="statements with most execution time sampled one by one")
+    parser.add_argument("--rabbit", choices=['admin', 'amqp', 'none'],
+                        help="queue depths by rabbitmqadmin or AMQP passive declares "
+                             "(default: admin if QA_RABBIT_HOST is set)")
+    parser.add_argument("--queues", help="comma separated queues for --rabbit amqp")
+    parser.add_argument("--product-dir", help="sample only node servers of this product directory")
+    args = parser.parse_args()
+
+    rabbit = args.rabbit or ('admin' if os.environ.get('QA_RABBIT_HOST') else 'none')
+    if rabbit == 'amqp' and not args.queues:
+        parser.error('--rabbit amqp needs --queues')
+
+    samplers = []
+    if not args.no_pg:
+        try:
+            samplers.append(PgSampler(args.dsn, args.top_queries))
+        except psycopg2.Error as e:
+            parser.error('cannot sample PostgreSQL: %s' % str(e).strip())
+    if rabbit == 'admin':
+        samplers.append(RabbitAdminSampler())
+    elif rabbit == 'amqp':
+        samplers.append(RabbitAmqpSampler(args.queues.split(',')))
+    samplers.append(ProcessSampler(args.product_dir))
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(FIELDS)
+        run(samplers, writer, out.flush, args.interval, args.duration)
+    finally:
+        if args.output:
+            out.close()
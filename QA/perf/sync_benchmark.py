@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+import argparse
+import json
+import os
+import sys
+import time
+from subprocess import call
+
+import psycopg2
+
+    # product control, test data and the Etsy emulator of the test harness
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests-shi'))
+from modules.hivedb import HiveDatabase, ShopInfoCols, ShopSyncStatus  # noqa: E402
+from modules.rabbit import setup_rabbit  # noqa: E402
+from tests.base import BIN_DIR, HIVE_DATABASE_URL, BaseTestClass, load_sql, set_pg_environment  # noqa: E402
+from tests.etsy_emulator_support import EtsyEmulatorInterface  # noqa: E402
+import tests.vela_control as vela  # noqa: E402
+
+# End to end shop sync throughput benchmark against the Etsy emulator
+# For every shop size and number of worker processes:
+#   - stops the product, loads the shop without products (listings_empty), sets the emulator scenario
+#     perf_sync_<size> (all listings generated from one template listing) and starts the product
+#     with QA_WORKER_PROCESSES workers
+#   - import: triggers syncShop and waits until the shop is up_to_date with all the products
+#   - re-sync: triggers syncShop --resyncs times more, nothing changed on Etsy
+# and reports the seconds, listings/s, rows written (inserted + updated + deleted tuples of the
+# hive database) per second and WAL written of every phase.
+# --conditions sets upstream conditions of the emulator for every phase (JSON file, see
+# etsy-emulator/lib/conditions.js - latency, injected errors, rate limit, bandwidth), the phases report
+# also the 429 responses and injected errors the worker got.
+# Run it on the test instance (bin/qa-test environment), the product is left running.
+#
+# Usage:
+#    ./sync_benchmark.py
+#    ./sync_benchmark.py --sizes 1000,10000 --workers 1,2,4,8 --json sync.json
+#    ./sync_benchmark.py --sizes 1000 --conditions etsy-like.json
+
+SIZES = '100,1000,10000,50000'
+WORKERS = '1'
+RESYNCS = 1
+COMPANY_ID = 2
+SHOP_ID = 2
+SCENARIO = 'perf_sync_%d'
+EMPTY_SHOP_SQL = 'listings_empty'
+POLL_INTERVAL = 0.5
+    # seconds of a sync before it fails - at least MIN_TIMEOUT, or LISTINGS_PER_SECOND_TIMEOUT listings/s
+MIN_TIMEOUT = 120
+LISTINGS_PER_SECOND_TIMEOUT = 5
+    # backends flush table statistics within a second when idle, at the latest in 10 seconds
+STATS_SETTLE = 1
+STATS_MAX_WAIT = 12
+
+WRITES_SQL = """
+SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0), pg_current_wal_lsn() - '0/0'::pg_lsn
+FROM pg_stat_user_tables
+"""
+
+
+def database_writes(conn):
+    """ (rows written, WAL bytes) of the database so far, after the table statistics settle
+    """
+    cur = conn.cursor()
+    last = None
+    deadline = time.monotonic() + STATS_MAX_WAIT
+    while True:
+        cur.execute('SELECT pg_stat_clear_snapshot()')
+        cur.execute(WRITES_SQL)
+        rows, wal = cur.fetchone()
+        if rows == last or time.monotonic() > deadline:
+            return int(rows), int(wal)
+        last = rows
+        time.sleep(STATS_SETTLE)
+
+
+def load_conditions(path):
+    """ Emulator conditions of the JSON file, none without the file
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def start_product(workers, max_listings=None, scenario=None):
+    """ (Re)start the product with the number of worker processes, allow shops of max_listings listings
+
+    :param scenario: tag of the run (QA_CURRENT_TEST) - name of the CPU profiles with QA_PROFILE_DIR set
+    """
+    os.environ['QA_WORKER_PROCESSES'] = str(workers)
+    if scenario:
+        os.environ['QA_CURRENT_TEST'] = scenario
+    if max_listings:
+        os.environ['QA_ETSY_MAX_LISTINGS_IN_SHOP'] = str(max_listings)
+    cmd = os.path.join(BIN_DIR, 'default', 'restart-product')
+    for _ in range(10):
+        if call([cmd]) == 0:
+            time.sleep(2)
+            return
+    raise Exception("Error: Nodes restart failed (" + cmd + ")")
+
+
+def wait_for_sync(hive_db, shop_id, last_sync_time, products, timeout):
+    """ Wait until the shop is synced after last_sync_time, up_to_date and with all products
+
+    :return: seconds waited
+    """
+    start = time.monotonic()
+    while True:
+        sync_time, status = hive_db.get_shop_info(shop_id, [ShopInfoCols.LAST_SYNC_TIMESTAMP, ShopInfoCols.SYNC_STATUS])
+        if (sync_time != last_sync_time and status == ShopSyncStatus.UP_TO_DATE.value and
+                hive_db.get_number_of_products(shop_id) == products):
+            return time.monotonic() - start
+        if time.monotonic() - start > timeout:
+            raise Exception('Shop %d not synced in %d s (status %s, %d of %d products)' % (
+                shop_id, timeout, status, hive_db.get_number_of_products(shop_id), products))
+        time.sleep(POLL_INTERVAL)
+
+
+def run_sync(conn, hive_db, company_id, shop_id, size, timeout, conditions):
+    """ Trigger syncShop and wait for it, return the measurements
+    """
+    emulator = EtsyEmulatorInterface()
+    last_sync_time = hive_db.get_shop_last_sync_time(shop_id)
+    rows, wal = database_writes(conn)
+    emulator.set_conditions(conditions)
+    vela.trigger_etsy_shop_sync(company_id, shop_id)
+    seconds = wait_for_sync(hive_db, shop_id, last_sync_time, size, timeout)
+    stats = emulator.get_conditions()['stats']
+    rows_after, wal_after = database_writes(conn)
+    return {'seconds': seconds, 'listings_per_s': size / seconds, 'rows': rows_after - rows,
+            'rows_per_s': (rows_after - rows) / seconds, 'wal_mb': (wal_after - wal) / 1024 / 1024,
+            'requests': stats['requests'], 'rate_limited': stats['rate_limited'], 'errors': stats['errors']}
+
+
+def benchmark(size, workers, resyncs, company_id, shop_id, timeout, conditions):
+    """ Import and re-syncs of a shop of size listings with the number of worker processes
+    """
+    product = BaseTestClass()
+    product.stop_all()
+    setup_rabbit()
+    load_sql('HIVE', EMPTY_SHOP_SQL, retry=2)
+    product.set_etsy_testcase(SCENARIO % size)
+    start_product(workers, size, 'sync_benchmark %s workers=%d' % (SCENARIO % size, workers))
+
+    set_pg_environment('HIVE')
+    conn = psycopg2.connect('')
+    conn.autocommit = True
+    hive_db = HiveDatabase(HIVE_DATABASE_URL)
+    try:
+        results = [dict(phase='import', **run_sync(conn, hive_db, company_id, shop_id, size, timeout, conditions))]
+        for i in range(resyncs):
+            results.append(dict(phase='re-sync', **run_sync(conn, hive_db, company_id, shop_id, size, timeout,
+                                                            conditions)))
+    finally:
+        conn.close()
+    for result in results:
+        result.update(listings=size, workers=workers)
+    return results
+
+
+def print_result(result, out):
+    out.write('%8d %7d %-8s %9.1f %11.1f %10d %9.1f %8.1f %9d %6d %6d\n' % (
+        result['listings'], result['workers'], result['phase'], result['seconds'], result['listings_per_s'],
+        result['rows'], result['rows_per_s'], result['wal_mb'], result['requests'], result['rate_limited'],
+        result['errors']))
+    out.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shop sync throughput by shop size and worker processes")
+    parser.add_argument("--sizes", default=SIZES, help="comma separated listings per shop (perf_sync_<size> scenarios)")
+    parser.add_argument("--workers", default=WORKERS, help="comma separated numbers of worker processes")
+    parser.add_argument("--resyncs", type=int, default=RESYNCS, help="re-syncs after the import")
+    parser.add_argument("--company-id", type=int, default=COMPANY_ID, help="company of the shop (listings_empty)")
+    parser.add_argument("--shop-id", type=int, default=SHOP_ID, help="shop to sync (listings_empty)")
+    parser.add_argument("--timeout", type=float, help="seconds of one sync before failing (default: by the size)")
+    parser.add_argument("--conditions", help="JSON file of the emulator conditions (etsy-emulator/lib/conditions.js)")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        workers = [int(n) for n in args.workers.split(',')]
+    except ValueError:
+        parser.error('--sizes and --workers are comma separated numbers')
+
+    conditions = load_conditions(args.conditions)
+    results = []
+    sys.stdout.write('%8s %7s %-8s %9s %11s %10s %9s %8s %9s %6s %6s\n' % (
+        'listings', 'workers', 'phase', 'seconds', 'listings/s', 'rows', 'rows/s', 'WAL MB', 'requests', '429s',
+        'errors'))
+    for size in sizes:
+        timeout = args.timeout or max(MIN_TIMEOUT, size / LISTINGS_PER_SECOND_TIMEOUT)
+        for n in workers:
+            for result in benchmark(size, n, args.resyncs, args.company_id, args.shop_id, timeout, conditions):
+                print_result(result, sys.stdout)
+                results.append(result)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
@@ -0,0 +1,75 @@
+import csv
+import io
+import random
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from analyze_jtl import JTL_FIELDS, LAST_LABEL, Analyzer
+
+# Parity of analyze_jtl.py --journeys with the former sum_calls.pl (kept as the reference in data/)
+#
+# Usage:
+#    cd QA/perf && python3 -m pytest -q test_analyze_jtl.py
+
+SUM_CALLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sum_calls.pl')
+LABELS = ['01 /', '05 /api/v1/shops', '12 /api/v1/shops/1/products', LAST_LABEL]
+
+
+def generate_jtl(threads=20, loops=5, seed=1):
+    """ JTL CSV of interleaved thread journeys, some failed samples, unfinished journeys at the end,
+    every third thread starts with a last label sample (its journey starts there)
+    """
+    rng = random.Random(seed)
+    pending = {'Thread Group 1-%d' % n: ([LAST_LABEL] if n % 3 == 1 else []) +
+               [label for _ in range(loops) for label in LABELS][:-rng.randint(0, 2) or None]
+               for n in range(1, threads + 1)}
+    timestamp = 1461837772337
+    out = io.StringIO()
+    out.write(','.join(JTL_FIELDS) + '\n')
+    while pending:
+        thread = rng.choice(sorted(pending))
+        label = pending[thread].pop(0)
+        if not pending[thread]:
+            del pending[thread]
+        success = rng.random() > 0.05
+        timestamp += rng.randint(0, 3000)
+        out.write('%d,%d,%s,%s,%s,%s,%d,%d,%d,%d,1,%d,%d\n' % (
+            timestamp, rng.randint(1, 5000), label, 200 if success else 500, thread, 'true' if success else 'false',
+            rng.randint(100, 100000), threads, threads, rng.randint(1, 1000), 0 if success else 1, rng.randint(0, 50)))
+    return out.getvalue()
+
+
+def journeys_of_analyzer(jtl):
+    out = io.StringIO()
+    analyzer = Analyzer(journeys=csv.writer(out, lineterminator='\n'))
+    analyzer.add_jtl(io.StringIO(jtl))
+    return out.getvalue(), analyzer
+
+
+@pytest.mark.skipif(shutil.which('perl') is None, reason='perl is not installed')
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_journeys_match_sum_calls(seed):
+    jtl = generate_jtl(seed=seed)
+    expected = subprocess.run(['perl', SUM_CALLS], input=jtl.encode(), stdout=subprocess.PIPE, check=True).stdout
+    journeys, _ = journeys_of_analyzer(jtl)
+    assert journeys == expected.decode()
+
+
+def test_journey_histogram():
+    jtl = generate_jtl(threads=3, loops=2)
+    journeys, analyzer = journeys_of_analyzer(jtl)
+    rows = list(csv.DictReader(io.StringIO(journeys)))
+    assert analyzer.journey.histogram.count == len(rows)
+    assert sum(int(row['bytes']) for row in rows) == analyzer.journey.bytes
+    # a journey ends with every last label sample but the first sample of a thread (it opens the journey),
+    # the threads cut short stay open
+    samples = [line.split(',') for line in jtl.splitlines()[1:]]
+    first = {}
+    for fields in samples:
+        first.setdefault(fields[4], fields[2])
+    assert len(rows) == (sum(fields[2] == LAST_LABEL for fields in samples) -
+                         sum(label == LAST_LABEL for label in first.values()))
+    assert analyzer._open
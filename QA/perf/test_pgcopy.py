@@ -0,0 +1,87 @@
+import decimal
+import random
+import struct
+
+import pytest
+
+from pgcopy import BINARY_ENCODERS, PGCOPY_HEADER, PGCOPY_TRAILER, TEXT_ENCODERS, encode_rows
+
+# Unit tests of the COPY encoders, no database needed
+#
+# Usage:
+#    cd QA/perf && python3 -m pytest -q test_pgcopy.py
+
+
+def numeric_fields(data):
+    """ (ndigits, weight, sign, dscale, digits) of a binary numeric field
+    """
+    length, ndigits, weight, sign, dscale = struct.unpack('!ihhHH', data[:12])
+    assert length == len(data) - 4
+    return ndigits, weight, sign, dscale, list(struct.unpack('!%dH' % ndigits, data[12:]))
+
+
+def decode_numeric(data):
+    ndigits, weight, sign, dscale, digits = numeric_fields(data)
+    value = sum(decimal.Decimal(digit) * decimal.Decimal(10000) ** (weight - i) for i, digit in enumerate(digits))
+    return -value if sign == 0x4000 else value, dscale
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0', (0, 0, 0, 0, [])),
+    ('12345.678', (3, 1, 0, 3, [1, 2345, 6780])),
+    ('-0.5', (1, -1, 0x4000, 1, [5000])),
+    ('10000', (1, 1, 0, 0, [1])),
+    ('0.0001', (1, -1, 0, 4, [1])),
+    ('100000', (1, 1, 0, 0, [10])),
+    ('19.99', (2, 0, 0, 2, [19, 9900])),
+])
+def test_binary_numeric(value, expected):
+    assert numeric_fields(BINARY_ENCODERS['numeric'](decimal.Decimal(value))) == expected
+
+
+def test_binary_numeric_round_trip():
+    rng = random.Random(1)
+    for _ in range(2000):
+        value = decimal.Decimal(rng.randint(-10 ** 12, 10 ** 12)).scaleb(-rng.randint(0, 8))
+        assert decode_numeric(BINARY_ENCODERS['numeric'](value)) == (value, max(-value.as_tuple().exponent, 0))
+
+
+def test_binary_jsonb():
+    assert BINARY_ENCODERS['jsonb']({'a': [1, None]}) == struct.pack('!i', 17) + b'\x01{"a": [1, null]}'
+
+
+def test_binary_int8_array():
+    data = BINARY_ENCODERS['int8[]']([1, -2])
+    header = struct.pack('!iiiii', 1, 0, 20, 2, 1)
+    elements = struct.pack('!iq', 8, 1) + struct.pack('!iq', 8, -2)
+    assert data == struct.pack('!i', len(header + elements)) + header + elements
+
+
+def test_binary_text_array():
+    data = BINARY_ENCODERS['text[]'](['a', 'žluť'])
+    header = struct.pack('!iiiii', 1, 0, 25, 2, 1)
+    elements = struct.pack('!i', 1) + b'a' + struct.pack('!i', 6) + 'žluť'.encode()
+    assert data == struct.pack('!i', len(header + elements)) + header + elements
+
+
+def test_binary_empty_array():
+    assert BINARY_ENCODERS['int8[]']([]) == struct.pack('!iiii', 12, 0, 0, 20)
+
+
+def test_text_array_quoting():
+    assert TEXT_ENCODERS['text[]'](['a', '', 'NULL', 'b c', 'x"y', 'back\\slash', '{}']) == \
+        b'{a,"","NULL","b c","x\\\\"y","back\\\\\\\\slash","{}"}'
+
+
+def test_text_escapes():
+    assert TEXT_ENCODERS['text']('a\tb\nc\\d\re') == b'a\\tb\\nc\\\\d\\re'
+    assert TEXT_ENCODERS['jsonb']({'k': 'a\\b'}) == b'{"k": "a\\\\\\\\b"}'
+
+
+def test_encode_rows():
+    types = ['int4', 'text', 'bool']
+    assert list(encode_rows(types, [[(1, 'a', True), (2, None, False)]])) == [b'1\ta\tt\n2\t\\N\tf\n']
+    chunks = list(encode_rows(types, [[(1, None, True)]], binary=True))
+    assert chunks[0] == PGCOPY_HEADER and chunks[-1] == PGCOPY_TRAILER
+    assert chunks[1] == (struct.pack('!h', 3) + struct.pack('!ii', 4, 1) + struct.pack('!i', -1) +
+                         b'\x00\x00\x00\x01\x01')
@@ -4,7 +4,7 @@ from modules.rabbit import setup_rabbit
 from pages.bulk_page import BulkPage
 from pages.login_page import LoginPage
 from pages.main_page import MainPage
-from tests.base import run_sql
+from tests.base import load_sql, run_sql
 from modules.selenium_tools import click
 from tests.s3_support import S3Interface
 
@@ -27,7 +27,8 @@ def test_id(request):
 @pytest.fixture()
 def reload(request):
     """
-    stop servers, init etsy emulator, load `self.sql_file` to the db, start servers
+    stop servers, init etsy emulator, load `self.sql_file` to the db (cloned from a snapshot after the first load), start servers
+    set `self.sql_bulk` for big sql files - indexes are rebuilt after the load instead of maintained during it
     """
     self = request.node.parent.obj
     self.stop_all()
@@ -36,7 +37,11 @@ def reload(request):
     except AttributeError:
         etsy_testcase = 'tc1'
     self.set_etsy_testcase(etsy_testcase)
-    run_sql('HIVE', self.sql_file, retry=2)
+    try:
+        sql_bulk = self.sql_bulk
+    except AttributeError:
+        sql_bulk = False
+    load_sql('HIVE', self.sql_file, retry=2, bulk=sql_bulk)
     run_sql('HIVE', 'update_shops_timestamp', retry=2)
     self.restart_all()
     self.driver.get(self.base_url)
@@ -280,21 +280,31 @@ kill_process() {
 #--------------------------------------------------------------------------------
 # (Re)start process $cmd $param in $workdir,
 # redirect output to $log_file (if defined)
+# with QA_PROFILE_DIR set, product processes (.../dist/<service>/server.js) are profiled by
+# lib/profile-node.js into $QA_PROFILE_DIR/current (collected by modules/profiles.py)
 restart_process() {
 	[ $# -ge 4 ] || die "Error: restart_process: at least 4 params expected, got ($@)"
-	local cmd=$1 work_dir=$2 log_file=$3 pid params
+	local cmd=$1 work_dir=$2 log_file=$3 pid params name profile_env=()
 	shift 3
 	params=("$@")
 
 	kill_process "$cmd" "${params[@]}"
 
+	if [ -n "$QA_PROFILE_DIR" ] && [[ "${params[0]}" =~ /dist/([a-z]+)/server\.js$ ]]; then
+		name=${BASH_REMATCH[1]}
+		[ ${#params[@]} -lt 2 ] || name="$name-${params[1]##*=}"
+		mkdir -p "$QA_PROFILE_DIR/current"
+		profile_env=(NODE_OPTIONS="${NODE_OPTIONS:+$NODE_OPTIONS }--require $script_dir/../lib/profile-node.js"
+			QA_PROFILE_OUT="$QA_PROFILE_DIR/current" QA_PROFILE_NAME="$name")
+	fi
+
 	cd "$work_dir"
 	log1 "Starting $cmd '${params[@]}'"
 	if [ -n "$log_file" ]; then
 		mkdir -p "`dirname "$log_file"`"
-		"$cmd" "${params[@]}" >>"$log_file" 2>&1 &
+		env "${profile_env[@]}" "$cmd" "${params[@]}" >>"$log_file" 2>&1 &
 	else
-		"$cmd" "${params[@]}" &
+		env "${profile_env[@]}" "$cmd" "${params[@]}" &
 	fi
 	pid=$!
 	sleep 2
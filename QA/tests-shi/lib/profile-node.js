@@ -0,0 +1,52 @@
+/*
+Profile a product process - preloaded by restart_process (lib/functions.sh) when QA_PROFILE_DIR is set:
+     NODE_OPTIONS="--require .../profile-node.js" QA_PROFILE_OUT=<dir> QA_PROFILE_NAME=<service> node server.js
+
+  Samples the CPU and the heap allocations from the start, on exit writes
+     <QA_PROFILE_OUT>/<QA_CURRENT_TEST>/<QA_PROFILE_NAME>-<pid>.cpuprofile   (Chrome DevTools, speedscope)
+     <QA_PROFILE_OUT>/<QA_CURRENT_TEST>/<QA_PROFILE_NAME>-<pid>.heapprofile
+  so the profile is tagged by the test or perf scenario the process was started for.
+  SIGTERM / SIGINT exit the process unless it handles them itself (worker).
+*/
+
+var fs = require('fs');
+var inspector = require('inspector');
+
+  // sampling interval of the CPU profiler in microseconds
+var CPU_INTERVAL = parseInt(process.env.QA_PROFILE_CPU_INTERVAL || '1000', 10);
+
+var tag = (process.env.QA_CURRENT_TEST || 'untagged').replace(/[^\w.-]+/g, '_');
+var dir = process.env.QA_PROFILE_OUT + '/' + tag;
+var prefix = dir + '/' + (process.env.QA_PROFILE_NAME || 'node') + '-' + process.pid;
+
+var session = new inspector.Session();
+session.connect();
+session.post('Profiler.enable');
+session.post('Profiler.setSamplingInterval', { interval: CPU_INTERVAL });
+session.post('Profiler.start');
+session.post('HeapProfiler.enable');
+session.post('HeapProfiler.startSampling');
+
+
+//--------------------------------------------------------------------------------
+// write the profiles - the in-process inspector session answers synchronously
+function writeProfiles() {
+  try { fs.mkdirSync(dir); } catch (err) { if (err.code !== 'EEXIST') { throw err; } }
+  session.post('Profiler.stop', function(err, result) {
+    if (!err) { fs.writeFileSync(prefix + '.cpuprofile', JSON.stringify(result.profile)); }
+  });
+  session.post('HeapProfiler.stopSampling', function(err, result) {
+    if (!err) { fs.writeFileSync(prefix + '.heapprofile', JSON.stringify(result.profile)); }
+  });
+  session.disconnect();
+}
+
+
+process.on('exit', writeProfiles);
+['SIGTERM', 'SIGINT'].forEach(function(signal) {
+  process.on(signal, function() {
+    if (process.listenerCount(signal) === 1) {
+      process.exit(0);
+    }
+  });
+});
@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+import re
+import tempfile
+
+import psycopg2
+
+# Bulk load of big datasets (perf data, large sql fixtures) without maintaining indexes row by row.
+# deferred_indexes() records index and foreign key definitions of the tables and drops them,
+# the caller loads the data, then indexes are rebuilt by parallel connections with bigger
+# maintenance_work_mem, constraints are restored and the tables analyzed.
+#
+# Usage:
+#    from modules.bulkload import deferred_indexes
+#
+#    with deferred_indexes(dsn, ['product_properties', 'product_offerings']):
+#        ... COPY the data ...
+#
+# Indexes are restored also when the load fails. The definitions are saved to a state file of the
+# database before they are dropped, if the process is killed during the load the next deferred_indexes()
+# (or restore_interrupted()) on the database restores them first.
+
+BUILD_JOBS = 4
+MAINTENANCE_WORK_MEM = '1GB'
+    # deferred_indexes-<host>-<port>-<database>.json, definitions dropped and not restored yet
+STATE_DIR = tempfile.gettempdir()
+
+TABLES_SQL = """
+SELECT c.oid::regclass::text FROM pg_class c
+WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+"""
+    # foreign keys of the tables and foreign keys referencing them - unique indexes cannot be dropped under them
+FOREIGN_KEYS_SQL = """
+SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE contype = 'f' AND (conrelid = ANY(%(tables)s::regclass[]) OR confrelid = ANY(%(tables)s::regclass[]))
+ORDER BY 1, 2
+"""
+    # exclusion constraints are left alone, their indexes cannot be attached by ADD CONSTRAINT ... USING INDEX
+INDEXES_SQL = """
+SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid),
+       c.conname, c.contype, c.condeferrable, c.condeferred
+FROM pg_index i
+LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid AND c.conrelid = i.indrelid AND c.contype IN ('p', 'u', 'x')
+WHERE i.indrelid = ANY(%(tables)s::regclass[]) AND c.contype IS DISTINCT FROM 'x'
+ORDER BY pg_relation_size(i.indrelid) DESC, 2
+"""
+
+
+def _constraint_using_index(index):
+    """ ALTER TABLE statement attaching rebuilt index back as its primary key / unique constraint
+    """
+    table, index_name, _, constraint, contype, deferrable, deferred = index
+    sql = 'ALTER TABLE ' + table + ' ADD CONSTRAINT ' + constraint + \
+        (' PRIMARY KEY' if contype == 'p' else ' UNIQUE') + ' USING INDEX ' + index_name
+    if deferrable:
+        sql += ' DEFERRABLE INITIALLY DEFERRED' if deferred else ' DEFERRABLE'
+    return sql
+
+
+    # indexes and constraints of the tables which exist - a restore interrupted midway built some of them
+EXISTING_SQL = """
+SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = ANY(%(tables)s::regclass[])
+UNION ALL
+SELECT conrelid::regclass::text || ' ' || conname FROM pg_constraint WHERE conrelid = ANY(%(tables)s::regclass[])
+"""
+
+
+def state_file(conn):
+    """ File of the definitions dropped from the database of the connection
+    """
+    params = conn.get_dsn_parameters()
+    name = '-'.join([params.get('host', 'local'), params.get('port', ''), params['dbname']])
+    return os.path.join(STATE_DIR, 'deferred_indexes-' + re.sub(r'[^\w.-]+', '_', name) + '.json')
+
+
+def _build_index(dsn, definition, maintenance_work_mem):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute('SET maintenance_work_mem = %s', [maintenance_work_mem])
+        cur.execute(definition)
+    finally:
+        conn.close()
+
+
+def drop_indexes(conn, tables=None):
+    """ Drop indexes and foreign keys of the tables, return their definitions for restore_indexes()
+
+    :param conn: psycopg2 connection, committed on success
+    :param tables: table names, all tables of the current schema if None
+    """
+    cur = conn.cursor()
+    if tables is None:
+        cur.execute(TABLES_SQL)
+        tables = [row[0] for row in cur.fetchall()]
+    cur.execute(FOREIGN_KEYS_SQL, {'tables': list(tables)})
+    foreign_keys = cur.fetchall()
+    cur.execute(INDEXES_SQL, {'tables': list(tables)})
+    indexes = cur.fetchall()
+
+    definitions = {'tables': tables, 'foreign_keys': foreign_keys, 'indexes': indexes}
+    with open(state_file(conn), 'w') as f:
+        json.dump(definitions, f)
+
+    for table, constraint, _ in foreign_keys:
+        cur.execute('ALTER TABLE ' + table + ' DROP CONSTRAINT ' + constraint)
+    for table, index_name, _, constraint, _, _, _ in indexes:
+        if constraint:
+            cur.execute('ALTER TABLE ' + table + ' DROP CONSTRAINT ' + constraint)
+        else:
+            cur.execute('DROP INDEX ' + index_name)
+    conn.commit()
+    return definitions
+
+
+def restore_indexes(conn, dsn, definitions, jobs=BUILD_JOBS, maintenance_work_mem=MAINTENANCE_WORK_MEM):
+    """ Rebuild indexes in parallel (own connection each), restore constraints and ANALYZE the tables,
+    remove the state file - indexes and constraints which exist already are skipped
+
+    :param conn: psycopg2 connection for the constraints, committed on success
+    :param dsn: connection string for the index builds
+    :param definitions: return value of drop_indexes()
+    """
+    cur = conn.cursor()
+    cur.execute(EXISTING_SQL, {'tables': list(definitions['tables'])})
+    existing = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_build_index, dsn, definition, maintenance_work_mem)
+                   for _, index_name, definition, _, _, _, _ in definitions['indexes'] if index_name not in existing]
+        for future in futures:
+            future.result()
+
+    cur.execute('SET maintenance_work_mem = %s', [maintenance_work_mem])
+    for index in definitions['indexes']:
+        if index[3] and index[0] + ' ' + index[3] not in existing:
+            cur.execute(_constraint_using_index(index))
+    for table, constraint, definition in definitions['foreign_keys']:
+        if table + ' ' + constraint not in existing:
+            cur.execute('ALTER TABLE ' + table + ' ADD CONSTRAINT ' + constraint + ' ' + definition)
+    conn.commit()
+
+    conn.autocommit = True
+    for table in definitions['tables']:
+        cur.execute('ANALYZE ' + table)
+    conn.autocommit = False
+    os.remove(state_file(conn))
+
+
+def restore_interrupted(conn, dsn, jobs=BUILD_JOBS, maintenance_work_mem=MAINTENANCE_WORK_MEM):
+    """ Restore the definitions left in the state file of the database by a killed load
+
+    :return: True if there was an interrupted load
+    """
+    try:
+        with open(state_file(conn)) as f:
+            definitions = json.load(f)
+    except FileNotFoundError:
+        return False
+    print('Restoring indexes and foreign keys of an interrupted bulk load (' + state_file(conn) + ')')
+    restore_indexes(conn, dsn, definitions, jobs, maintenance_work_mem)
+    return True
+
+
+@contextmanager
+def deferred_indexes(dsn, tables=None, jobs=BUILD_JOBS, maintenance_work_mem=MAINTENANCE_WORK_MEM):
+    """ Drop indexes and foreign keys of the tables for the body of the with statement, restore them after
+
+    :param dsn: connection string, '' takes connection from PG* environment variables
+    :param tables: table names, all tables of the current schema if None
+    :param jobs: number of indexes built at the same time
+    :param maintenance_work_mem: maintenance_work_mem of the index builds
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        restore_interrupted(conn, dsn, jobs, maintenance_work_mem)
+        definitions = drop_indexes(conn, tables)
+        try:
+            yield definitions
+        finally:
+            restore_indexes(conn, dsn, definitions, jobs, maintenance_work_mem)
+    finally:
+        conn.close()
@@ -6,6 +6,7 @@ from typing import List
 class ShopInfoCols(Enum):
     LAST_SYNC_TIMESTAMP = 'last_sync_timestamp'
     SYNC_STATUS = 'sync_status'
+    APPLYING_OPERATIONS = 'applying_operations'
 
 
 class ShopSyncStatus(Enum):
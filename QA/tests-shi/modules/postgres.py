@@ -1,8 +1,13 @@
 import psycopg2
-import os
+import psycopg2.extensions
+import threading
+import time
 
 # Connect to the database ($DATABASE_URL) and run SQL queries
-# get_db() singleton returns existing session
+# get_db() returns the shared session of the connection string. Sessions of different databases (hive,
+# hive_auth) live side by side, every session runs its queries on a bounded, thread safe pool of
+# connections - concurrent health checks and parallel test workers share the connections.
+# pool_stats() shows checkouts, waits for a free connection and reconnects of broken connections.
 #
 # Usage:
 #    from db.postgres import Postgres
@@ -11,39 +16,166 @@ import os
 #    rows = db.select('SELECT email FROM users WHERE name_first = %s', ['Jeff'])
 #    db.run('UPDATE users SET name_first = %s WHERE email = %s', ['Jefferson', 'jbrown@example.com']);
 
+    # connections per connection string
+MAX_POOL_SIZE = 4
+    # seconds to wait for a free connection
+CHECKOUT_TIMEOUT = 60
+    # connections idle longer are pinged on checkout (closed ones are always replaced)
+PING_AFTER = 10
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """ Bounded, thread safe pool of connections to one database
+    """
+
+    def __init__(self, connection_string, max_size=MAX_POOL_SIZE):
+        self.connection_string = connection_string
+        self.max_size = max_size
+        self.idle = []  # (connection, time it was returned)
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.stats = {'connects': 0, 'checkouts': 0, 'waits': 0, 'reconnects': 0}
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - idle_since < PING_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        """ Idle connection of the pool (health checked) or a new one while the pool is not full, else wait
+        """
+        with self.condition:
+            self.stats['checkouts'] += 1
+            if not self.idle and self.size >= self.max_size:
+                self.stats['waits'] += 1
+                if not self.condition.wait_for(lambda: self.idle or self.size < self.max_size, timeout):
+                    raise PoolTimeoutError('No free connection in %d s (pool of %d)' % (timeout, self.max_size))
+            if self.idle:
+                conn, idle_since = self.idle.pop()
+            else:
+                conn = None
+                self.size += 1
+
+        if conn is not None and not self._healthy(conn, idle_since):
+            conn.close()
+            conn = None
+            with self.condition:
+                self.stats['reconnects'] += 1
+        if conn is None:
+            try:
+                conn = psycopg2.connect(self.connection_string)
+            except Exception:
+                self._discard()
+                raise
+            with self.condition:
+                self.stats['connects'] += 1
+        return conn
+
+    def checkin(self, conn):
+        """ Return the connection, a broken one (or any after close()) is closed and frees its place
+        """
+        if self.closed or conn.closed:
+            conn.close()
+            self._discard()
+            return
+        with self.condition:
+            self.idle.append((conn, time.monotonic()))
+            self.condition.notify()
+
+    def _discard(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        """ Close the idle connections, the checked out ones are closed when returned
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, size=self.size, idle=len(self.idle), max_size=self.max_size)
+
 
 class Postgres():
-    _session = None
-    _connection_string = None
+    _sessions = {}
+    _lock = threading.Lock()
 
     @staticmethod
     def get_db(connection_string):
-        if connection_string == Postgres._connection_string:
-            return Postgres._session
-        if Postgres._session is not None:
-            Postgres._session.close()
+        with Postgres._lock:
+            session = Postgres._sessions.get(connection_string)
+            if session is None:
+                session = Postgres._sessions[connection_string] = Postgres(connection_string)
+            return session
 
-        Postgres._connection_string = connection_string
-        Postgres._session = Postgres(connection_string)
-        return Postgres._session
+    @staticmethod
+    def close_db():
+        """ Close the sessions of get_db(), eg. before their database is dropped and recreated
+        """
+        with Postgres._lock:
+            sessions, Postgres._sessions = Postgres._sessions, {}
+        for session in sessions.values():
+            session.close()
 
-    def __init__(self, connection_string):
-        self.connection = psycopg2.connect(connection_string)
+    @staticmethod
+    def pool_stats():
+        """ {database: connects, checkouts, waits, reconnects, size, idle, max_size} of the get_db() sessions
+        """
+        with Postgres._lock:
+            sessions = list(Postgres._sessions.items())
+        stats = {}
+        for connection_string, session in sessions:
+            dsn = psycopg2.extensions.parse_dsn(connection_string)
+            stats['%s@%s' % (dsn.get('dbname'), dsn.get('host', 'localhost'))] = session.pool.get_stats()
+        return stats
+
+    def __init__(self, connection_string, max_size=MAX_POOL_SIZE):
+        self.pool = ConnectionPool(connection_string, max_size)
 
     def close(self):
-        self.connection.close()
+        self.pool.close()
+
+    def _execute(self, sql, params, fetch):
+        conn = self.pool.checkout()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            result = cur.fetchall() if fetch else None
+            conn.commit()
+            cur.close()
+            return result
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                # broken connection, checkin() drops it
+                conn.close()
+            raise
+        finally:
+            self.pool.checkin(conn)
 
     def select(self, sql, params=None):
-        cur = self.connection.cursor()
-        cur.execute(sql, params)
-        self.connection.commit()
-        result = cur.fetchall()
-        cur.close()
-        return result
+        return self._execute(sql, params, True)
 
     def run(self, sql, params=None):
-        cur = self.connection.cursor()
-        cur.execute(sql, params)
-        self.connection.commit()
-        cur.close()
-
+        self._execute(sql, params, False)
@@ -0,0 +1,100 @@
+import argparse
+import collections
+import json
+import os
+import shutil
+import time
+
+# CPU and heap profiles of the product processes
+# With QA_PROFILE_DIR set, restart_process (lib/functions.sh) starts the product services with
+# lib/profile-node.js preloaded, they write on exit
+#    $QA_PROFILE_DIR/current/<QA_CURRENT_TEST>/<service>-<pid>.cpuprofile / .heapprofile
+# (the test or perf scenario the processes were started for). collect_profiles() - called by
+# BaseTestClass.stop_all and restart_all - moves them to $QA_PROFILE_DIR/<time>-<tag>, writes there
+# summary.txt with the top self time functions of every service and prints it into the test output.
+# The .cpuprofile files open in Chrome DevTools (Performance) or https://www.speedscope.app
+#
+# Usage:
+#    QA_PROFILE_DIR=$QA_LOG_DIR/profiles bin/run-tests ...
+#    python3 modules/profiles.py $QA_LOG_DIR/profiles/20180215-101010-test_sync.py_test_sync_base
+
+PROFILE_DIR = os.environ.get('QA_PROFILE_DIR')
+CURRENT = 'current'
+SUMMARY_FILE = 'summary.txt'
+CPU_PROFILE = '.cpuprofile'
+TOP = 15
+    # samples not spent in JavaScript functions of the process
+IDLE_FUNCTIONS = ['(idle)', '(root)']
+
+
+def cpu_self_times(path):
+    """ {(function, location): self time in microseconds} of the .cpuprofile file, total sampled time
+    """
+    with open(path) as f:
+        profile = json.load(f)
+    frames = {node['id']: node['callFrame'] for node in profile['nodes']}
+    by_node = collections.Counter()
+    # timeDeltas[i] is the time from the previous sample to samples[i]
+    for node_id, delta in zip(profile['samples'], profile['timeDeltas']):
+        by_node[node_id] += delta
+    self_times = collections.Counter()
+    for node_id, micros in by_node.items():
+        frame = frames[node_id]
+        function = frame['functionName'] or '(anonymous)'
+        if function in IDLE_FUNCTIONS:
+            continue
+        location = '%s:%d' % (frame['url'] or '?', frame['lineNumber'] + 1) if frame['url'] else ''
+        self_times[function, location] += micros
+    return self_times, profile['endTime'] - profile['startTime']
+
+
+def summarize(profile_dir, top=TOP):
+    """ Text table of the top self time functions of every service (all its processes) in the directory
+    """
+    services = collections.defaultdict(lambda: [collections.Counter(), 0])
+    for name in sorted(os.listdir(profile_dir)):
+        if name.endswith(CPU_PROFILE):
+            service = name.rsplit('-', 1)[0]
+            self_times, duration = cpu_self_times(os.path.join(profile_dir, name))
+            services[service][0].update(self_times)
+            services[service][1] += duration
+    lines = []
+    for service, (self_times, duration) in sorted(services.items()):
+        busy = sum(self_times.values())
+        lines.append('%s: %.1f s CPU of %.1f s profiled' % (service, busy / 1e6, duration / 1e6))
+        for (function, location), micros in self_times.most_common(top):
+            lines.append('  %9.1f ms %5.1f%%  %s %s' % (micros / 1000, micros * 100 / busy if busy else 0,
+                                                        function, location))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def collect_profiles(profile_dir=PROFILE_DIR, top=TOP):
+    """ Move the profiles written by exited processes to <time>-<tag> directories and summarize them
+
+    :return: list of the new directories
+    """
+    current = os.path.join(profile_dir, CURRENT)
+    if not os.path.isdir(current):
+        return []
+    collected = []
+    for tag in sorted(os.listdir(current)):
+        target = base = os.path.join(profile_dir, time.strftime('%Y%m%d-%H%M%S-') + tag)
+        n = 1
+        while os.path.exists(target):
+            n += 1
+            target = '%s-%d' % (base, n)
+        shutil.move(os.path.join(current, tag), target)
+        summary = summarize(target, top)
+        with open(os.path.join(target, SUMMARY_FILE), 'w') as out:
+            out.write(summary)
+        print('*** CPU profile of %s (%s) ***\n%s' % (tag, target, summary))
+        collected.append(target)
+    return collected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Top self time functions of the collected CPU profiles")
+    parser.add_argument("profile_dir", help="directory of .cpuprofile files")
+    parser.add_argument("--top", type=int, default=TOP, help="functions per service")
+    args = parser.parse_args()
+    print(summarize(args.profile_dir, args.top), end='')
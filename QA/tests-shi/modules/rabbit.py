@@ -58,6 +58,27 @@ class Rabbit(object):
 
         self._disconnect()
 
+    def publish_all_to_queue(self, queue_name: str, bodies, on_publish=None):
+        """ Send messages to RabbitMQ queue over one connection
+
+        :param queue_name: Name of the queue to publish to
+        :param bodies: Message bodies
+        :param on_publish: Called with the body after each message is sent
+        """
+
+        self._connect()
+
+        try:
+            channel = self.connection.channel()
+            for body in bodies:
+                channel.basic_publish(exchange='',
+                                      routing_key=queue_name,
+                                      body=json.dumps(body))
+                if on_publish:
+                    on_publish(body)
+        finally:
+            self._disconnect()
+
     def publish_to_exchange(self, exchange_name: str, routing_key: str, body: dict):
         """ Send message to RabbitMQ queue
 
@@ -73,3 +94,25 @@ class Rabbit(object):
                               body=json.dumps(body))
 
         self._disconnect()
+
+    def queue_depths(self, queue_names):
+        """ Ready messages and consumers of the queues, by passive declares (no management plugin needed)
+
+        :param queue_names: Names of the queues, missing queues are left out
+        :return: {queue name: (messages, consumers)}
+        """
+        self._connect()
+        depths = {}
+        try:
+            for queue_name in queue_names:
+                channel = self.connection.channel()
+                try:
+                    result = channel.queue_declare(queue=queue_name, passive=True)
+                except pika.exceptions.ChannelClosed:
+                    # passive declare of a missing queue closes the channel
+                    continue
+                depths[queue_name] = (result.method.message_count, result.method.consumer_count)
+                channel.close()
+        finally:
+            self._disconnect()
+        return depths
@@ -0,0 +1,156 @@
+import functools
+import hashlib
+
+import psycopg2
+
+from modules.postgres import Postgres
+
+# Snapshot cache of databases loaded from sql files
+# The first load of a sql file into a database is saved as a template database named by the hash
+# of the file content, next loads of the same content clone the template (CREATE DATABASE ... TEMPLATE)
+# instead of replaying the file. The hash covers also the database schema - a changed file or migrated
+# schema gets a new hash, the old snapshot of the file is dropped.
+# A snapshot clones the whole database, also tables the file does not reset (TRUNCATE). The content of
+# those tables before the load is part of the hash, so state left there by earlier tests gets its own
+# snapshot instead of being baked into later loads (it costs a scan of the tables not reset by the file).
+#
+# Usage:
+#    from modules.snapshot import load_snapshot, save_snapshot, snapshot_key
+#
+#    key = snapshot_key('hive_db', 'sql/listings_03.sql', ['accounts', 'shops', ...])
+#    if snapshots_supported('hive_db') and not load_snapshot('hive_db', 'listings_03', key):
+#        ... load listings_03.sql into hive_db ...
+#        save_snapshot('hive_db', 'listings_03', key)
+#
+# Nothing may be connected to the database during load_snapshot() and save_snapshot() - stop servers first.
+# Connections are taken from PG* environment variables, the user needs the CREATEDB privilege and has to
+# own the database (or be a superuser) - snapshots_supported() checks it.
+
+MAINTENANCE_DB = 'postgres'
+SNAPSHOT_SUFFIX = '_snap_'
+HASH_LENGTH = 16
+    # PostgreSQL truncates longer identifiers
+MAX_NAME_LENGTH = 63
+    # tables, columns and indexes of the current schema
+SCHEMA_SQL = """
+SELECT coalesce(string_agg(def, E'\\n' ORDER BY def), '') FROM (
+    SELECT table_name || '.' || column_name || ' ' || data_type || ' ' || coalesce(column_default, '') AS def
+    FROM information_schema.columns WHERE table_schema = current_schema()
+    UNION ALL
+    SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema()
+) schema
+"""
+    # tables of the current schema except the ones the sql file resets
+OTHER_TABLES_SQL = """
+SELECT c.oid::regclass::text FROM pg_class c
+WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+  AND c.oid <> ALL(ARRAY(SELECT to_regclass(t) FROM unnest(%s::text[]) t WHERE to_regclass(t) IS NOT NULL))
+ORDER BY 1
+"""
+    # the user can clone (CREATEDB, owner of the source) and drop (owner) the database
+PRIVILEGES_SQL = """
+SELECT r.rolsuper OR (r.rolcreatedb AND d.datdba = r.oid)
+FROM pg_roles r, pg_database d WHERE r.rolname = current_user AND d.datname = %s
+"""
+
+
+@functools.lru_cache()
+def snapshots_supported(database):
+    """ Whether the PG* user can clone and drop the database
+    """
+    conn = psycopg2.connect(dbname=database)
+    try:
+        cur = conn.cursor()
+        cur.execute(PRIVILEGES_SQL, [database])
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    return bool(row and row[0])
+
+
+def snapshot_key(database, path, reset_tables=()):
+    """ Hash of the sql file content, of the database schema and of the content of the tables
+    the file does not reset, the snapshot cache key
+
+    Test data files only fill existing tables, a snapshot made before a schema migration must not be reused.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    conn = psycopg2.connect(dbname=database)
+    try:
+        cur = conn.cursor()
+        cur.execute(SCHEMA_SQL)
+        digest.update(cur.fetchone()[0].encode())
+        cur.execute(OTHER_TABLES_SQL, [list(reset_tables)])
+        for (table, ) in cur.fetchall():
+            cur.execute('SELECT count(*), coalesce(sum(hashtext(t::text)::bigint), 0) FROM ' + table + ' t')
+            digest.update(('%s %d %d\n' % ((table, ) + cur.fetchone())).encode())
+    finally:
+        conn.close()
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def snapshot_name(database, key):
+    suffix = SNAPSHOT_SUFFIX + key
+    return database[:MAX_NAME_LENGTH - len(suffix)] + suffix
+
+
+def _connect():
+    conn = psycopg2.connect(dbname=MAINTENANCE_DB)
+    conn.autocommit = True
+    return conn
+
+
+def _database_exists(cur, database):
+    cur.execute('SELECT 1 FROM pg_database WHERE datname = %s', [database])
+    return cur.fetchone() is not None
+
+
+def _disconnect(cur, database):
+    """ Terminate leftover sessions of the database (test's own db connections, psql killed by a timeout)
+    """
+    # Postgres.get_db() would keep returning the terminated session
+    Postgres.close_db()
+    cur.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()',
+                [database])
+
+
+def load_snapshot(database, script, key):
+    """ Replace the database by a clone of the snapshot of script with the key
+
+    :return: False if there is no such snapshot (the database is left untouched)
+    """
+    template = snapshot_name(database, key)
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        if not _database_exists(cur, template):
+            return False
+        _disconnect(cur, database)
+        cur.execute('DROP DATABASE IF EXISTS "' + database + '"')
+        cur.execute('CREATE DATABASE "' + database + '" TEMPLATE "' + template + '"')
+        return True
+    finally:
+        conn.close()
+
+
+def save_snapshot(database, script, key):
+    """ Save the database just loaded from script as its snapshot, drop older snapshots of the script
+    """
+    template = snapshot_name(database, key)
+    conn = _connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT datname FROM pg_database WHERE shobj_description(oid, 'pg_database') = %s",
+                    [database + ' ' + script])
+        for (old_template, ) in cur.fetchall():
+            cur.execute('DROP DATABASE IF EXISTS "' + old_template + '"')
+        _disconnect(cur, database)
+        cur.execute('DROP DATABASE IF EXISTS "' + template + '"')
+        cur.execute('CREATE DATABASE "' + template + '" TEMPLATE "' + database + '"')
+        # the comment identifies snapshots of the script for replacement when the file changes
+        cur.execute('COMMENT ON DATABASE "' + template + '" IS %s', [database + ' ' + script])
+    finally:
+        conn.close()
@@ -0,0 +1,152 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from modules import postgres
+from modules.postgres import PING_AFTER, ConnectionPool, PoolTimeoutError
+
+# Unit tests of the connection pool on fake connections, no database needed
+#
+# Usage:
+#    cd QA/tests-shi && python3 -m pytest -q modules/test_postgres.py
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.conn.executed.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.executed = []
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """ Connections made by the pool
+    """
+    made = []
+
+    def connect(connection_string):
+        made.append(FakeConnection())
+        return made[-1]
+
+    monkeypatch.setattr(postgres.psycopg2, 'connect', connect)
+    return made
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Settable time.monotonic() of the pool
+    """
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(postgres, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_checkin_reuses_connection(connections):
+    pool = ConnectionPool('dbname=test', 2)
+    conn = pool.checkout()
+    pool.checkin(conn)
+    assert pool.checkout() is conn
+    other = pool.checkout()
+    assert other is not conn
+    assert len(connections) == 2
+    assert pool.get_stats() == {'connects': 2, 'checkouts': 3, 'waits': 0, 'reconnects': 0, 'size': 2, 'idle': 0,
+                                'max_size': 2}
+
+
+def test_checkout_blocks_at_max_size(connections):
+    pool = ConnectionPool('dbname=test', 1)
+    conn = pool.checkout()
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout(timeout=0.05)
+
+    timer = threading.Timer(0.1, pool.checkin, [conn])
+    timer.start()
+    started = time.monotonic()
+    assert pool.checkout(timeout=5) is conn
+    assert time.monotonic() - started >= 0.05
+    timer.join()
+    assert len(connections) == 1
+    assert pool.get_stats()['waits'] == 2
+
+
+def test_idle_connection_pinged_after_ping_after(connections, clock):
+    pool = ConnectionPool('dbname=test', 1)
+    conn = pool.checkout()
+    pool.checkin(conn)
+    clock.value += PING_AFTER - 1
+    assert pool.checkout() is conn
+    assert conn.executed == []
+
+    pool.checkin(conn)
+    clock.value += PING_AFTER
+    assert pool.checkout() is conn
+    assert conn.executed == ['SELECT 1']
+
+    pool.checkin(conn)
+    clock.value += PING_AFTER
+    conn.broken = True
+    replaced = pool.checkout()
+    assert replaced is not conn and conn.closed
+    assert pool.get_stats()['reconnects'] == 1
+    assert pool.get_stats()['size'] == 1
+
+
+def test_closed_connections_discarded(connections):
+    pool = ConnectionPool('dbname=test', 1)
+    conn = pool.checkout()
+    conn.closed = 2
+    pool.checkin(conn)
+    assert pool.get_stats()['size'] == 0
+
+    idle = pool.checkout()
+    assert idle is not conn
+    pool.checkin(idle)
+    idle.closed = 2
+    replaced = pool.checkout()
+    assert replaced is not idle
+    assert len(connections) == 3
+    assert pool.get_stats()['reconnects'] == 1
+
+
+def test_close_closes_returned_connections(connections):
+    pool = ConnectionPool('dbname=test', 2)
+    idle = pool.checkout()
+    busy = pool.checkout()
+    pool.checkin(idle)
+    pool.close()
+    assert idle.closed and not busy.closed
+    pool.checkin(busy)
+    assert busy.closed
+    assert pool.get_stats()['size'] == 0
@@ -1,8 +1,9 @@
 # /usr/bin/env python
 import os
 import re
+from contextlib import ExitStack
 from enum import Enum
-from subprocess import call
+from subprocess import PIPE, Popen, call
 from tempfile import NamedTemporaryFile
 from time import sleep
 
@@ -14,12 +15,20 @@ from shishito.conf.conftest import get_test_info
 from shishito.runtime.shishito_support import ShishitoSupport
 from shishito.ui.selenium_support import SeleniumTest
 
+from modules.bulkload import deferred_indexes
+from modules.profiles import PROFILE_DIR, collect_profiles
 from modules.selenium_tools import click
+from modules.snapshot import load_snapshot, save_snapshot, snapshot_key, snapshots_supported
 from tests.etsy_emulator_support import EtsyEmulatorInterface, EtsyEmulatorRequestError
 
 DB_DIR = os.path.dirname(__file__) + '/../sql'
 BIN_DIR = os.path.dirname(__file__) + '/../bin'
 BACKSPACE_KEYS = Keys.BACKSPACE * 10
+# sql script file extensions tried by run_sql() and the command streaming the file to psql
+SQL_EXTENSIONS = [('.sql', None), ('.sql.gz', 'gzip -dc'), ('.sql.zst', 'zstd -dc')]
+COPY_RE = re.compile(rb'^COPY\s+([\w."]+)\s*\(')
+TRUNCATE_RE = re.compile(rb'^TRUNCATE\s+(?:TABLE\s+)?(?:ONLY\s+)?([\w.", ]+?)\s*(?:\b(?:CASCADE|RESTRICT|RESTART|CONTINUE)\b.*)?;',
+                         re.IGNORECASE)
 
 # we either build the connection string or read it whole from environment variable if not possible to build it
 try:
@@ -50,41 +59,121 @@ class InventorySupport(Enum):
     on = 1
 
 
-def run_sql(db_instance, script, return_result=False, retry=0):
-    "run psql <script.sql> on  db_instance (eg '00')"
+def sql_script_file(script):
+    """ Return (file name, decompress command or None) of <script>.sql, <script>.sql.gz or <script>.sql.zst
+    """
+    for extension, decompress in SQL_EXTENSIONS:
+        script_filename = os.path.join(DB_DIR, script + extension)
+        if os.path.isfile(script_filename):
+            return script_filename, decompress
+    return os.path.join(DB_DIR, script + '.sql'), None
+
+
+def script_tables(script_filename, decompress, statement_re):
+    """ Tables of the statements matching statement_re (group 1 = table name) in the sql script, in file order
+    """
+    if decompress:
+        process = Popen(decompress.split() + [script_filename], stdout=PIPE)
+        lines = process.stdout
+    else:
+        process = None
+        lines = open(script_filename, 'rb')
+    tables = []
+    try:
+        for line in lines:
+            m = statement_re.match(line)
+            if m:
+                for table in m.group(1).split(b','):
+                    table = table.strip().decode()
+                    if table not in tables:
+                        tables.append(table)
+    finally:
+        lines.close()
+        if process:
+            process.wait()
+    return tables
+
+
+def set_pg_environment(db_instance):
+    """ Set PG* variables for psql and psycopg2 connections to db_instance
+    """
+    os.environ['PGDATABASE'] = os.environ['QA_PGDATABASE_' + db_instance]
+    for i in ['PGHOST', 'PGPORT', 'PGUSER', 'PGPASSWORD']:
+        os.environ[i] = os.environ['QA_' + i]
 
-    script_filename = os.path.join(DB_DIR, script + '.sql')
+
+def load_sql(db_instance, script, retry=0, bulk=False):
+    """load test data <script.sql> into db_instance
+    QA_SQL_SNAPSHOTS=1 enables the snapshots (modules/snapshot.py): the database is cloned from a snapshot
+    if the same file was loaded into the same schema and data before - servers must be stopped, the database
+    is dropped. The db user needs CREATEDB and to own the database (the default create_db_postgres() setup
+    does not grant it), else the file is run.
+    """
+    if os.environ.get('QA_SQL_SNAPSHOTS', '0') != '1':
+        return run_sql(db_instance, script, retry=retry, bulk=bulk)
+
+    set_pg_environment(db_instance)
+    database = os.environ['PGDATABASE']
+    if not snapshots_supported(database):
+        print('SQL snapshots skipped: ' + os.environ['PGUSER'] + ' cannot clone and drop ' + database +
+              ' (needs CREATEDB and database ownership)')
+        return run_sql(db_instance, script, retry=retry, bulk=bulk)
+    script_filename, decompress = sql_script_file(script)
+    key = snapshot_key(database, script_filename, script_tables(script_filename, decompress, TRUNCATE_RE))
+    if not load_snapshot(database, script, key):
+        run_sql(db_instance, script, retry=retry, bulk=bulk)
+        save_snapshot(database, script, key)
+
+
+def run_sql(db_instance, script, return_result=False, retry=0, bulk=False):
+    """run psql <script.sql> on  db_instance (eg '00')
+    compressed <script>.sql.gz / <script>.sql.zst are decompressed on the fly into psql
+    bulk: drop indexes and foreign keys of the tables the script COPYs into for the load and rebuild them
+          after (big data files)
+    """
+
+    script_filename, decompress = sql_script_file(script)
     try:
         open(script_filename)
     except IOError:
         print('Script file ' + script_filename + ' does not exist or not readable')
         raise
 
-    os.environ['PGDATABASE'] = os.environ['QA_PGDATABASE_' + db_instance]
-    for i in ['PGHOST', 'PGPORT', 'PGUSER', 'PGPASSWORD']:
-        os.environ[i] = os.environ['QA_' + i]
-
-    for attempt in range(retry+1):
-        tmp_file = NamedTemporaryFile()
-        output_name = tmp_file.name
-        returncode = call(['sh', '-c', 'psql -v ON_ERROR_STOP=1 -t --no-align --no-psqlrc -0 < ' + script_filename + ' > ' + output_name + ' 2>&1'])
-        read_data = tmp_file.read()
-        read_data = str(read_data, encoding="UTF-8")
-        tmp_file.close()
-        if returncode != 0:
-            if attempt < retry:
-                print("Error: DB script failed (" + DB_DIR + '/' + script + ".sql)" + "\n" + read_data + "\n")
-                raise Exception("Error: DB script failed (" + DB_DIR + '/' + script + ".sql)\n" + read_data)
-            else:
-                continue
-        if return_result:
-            result = []
-            for line in re.split("\0", read_data):
-                if line != '':
-                    # print("DB: ", line)
-                    result.append(re.split("\|", line))
-            return result
-        return
+    set_pg_environment(db_instance)
+
+    psql = 'psql -v ON_ERROR_STOP=1 -t --no-align --no-psqlrc -0'
+    if decompress:
+        # pipefail - a corrupted file must fail even if psql is happy with the truncated input
+        shell = ['bash', '-o', 'pipefail', '-c']
+        command = decompress + ' ' + script_filename + ' | ' + psql
+    else:
+        shell = ['sh', '-c']
+        command = psql + ' < ' + script_filename
+
+    tables = script_tables(script_filename, decompress, COPY_RE) if bulk else []
+    # connection of deferred_indexes() is taken from the PG* variables above
+    with deferred_indexes('', tables) if tables else ExitStack():
+        for attempt in range(retry+1):
+            tmp_file = NamedTemporaryFile()
+            output_name = tmp_file.name
+            returncode = call(shell + [command + ' > ' + output_name + ' 2>&1'])
+            read_data = tmp_file.read()
+            read_data = str(read_data, encoding="UTF-8")
+            tmp_file.close()
+            if returncode != 0:
+                if attempt < retry:
+                    print("Error: DB script failed (" + script_filename + ")" + "\n" + read_data + "\n")
+                    raise Exception("Error: DB script failed (" + script_filename + ")\n" + read_data)
+                else:
+                    continue
+            if return_result:
+                result = []
+                for line in re.split("\0", read_data):
+                    if line != '':
+                        # print("DB: ", line)
+                        result.append(re.split("\|", line))
+                return result
+            return
 
 
 class BaseTestClass():
@@ -113,6 +202,8 @@ class BaseTestClass():
         for _ in range(3):
             if call([cmd, '--kill']) == 0:
                 sleep(2)
+                if PROFILE_DIR:
+                    collect_profiles()
                 return
         raise Exception("Error: Nodes kill failed (" + cmd + " --kill)")
 
@@ -126,6 +217,9 @@ class BaseTestClass():
                     break
             else:
                 raise Exception("Error: Nodes restart failed (" + cmd + ")")
+            # profiles of the processes of the previous test, written when the restart stopped them
+            if PROFILE_DIR:
+                collect_profiles()
             # check if we can connect
             for connect_attempt in range(10, -1, -1):
                 try:
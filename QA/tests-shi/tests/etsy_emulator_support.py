@@ -144,6 +144,45 @@ class EtsyEmulatorInterface(object):
                 error += '\n  Response: ' + r.text
             raise EtsyEmulatorResponseError(error)
 
+    def set_conditions(self, conditions):
+        """ Sets upstream conditions of the emulated Etsy API until the next test case is set
+        (see etsy-emulator/lib/conditions.js), resets their statistics
+
+        :param conditions: dict with optional items
+            latency: {'distribution': 'fixed', 'ms': 200}, 'uniform' (min_ms, max_ms), 'normal' (mean_ms,
+                     stddev_ms), 'exponential' (mean_ms), or a list of them with optional 'method' and 'url' regex
+            errors: list of {'method', 'url', 'rate': 0..1, 'status', 'body'} - injected error responses
+            rate_limit: {'per_second': 10, 'burst': 10, 'limit': 10000} - 429 responses over the rate
+            bandwidth: {'bytes_per_second': N} - shared by all responses
+            {} removes all conditions
+        """
+
+        url = self.etsy_url + '/conditions'
+
+        try:
+            r = requests.post(url, json=conditions)
+        except requests.exceptions.RequestException as e:
+            raise EtsyEmulatorRequestError(str(e))
+
+        if r.status_code != 200:
+            raise EtsyEmulatorResponseError("Error: set conditions on " + url + ": " + r.text)
+
+    def get_conditions(self):
+        """ Get the conditions set on the emulator and statistics of the requests since they were set
+        :return: {'conditions': {...}, 'stats': {'requests', 'latency_ms', 'errors', 'rate_limited', 'bytes'}}
+        """
+
+        url = self.etsy_url + '/conditions'
+
+        try:
+            r = requests.get(url)
+        except requests.exceptions.RequestException as e:
+            raise EtsyEmulatorRequestError(str(e))
+
+        if r.status_code != 200:
+            raise EtsyEmulatorResponseError("Error: get conditions from " + url)
+        return r.json()
+
     def sort_api_calls(self, requests):
         """ Sort API calls to be comparable with test data
 
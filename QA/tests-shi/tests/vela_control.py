@@ -10,24 +10,44 @@ ETSY_CHANNEL_ID = 1
 SHOPIFY_CHANNEL_ID = 2
 
 
-def trigger_etsy_shop_sync(company_id, shop_id, db_name='db1'):
-    """ Triggers immediate synchronization of the shop using Rabbit.
-    Sends syncShop task to manager.
+def etsy_shop_sync_message(company_id, shop_id):
+    """ syncShop task message for the manager
 
     :param company_id: company ID of the user
     :param shop_id: ID of the shop
-    :param channel_id: channel ID of the shop
     """
-
-    message = {
+    return {
         'companyId': str(company_id),
         'channelId': str(ETSY_CHANNEL_ID),
         'operation': 'syncShop',
         'operationData': str(shop_id)
     }
 
+
+def trigger_etsy_shop_sync(company_id, shop_id, db_name='db1'):
+    """ Triggers immediate synchronization of the shop using Rabbit.
+    Sends syncShop task to manager.
+
+    :param company_id: company ID of the user
+    :param shop_id: ID of the shop
+    :param channel_id: channel ID of the shop
+    """
+
+    rabbit = Rabbit()
+    rabbit.publish_to_queue('%s.manager-tasks' % db_name, etsy_shop_sync_message(company_id, shop_id))
+
+
+def trigger_etsy_shops_sync(company_shop_ids, db_name='db1', on_publish=None):
+    """ Triggers synchronization of many shops at once (perf tests), over one Rabbit connection.
+
+    :param company_shop_ids: (company ID, shop ID) of the shops
+    :param on_publish: called with the message after each one is sent
+    """
+
     rabbit = Rabbit()
-    rabbit.publish_to_queue('%s.manager-tasks' % db_name, message)
+    rabbit.publish_all_to_queue('%s.manager-tasks' % db_name,
+                                (etsy_shop_sync_message(company_id, shop_id) for company_id, shop_id in company_shop_ids),
+                                on_publish)
 
 
 def trigger_shopify_shop_sync(user_id, shop_id):
@@ -19,6 +19,7 @@ export default (() => {
     'etsy.auth.accessTokenURL': process.env.ETSY_ACCESS_TOKEN_URL,
     'etsy.auth.userAuthorizationURL': process.env.ETSY_USER_AUTHORIZATION_URL,
     'etsy.apiUrl': process.env.ETSY_API_URL,
+    'etsy.maxListingsInShop': process.env.ETSY_MAX_LISTINGS_IN_SHOP,
 
     'terminateOnDisconnect': process.env.TERMINATE_ON_DISCONNECT, // eslint-disable-line quote-props
 